@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+'''
+Requests/second of the bidding API with and without the connection pool.
+
+Run from the repository root with the sources on the path:
+
+    PYTHONPATH=src python benchmarks/bench_connection_pool.py
+'''
+from auction_db import AuctionDbEndpoint
+from bid_api import get_app, close_app
+
+import argparse
+from datetime import date, datetime, timedelta
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+endpoint_name = "bench"
+key = "BENCHKEY"
+applying_date = date(2021, 3, 5)
+# /get reads a date that /set does not write to,
+# so that every read returns the same amount of data.
+read_date = date(2021, 3, 4)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='''
+    Compare requests/second on /set and /get with and without pooling.
+    ''')
+    parser.add_argument('--requests',
+                        type=int,
+                        default=2000,
+                        help="Number of requests per measurement.")
+    parser.add_argument('--poolsize',
+                        type=int,
+                        default=4,
+                        help="Size of the pool to compare against.")
+    return parser
+
+
+def make_orders(n=24, applying_date=applying_date):
+    return [{
+        "applying_date": applying_date.isoformat(),
+        "hour_ID": h % 24 + 1,
+        "type": "BUY" if h % 2 else "SELL",
+        "volume": "0.5",
+        "price": "40"
+    } for h in range(n)]
+
+
+def measure(client, method, nrequests, **kwargs):
+    start = time.perf_counter()
+    for _ in range(nrequests):
+        r = method(client, **kwargs)
+        assert r.status_code == 200
+    return nrequests / (time.perf_counter() - start)
+
+
+def post_orders(client, orders):
+    return client.post(f"/{endpoint_name}/set",
+                       json={
+                           "key": key,
+                           "orders": orders
+                       })
+
+
+def get_orders(client):
+    return client.get(f"/{endpoint_name}/get",
+                      query_string=dict(key=key,
+                                        applying_date=read_date.isoformat()))
+
+
+def setup(dbfile):
+    bid_db = AuctionDbEndpoint(dbfile)
+    bid_db.write_key(key)
+    ts = datetime.combine(read_date - timedelta(days=1), datetime.min.time())
+    bid_db.write_orders(key, [
+        o | {"timestamp": ts}
+        for o in make_orders(applying_date=read_date)
+    ])
+    bid_db.close()
+
+
+def run(nrequests, pool_size):
+    results = {}
+    orders = make_orders()
+    ts = datetime.combine(applying_date - timedelta(days=1),
+                          datetime.min.time())
+    for size in [0, pool_size]:
+        # A fresh database each time, so that both runs see the same tables.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dbfile = os.path.join(tmpdir, "bench.db")
+            setup(dbfile)
+            app = get_app(dbfile, None, endpoint_name, pool_size=size)
+            with app.test_client() as client, patch("bid_api.get_time",
+                                                     return_value=ts):
+                get_rps = measure(client, get_orders, nrequests)
+                set_rps = measure(client,
+                                  post_orders,
+                                  nrequests,
+                                  orders=orders)
+            close_app(app)
+        results[size] = (set_rps, get_rps)
+    return results
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    results = run(args.requests, args.poolsize)
+    print(f"{'pool size':>10} {'/set req/s':>12} {'/get req/s':>12}")
+    for size, (set_rps, get_rps) in results.items():
+        print(f"{size:>10} {set_rps:>12.1f} {get_rps:>12.1f}")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+'''
+Peak /set throughput with synchronous writes, group commit
+and the ingestion queue, with several concurrent submitters.
+
+    PYTHONPATH=src python benchmarks/bench_ingestion.py
+'''
+from auction_db import AuctionDbEndpoint
+from bid_api import get_app, close_app
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+endpoint_name = "bench"
+applying_date = date(2021, 3, 5)
+submit_time = datetime(2021, 3, 4, 8)
+
+modes = {
+    "sync": dict(pool_size=8),
+    "groupcommit": dict(pool_size=8, group_commit_window=0.002),
+    "queue": dict(pool_size=8, ingestion_queue_size=4096),
+}
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='''
+    Compare /set throughput of the write paths.
+    ''')
+    parser.add_argument('--requests',
+                        type=int,
+                        default=2000,
+                        help="Number of requests per measurement.")
+    parser.add_argument('--threads',
+                        type=int,
+                        default=8,
+                        help="Number of concurrent submitters.")
+    return parser
+
+
+def make_orders(n=24):
+    return [{
+        "applying_date": applying_date.isoformat(),
+        "hour_ID": h % 24 + 1,
+        "type": "BUY" if h % 2 else "SELL",
+        "volume": "0.5",
+        "price": "40"
+    } for h in range(n)]
+
+
+def run_mode(kwargs, nrequests, nthreads):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dbfile = os.path.join(tmpdir, "bench.db")
+        keys = [f"KEY{i}" for i in range(nthreads)]
+        bid_db = AuctionDbEndpoint(dbfile)
+        for key in keys:
+            bid_db.write_key(key)
+        bid_db.close()
+
+        app = get_app(dbfile, None, endpoint_name, **kwargs)
+        orders = make_orders()
+
+        def submitter(key):
+            with app.test_client() as client:
+                for _ in range(nrequests // nthreads):
+                    r = client.post(f"/{endpoint_name}/set",
+                                    json={
+                                        "key": key,
+                                        "orders": orders
+                                    })
+                    assert r.status_code == 200
+
+        with patch("bid_api.get_time", return_value=submit_time):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(nthreads) as executor:
+                list(executor.map(submitter, keys))
+            accepted = time.perf_counter() - start
+            if app.extensions["ingestion_queue"] is not None:
+                app.extensions["ingestion_queue"].join()
+            persisted = time.perf_counter() - start
+        close_app(app)
+        n = (nrequests // nthreads) * nthreads
+        return n / accepted, n / persisted
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    print(f"{'mode':>12} {'accepted req/s':>15} {'persisted req/s':>16}")
+    for name, kwargs in modes.items():
+        accepted, persisted = run_mode(kwargs, args.requests, args.threads)
+        print(f"{name:>12} {accepted:>15.1f} {persisted:>16.1f}")
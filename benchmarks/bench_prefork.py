@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+'''
+Requests/second of bidding_api.py with 1, 2, 4, ... prefork workers.
+
+For each number of workers, the server is started on a fresh WAL
+database and load_generator.py is run from several client processes
+at once (one client process is not enough to load many workers: it has
+its own GIL). Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/bench_prefork.py --duration 10
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+programs = os.path.join(os.path.dirname(here), "programs")
+sys.path.insert(0, programs)
+
+from load_generator import key_names, provision_keys, start_server  # noqa
+
+endpoint_name = "bench"
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='''
+    Measure how the throughput of /set and /get scales with the number
+    of prefork workers.
+    ''')
+    cpus = os.cpu_count() or 1
+    parser.add_argument('--workers',
+                        type=int,
+                        nargs='+',
+                        default=[n for n in [1, 2, 4, 8, 16] if n <= cpus],
+                        help="Numbers of workers to compare"
+                        " (default: powers of 2 up to the number of cores).")
+    parser.add_argument('--clients',
+                        type=int,
+                        default=max(2, cpus // 2),
+                        help="Load generator processes.")
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=8,
+                        help="Connections per load generator process.")
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--getfraction', type=float, default=0.5)
+    parser.add_argument('--participants', type=int, default=50)
+    parser.add_argument('--port', type=int, default=5051)
+    parser.add_argument('--serverargs',
+                        type=str,
+                        default="--busytimeoutms 5000 --poolsize 4",
+                        help="Extra arguments for bidding_api.py.")
+    parser.add_argument('--output',
+                        type=str,
+                        default=None,
+                        help="File where to write the JSON results.")
+    return parser
+
+
+def run_clients(args, dbfile, url, tmpdir):
+    '''
+    The reports of the load generator processes, run at the same time.
+    '''
+    processes = []
+    for i in range(args.clients):
+        output = os.path.join(tmpdir, f"client-{i}.json")
+        command = [
+            sys.executable,
+            os.path.join(programs, "load_generator.py"), "--dbfile", dbfile,
+            "--endpointname", endpoint_name, "--url", url, "--participants",
+            str(args.participants), "--concurrency",
+            str(args.concurrency), "--duration",
+            str(args.duration), "--getfraction",
+            str(args.getfraction), "--seed",
+            str(i), "--output", output
+        ]
+        processes.append((subprocess.Popen(command,
+                                           stdout=subprocess.DEVNULL), output))
+    reports = []
+    for process, output in processes:
+        if process.wait() != 0:
+            raise RuntimeError("A load generator failed.")
+        with open(output) as f:
+            reports.append(json.load(f))
+    return reports
+
+
+def combine(reports):
+    res = {}
+    for route in ["set", "get"]:
+        routes = [r["routes"][route] for r in reports]
+        requests = sum(r["requests"] for r in routes)
+        res[route] = {
+            "requests": requests,
+            "errors": requests - sum(r["ok"] for r in routes),
+            "throughput_per_s": sum(r["throughput_per_s"] for r in routes),
+            # The worst client, rather than a mean of percentiles.
+            "p99_ms": max((r["p99_ms"] for r in routes
+                           if r["p99_ms"] is not None),
+                          default=None),
+        }
+    return res
+
+
+def measure(args, workers):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dbfile = os.path.join(tmpdir, "bench.db")
+        provision_keys(dbfile, key_names(args.participants))
+        url = f"http://127.0.0.1:{args.port}"
+        server_args = argparse.Namespace(
+            url=url,
+            dbfile=dbfile,
+            endpointname=endpoint_name,
+            serverargs=(f"--workers {workers} --journalmode WAL "
+                        f"{args.serverargs}"))
+        server = start_server(server_args, os.path.join(tmpdir, "server.log"))
+        try:
+            return combine(run_clients(args, dbfile, url, tmpdir))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    results = {}
+    print(f"{'workers':>7} {'route':>5} {'req/s':>9} {'speedup':>8}"
+          f" {'p99 ms':>8} {'errors':>7}")
+    for workers in args.workers:
+        results[workers] = measure(args, workers)
+        for route, r in results[workers].items():
+            base = results[args.workers[0]][route]["throughput_per_s"]
+            p99 = (f"{r['p99_ms']:8.1f}"
+                   if r["p99_ms"] is not None else f"{'-':>8}")
+            print(f"{workers:7d} {route:>5} {r['throughput_per_s']:9.1f}"
+                  f" {r['throughput_per_s'] / base:8.2f} {p99}"
+                  f" {r['errors']:7d}")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "config": vars(args),
+                    "cpu_count": os.cpu_count(),
+                    "results": results
+                },
+                f,
+                indent=2)
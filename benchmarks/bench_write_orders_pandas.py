@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''
+Bulk upload of a DataFrame of orders: the columnar write_orders_pandas
+against the per-record path (pandas_orders_to_records + write_orders).
+
+    PYTHONPATH=src python benchmarks/bench_write_orders_pandas.py
+'''
+from auction_db import AuctionDbEndpoint
+import converter
+
+import argparse
+from datetime import date, datetime, timedelta
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+key = "BENCHKEY"
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='''
+    Compare the two ways of writing a DataFrame of orders.
+    ''')
+    parser.add_argument('--orders',
+                        type=int,
+                        nargs='+',
+                        default=[10000, 50000],
+                        help="Sizes of the DataFrames to upload.")
+    return parser
+
+
+def make_orders(n, seed=0):
+    rng = np.random.default_rng(seed)
+    first_day = date(2021, 3, 1)
+    applying = [
+        first_day + timedelta(days=int(d)) for d in rng.integers(0, 30, n)
+    ]
+    return pd.DataFrame({
+        "hour_ID": rng.integers(1, 25, n),
+        "applying_date": applying,
+        "timestamp": pd.Timestamp(datetime(2021, 2, 27, 8)),
+        "volume": rng.uniform(0, 2, n),
+        "price": rng.uniform(20, 80, n),
+        "type": rng.choice(["BUY", "SELL"], n),
+    })
+
+
+def records_path(bid_db, df):
+    return bid_db.write_orders(key, converter.pandas_orders_to_records(df))
+
+
+def frame_path(bid_db, df):
+    return bid_db.write_orders_pandas(key, df)
+
+
+def measure(write, df):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bid_db = AuctionDbEndpoint(os.path.join(tmpdir, "bench.db"))
+        bid_db.write_key(key)
+        start = time.perf_counter()
+        nwritten, _message = write(bid_db, df)
+        elapsed = time.perf_counter() - start
+        bid_db.close()
+    assert nwritten == len(df)
+    return elapsed
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    print(f"{'orders':>8} {'records s':>10} {'columnar s':>11} {'speedup':>8}")
+    for n in args.orders:
+        df = make_orders(n)
+        t_records = measure(records_path, df)
+        t_frame = measure(frame_path, df)
+        print(f"{n:>8} {t_records:>10.3f} {t_frame:>11.3f}"
+              f" {t_records / t_frame:>8.1f}")
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+'''
+Benchmarks of the database and API hot paths on synthetic data,
+with the results written as JSON to compare between releases.
+
+    PYTHONPATH=src python benchmarks/run_suite.py --output results.json
+'''
+from auction_db import AuctionDbEndpoint
+from bid_api import get_app, close_app
+import converter
+import synthetic
+from timeseries import TimeSeriesStore
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+endpoint_name = "bench"
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='''
+    Run the benchmark suite and write the results as JSON.
+    ''')
+    parser.add_argument('--participants', type=int, default=20)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--ordersperhour',
+                        type=int,
+                        default=5,
+                        help="Orders per participant per hour.")
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=50,
+                        help="Measurements per benchmark.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only',
+                        type=str,
+                        nargs='+',
+                        default=None,
+                        help="Run only these benchmarks.")
+    parser.add_argument('--output',
+                        type=str,
+                        default=None,
+                        help="File where to write the JSON results"
+                        " (default: standard output).")
+    return parser
+
+
+def summarize(durations, items):
+    durations = sorted(durations)
+    return {
+        "repeat": len(durations),
+        "min_s": durations[0],
+        "median_s": statistics.median(durations),
+        "mean_s": statistics.fmean(durations),
+        "p95_s": durations[min(len(durations) - 1,
+                               int(0.95 * len(durations)))],
+        "max_s": durations[-1],
+        "items_per_call": items,
+        "items_per_s": items / statistics.median(durations),
+    }
+
+
+def measure(f, repeat, setup=None):
+    '''
+    Time f(setup()) repeat times; setup is not timed.
+    '''
+    durations = []
+    for i in range(repeat):
+        arg = setup(i) if setup is not None else None
+        start = time.perf_counter()
+        f(arg)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+class Suite:
+
+    def __init__(self, dbfile, args):
+        self.args = args
+        self.rng = np.random.default_rng(args.seed)
+        self.bid_db = AuctionDbEndpoint(dbfile)
+        self.keys, self.dates = synthetic.populate(self.bid_db, self.rng,
+                                                   args.participants,
+                                                   args.days,
+                                                   args.ordersperhour)
+        # days with no orders yet, for the writes
+        self.new_dates = synthetic.days(args.repeat,
+                                        start=self.dates[-1] +
+                                        timedelta(days=1))
+        self.app = get_app(dbfile, None, endpoint_name, pool_size=4)
+        self.client = self.app.test_client()
+        # A separate endpoint, so that the writes do not update the store.
+        store = TimeSeriesStore(os.path.join(os.path.dirname(dbfile),
+                                             "timeseries"),
+                                epoch=self.dates[0])
+        self.timeseries_db = AuctionDbEndpoint(dbfile, timeseries=store)
+        self.timeseries_db.rebuild_timeseries()
+
+    def close(self):
+        close_app(self.app)
+        self.bid_db.close()
+        self.timeseries_db.close()
+
+    def new_orders(self, i):
+        return synthetic.make_orders(self.rng, [self.new_dates[i]],
+                                     self.args.ordersperhour)
+
+    def writer_key(self, i):
+        '''
+        The key of the i-th benchmark writing orders (shared
+        when there are fewer participants than such benchmarks).
+        '''
+        return self.keys[i % len(self.keys)]
+
+    def bench_write_orders(self):
+        orders_per_call = 24 * self.args.ordersperhour
+        durations = measure(
+            lambda records: self.bid_db.write_orders(self.writer_key(0),
+                                                     records),
+            self.args.repeat,
+            lambda i: converter.pandas_orders_to_records(self.new_orders(i)))
+        return summarize(durations, orders_per_call)
+
+    def bench_write_orders_pandas(self):
+        orders_per_call = 24 * self.args.ordersperhour
+        durations = measure(
+            lambda df: self.bid_db.write_orders_pandas(self.writer_key(1), df),
+            self.args.repeat, self.new_orders)
+        return summarize(durations, orders_per_call)
+
+    def random_key_and_date(self, _i):
+        return (self.keys[self.rng.integers(len(self.keys))],
+                self.dates[self.rng.integers(len(self.dates))])
+
+    def bench_read_orders(self):
+        durations = measure(lambda kd: self.bid_db.read_orders(*kd),
+                            self.args.repeat, self.random_key_and_date)
+        return summarize(durations, 24 * self.args.ordersperhour)
+
+    def bench_write_market_index(self):
+        # replaces one stored day, so that its orders are cleared again
+        durations = measure(
+            self.bid_db.write_market_index, self.args.repeat, lambda i:
+            synthetic.make_market_index(self.rng, [self.dates[i % len(
+                self.dates)]]))
+        return summarize(durations, 48)
+
+    def bench_read_api_data(self):
+        durations = measure(
+            lambda _: self.bid_db._read_api_data(
+                self.dates[0], self.dates[-1] + timedelta(days=1),
+                "market_index"), self.args.repeat)
+        return summarize(durations, 48 * len(self.dates))
+
+    def bench_read_market_index_numpy(self):
+        durations = measure(
+            lambda _: self.timeseries_db.read_market_index(
+                self.dates[0],
+                self.dates[-1] + timedelta(days=1),
+                output="numpy"), self.args.repeat)
+        return summarize(durations, 48 * len(self.dates))
+
+    def bench_api_set(self):
+        submit_time = datetime.combine(self.new_dates[0] - timedelta(days=1),
+                                       datetime.min.time())
+
+        def post(orders):
+            r = self.client.post(f"/{endpoint_name}/set",
+                                 json={
+                                     "key": self.writer_key(2),
+                                     "orders": orders
+                                 })
+            assert r.status_code == 200
+
+        def setup(i):
+            df = self.new_orders(i)
+            df = df.drop(columns=["timestamp"])
+            df["applying_date"] = pd.to_datetime(
+                df["applying_date"]).dt.strftime("%Y-%m-%d")
+            return df.to_dict("records")
+
+        with patch("bid_api.get_time", return_value=submit_time):
+            durations = measure(post, self.args.repeat, setup)
+        return summarize(durations, 24 * self.args.ordersperhour)
+
+    def bench_api_get(self):
+
+        def get(kd):
+            key, applying_date = kd
+            r = self.client.get(f"/{endpoint_name}/get",
+                                query_string=dict(
+                                    key=key,
+                                    applying_date=applying_date.isoformat()))
+            assert r.status_code == 200
+
+        durations = measure(get, self.args.repeat, self.random_key_and_date)
+        return summarize(durations, 24 * self.args.ordersperhour)
+
+
+# The order matters: the writes add orders for the days after the
+# populated ones, which the reads do not look at.
+benchmarks = {
+    "read_orders": Suite.bench_read_orders,
+    "_read_api_data": Suite.bench_read_api_data,
+    "read_market_index_numpy": Suite.bench_read_market_index_numpy,
+    "api_get": Suite.bench_api_get,
+    "write_market_index": Suite.bench_write_market_index,
+    "write_orders": Suite.bench_write_orders,
+    "write_orders_pandas": Suite.bench_write_orders_pandas,
+    "api_set": Suite.bench_api_set,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = {
+        "metadata": {
+            "time": datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "scale": {
+                "participants": args.participants,
+                "days": args.days,
+                "orders_per_hour": args.ordersperhour,
+                "repeat": args.repeat,
+                "seed": args.seed,
+            },
+        },
+        "benchmarks": {},
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        start = time.perf_counter()
+        suite = Suite(os.path.join(tmpdir, "bench.db"), args)
+        results["metadata"]["setup_s"] = time.perf_counter() - start
+        try:
+            for name, bench in benchmarks.items():
+                if args.only is None or name in args.only:
+                    results["benchmarks"][name] = bench(suite)
+        finally:
+            suite.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = make_parser()
+    args = parser.parse_args()
+    if args.participants < 1 or args.days < 1:
+        parser.error("--participants and --days must be at least 1.")
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
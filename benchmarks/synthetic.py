@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+'''
+Synthetic data for the benchmarks, at a configurable scale.
+Everything is generated from a seed, so that runs are reproducible.
+'''
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+
+first_day = date(2021, 1, 1)
+
+
+def make_keys(participants):
+    return [f"PARTICIPANT{i:04d}" for i in range(participants)]
+
+
+def days(ndays, start=first_day):
+    return [start + timedelta(days=i) for i in range(ndays)]
+
+
+def make_orders(rng, applying_dates, orders_per_hour):
+    '''
+    orders_per_hour orders for each hour of each of the applying_dates,
+    all submitted in time (at 08:00 the day before).
+    '''
+    applying = np.repeat(np.array(applying_dates, dtype=object),
+                         24 * orders_per_hour)
+    n = len(applying)
+    hours = np.tile(np.repeat(np.arange(1, 25), orders_per_hour),
+                    len(applying_dates))
+    timestamps = [
+        datetime.combine(d - timedelta(days=1), time(8)) for d in applying
+    ]
+    return pd.DataFrame({
+        "hour_ID": hours,
+        "applying_date": applying,
+        "timestamp": pd.to_datetime(timestamps),
+        "volume": rng.uniform(0, 2, n).round(3),
+        "price": rng.uniform(20, 80, n).round(2),
+        "type": rng.choice(["BUY", "SELL"], n),
+    })
+
+
+def make_market_index(rng, dates):
+    '''
+    In the format returned by query_bmrs.get_market_index_converted.
+    '''
+    n = 48 * len(dates)
+    return pd.DataFrame({
+        "Settlement Date": np.repeat(np.array(dates, dtype=object), 48),
+        "Settlement Period": np.tile(np.arange(1, 49), len(dates)),
+        "Price": rng.uniform(20, 80, n).round(2),
+        "Volume": rng.uniform(100, 2000, n).round(1),
+    })
+
+
+def make_imbalance_prices(rng, dates):
+    '''
+    In the format returned by query_bmrs.get_imbalance_prices.
+    '''
+    n = 48 * len(dates)
+    return pd.DataFrame({
+        "SettlementDate": np.repeat(np.array(dates, dtype=object), 48),
+        "SettlementPeriod": np.tile(np.arange(1, 49), len(dates)),
+        "ImbalancePriceAmount": rng.uniform(-20, 120, n).round(2),
+    })
+
+
+def populate(bid_db, rng, participants, ndays, orders_per_hour):
+    '''
+    Fill bid_db with keys, orders, market index and imbalance prices.
+    Returns the keys and the days.
+    '''
+    keys = make_keys(participants)
+    dates = days(ndays)
+    for key in keys:
+        bid_db.write_key(key)
+    bid_db.write_market_index(make_market_index(rng, dates))
+    bid_db.write_imbalance_prices(make_imbalance_prices(rng, dates))
+    for key in keys:
+        bid_db.write_orders_pandas(key,
+                                   make_orders(rng, dates, orders_per_hour))
+    return keys, dates
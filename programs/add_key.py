@@ -24,6 +24,10 @@ def make_parser():
                         type=str,
                         help="File where to store logs.")
 
+    parser.add_argument('--revoke',
+                        action='store_true',
+                        help="Remove the key instead of adding it.")
+
     return parser
 
 
@@ -40,4 +44,7 @@ if __name__ == "__main__":
 
     bid_db = AuctionDbEndpoint(database_file, logger=logger)
 
-    bid_db.write_key(key)
+    if args.revoke:
+        bid_db.revoke_key(key)
+    else:
+        bid_db.write_key(key)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+from archive import Archive
+from auction_db import AuctionDbEndpoint
+from loggers import get_logger, set_global_handler
+import argparse
+from datetime import date, timedelta
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='''
+    Move the orders, market index and imbalance prices of the settled days
+    to compressed Parquet files, then vacuum the database.
+    ''')
+
+    parser.add_argument('--dbfile',
+                        type=str,
+                        required=True,
+                        help="File to use for the sqlite database.")
+
+    parser.add_argument('--logfile',
+                        required=True,
+                        type=str,
+                        help="File where to store logs.")
+
+    parser.add_argument('--archivedir',
+                        required=True,
+                        type=str,
+                        help="Directory of the archive.")
+
+    parser.add_argument('--keepdays',
+                        type=int,
+                        default=30,
+                        help="Keep this many days before today"
+                        " in the database.")
+
+    parser.add_argument('--novacuum',
+                        action='store_true',
+                        help="Do not vacuum the database afterwards.")
+
+    return parser
+
+
+if __name__ == "__main__":
+    parser = make_parser()
+    args = parser.parse_args()
+
+    set_global_handler(args.logfile)
+    logger = get_logger("MAIN")
+
+    bid_db = AuctionDbEndpoint(args.dbfile,
+                               logger=logger,
+                               archive=Archive(args.archivedir))
+    try:
+        before = date.today() - timedelta(days=args.keepdays)
+        narchived = bid_db.archive_settled(before, vacuum=not args.novacuum)
+        print(f"Archived the days before {before}:", narchived)
+    finally:
+        bid_db.close()
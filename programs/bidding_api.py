@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
-from loggers import get_logger, set_global_handler
-from bid_api import get_app
+from loggers import get_logger, set_global_handler, stop_listener
+from auction_db import AuctionDbEndpoint
+from bid_api import get_app, close_app
+from prefork import PreforkServer
 
 import argparse
+import signal
 from flask_socketio import SocketIO
 import eventlet
 
@@ -27,30 +30,203 @@ def make_parser():
                         type=str,
                         help="The endpoint will be '/endpointname'.")
 
+    parser.add_argument('--jsonlogs',
+                        action='store_true',
+                        help="Write the logs as JSON lines.")
+
     parser.add_argument('--port',
                         required=True,
                         type=str,
                         help="The port to run the webserver on.")
 
+    parser.add_argument('--poolsize',
+                        type=int,
+                        default=8,
+                        help="Number of pooled database connections"
+                        " (0 disables pooling).")
+
+    parser.add_argument('--workers',
+                        type=int,
+                        default=0,
+                        help="Serve with this many prefork worker processes"
+                        " sharing the port and the database (default: 0,"
+                        " a single eventlet process). SIGHUP restarts"
+                        " them gracefully. Each worker has its own"
+                        " /metrics counters and caches; it cannot be used"
+                        " with --ingestionqueuesize.")
+
+    parser.add_argument('--gracefultimeout',
+                        type=float,
+                        default=30,
+                        help="Seconds a stopping worker has to finish"
+                        " its requests.")
+
+    parser.add_argument('--busytimeoutms',
+                        type=float,
+                        default=None,
+                        help="How long a connection waits for the database"
+                        " locks held by others (default: the sqlite3"
+                        " module's 5 s).")
+
+    parser.add_argument('--readpoolsize',
+                        type=int,
+                        default=0,
+                        help="Number of pooled read-only connections for the"
+                        " order reads (0: reads share the pool above);"
+                        " needs the WAL journal mode.")
+
+    parser.add_argument('--journalmode',
+                        type=str,
+                        default=None,
+                        choices=["DELETE", "WAL"],
+                        help="sqlite journal mode (default: leave as is).")
+
+    parser.add_argument('--synchronous',
+                        type=str,
+                        default=None,
+                        choices=["OFF", "NORMAL", "FULL", "EXTRA"],
+                        help="sqlite synchronous level"
+                        " (default: the sqlite default).")
+
+    parser.add_argument('--groupcommitms',
+                        type=float,
+                        default=None,
+                        help="Commit together the orders submitted"
+                        " within this many milliseconds (default: off).")
+
+    parser.add_argument('--keycachesize',
+                        type=int,
+                        default=1024,
+                        help="Number of API keys to cache in memory"
+                        " (0 disables the cache).")
+
+    parser.add_argument('--marketcachesize',
+                        type=int,
+                        default=64,
+                        help="Days of market index cached in each process"
+                        " to clear the orders submitted (0 disables it).")
+
+    parser.add_argument('--ingestionqueuesize',
+                        type=int,
+                        default=0,
+                        help="Answer /set with a receipt and write the orders"
+                        " in the background, queueing at most this many"
+                        " submissions (default: 0, synchronous writes)."
+                        " The receipts are kept in memory, so not with"
+                        " --workers.")
+
+    parser.add_argument('--adminkey',
+                        type=str,
+                        default=None,
+                        help="Key allowed to read the orders of all the"
+                        " participants at /get_bulk.")
+
+    parser.add_argument('--archivedir',
+                        type=str,
+                        default=None,
+                        help="Directory of the archive of the settled days"
+                        " (see archive_settled.py), read when they are"
+                        " asked for.")
+
+    parser.add_argument('--nometrics',
+                        action='store_true',
+                        help="Do not collect the timings and counters"
+                        " served at /metrics (those of the worker"
+                        " answering, with --workers).")
+
+    parser.add_argument('--sqlslowms',
+                        type=float,
+                        default=None,
+                        help="Trace the SQL statements and log those taking"
+                        " longer than this many milliseconds; SIGUSR1 logs"
+                        " the per statement summary (default: off).")
+
     return parser
 
 
 if __name__ == "__main__":
     parser = make_parser()
     args = parser.parse_args()
+    if args.workers and args.ingestionqueuesize:
+        # A receipt could be polled on another worker than the one
+        # holding it.
+        parser.error("--ingestionqueuesize cannot be used with --workers.")
 
     database_file = args.dbfile
     logfile = args.logfile
     endpoint_name = args.endpointname
     port = args.port
+    pool_size = args.poolsize
+    group_commit_window = (args.groupcommitms / 1000
+                           if args.groupcommitms is not None else None)
+    sql_slow_threshold = (args.sqlslowms / 1000
+                          if args.sqlslowms is not None else None)
+
+    busy_timeout = (args.busytimeoutms / 1000
+                    if args.busytimeoutms is not None else None)
+
+    def make_app(logger):
+        app = get_app(database_file,
+                      logger,
+                      endpoint_name,
+                      pool_size=pool_size,
+                      journal_mode=args.journalmode,
+                      synchronous=args.synchronous,
+                      group_commit_window=group_commit_window,
+                      key_cache_size=args.keycachesize,
+                      market_cache_size=args.marketcachesize,
+                      ingestion_queue_size=args.ingestionqueuesize,
+                      enable_metrics=not args.nometrics,
+                      sql_slow_threshold=sql_slow_threshold,
+                      admin_key=args.adminkey,
+                      read_pool_size=args.readpoolsize,
+                      busy_timeout=busy_timeout,
+                      archive_dir=args.archivedir)
+
+        tracer = app.extensions["sql_tracer"]
+        if tracer is not None:
+            signal.signal(
+                signal.SIGUSR1, lambda signum, frame: logger.info(
+                    "SQL statements summary:\n%s", tracer.dump()))
+        return app
+
+    if args.workers:
+        set_global_handler(logfile, json_format=args.jsonlogs)
+        logger = get_logger("MASTER")
+
+        # Create or migrate the database once, before the workers start.
+        bid_db = AuctionDbEndpoint(database_file, logger=logger)
+        bid_db.set_durability(args.journalmode)
+        bid_db.close()
+
+        def make_worker_app():
+            # The log listener thread of the master is not forked.
+            set_global_handler(logfile, json_format=args.jsonlogs)
+            return make_app(get_logger("WORKER"))
+
+        def on_worker_exit(app):
+            if app is not None:  # None if make_worker_app failed
+                close_app(app)
+            stop_listener()
+
+        server = PreforkServer(make_worker_app,
+                               port=int(port),
+                               workers=args.workers,
+                               logger=logger,
+                               graceful_timeout=args.gracefultimeout,
+                               on_exit=on_worker_exit)
+        server.serve_forever()
+    else:
+        # Before the pool is created,
+        # so that its queue and locks are greenlet-aware.
+        eventlet.monkey_patch()
 
-    set_global_handler(logfile)
-    logger = get_logger("MAIN")
+        set_global_handler(logfile, json_format=args.jsonlogs)
+        logger = get_logger("MAIN")
 
-    app = get_app(database_file, logger, endpoint_name)
+        app = make_app(logger)
 
-    eventlet.monkey_patch()
-    socketio = SocketIO()
+        socketio = SocketIO()
 
-    socketio.init_app(app,port=port)
-    socketio.run(app,host="0.0.0.0" )
+        socketio.init_app(app,port=port)
+        socketio.run(app, host="0.0.0.0", port=int(port))
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+'''
+Load generator for the bidding endpoint of bidding_api.py.
+
+Provisions the keys of N participants in the database, then sends
+/set requests with a day of orders and /get requests for them, either
+from a fixed number of clients (closed loop, optionally paced to a target
+rate) or with arrivals that do not wait for the responses (open loop,
+constant or Poisson). Reports throughput, errors and latency percentiles.
+'''
+from auction_db import AuctionDbEndpoint
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dtime, timedelta
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='''
+    Generate load against the /set and /get routes of the bidding API.
+    ''')
+
+    parser.add_argument('--dbfile',
+                        type=str,
+                        required=True,
+                        help="sqlite database of the server,"
+                        " where the keys are provisioned.")
+
+    parser.add_argument('--endpointname',
+                        required=True,
+                        type=str,
+                        help="The endpoint is '/endpointname'.")
+
+    parser.add_argument('--url',
+                        type=str,
+                        default="http://127.0.0.1:5000",
+                        help="Base URL of the server.")
+
+    parser.add_argument('--startserver',
+                        action='store_true',
+                        help="Start bidding_api.py locally on the port"
+                        " of --url for the duration of the run.")
+
+    parser.add_argument('--serverargs',
+                        type=str,
+                        default="",
+                        help="Extra arguments for bidding_api.py,"
+                        " e.g. '--journalmode WAL --groupcommitms 5'.")
+
+    parser.add_argument('--participants',
+                        type=int,
+                        default=50,
+                        help="Number of keys to provision and use.")
+
+    parser.add_argument('--ordersperhour',
+                        type=int,
+                        default=4,
+                        help="Orders per hour in each /set request.")
+
+    parser.add_argument('--getfraction',
+                        type=float,
+                        default=0.2,
+                        help="Fraction of the requests that are /get.")
+
+    parser.add_argument('--mode',
+                        type=str,
+                        default="closed",
+                        choices=["closed", "open"],
+                        help="closed: --concurrency clients each waiting for"
+                        " their response; open: requests start at --rate"
+                        " whatever the response times.")
+
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=8,
+                        help="Number of clients in closed loop; maximum"
+                        " number of requests in flight in open loop.")
+
+    parser.add_argument('--rate',
+                        type=float,
+                        default=None,
+                        help="Target requests per second (required in open"
+                        " loop; default in closed loop: as fast as possible).")
+
+    parser.add_argument('--arrival',
+                        type=str,
+                        default="poisson",
+                        choices=["constant", "poisson"],
+                        help="Spacing of the open loop arrivals.")
+
+    parser.add_argument('--duration',
+                        type=float,
+                        default=30,
+                        help="Seconds to generate load for.")
+
+    parser.add_argument('--deadline',
+                        type=str,
+                        default="09:00",
+                        help="order_deadline of the server (HH:MM), to pick"
+                        " an applying date the orders are in time for.")
+
+    parser.add_argument('--seed', type=int, default=0)
+
+    parser.add_argument('--output',
+                        type=str,
+                        default=None,
+                        help="File where to write the report as JSON.")
+
+    return parser
+
+
+def key_names(participants):
+    return [f"LOADTEST{i:05d}" for i in range(participants)]
+
+
+def provision_keys(dbfile, keys):
+    bid_db = AuctionDbEndpoint(dbfile)
+    try:
+        for key in keys:
+            bid_db.write_key(key)
+    finally:
+        bid_db.close()
+
+
+def next_applying_date(now, deadline):
+    '''
+    The first day orders submitted now are in time for.
+    '''
+    days = 1 if now.time() < deadline else 2
+    return (now + timedelta(days=days)).date()
+
+
+def make_orders(rng, applying_date, orders_per_hour):
+    '''
+    Bids and offers around a market price changing over the day.
+    '''
+    orders = []
+    for hour_ID in range(1, 25):
+        reference = 40 + 25 * (8 <= hour_ID <= 20)
+        for _ in range(orders_per_hour):
+            orders.append({
+                "hour_ID": hour_ID,
+                "applying_date": applying_date.isoformat(),
+                "type": rng.choice(["BUY", "SELL"]),
+                "volume": round(rng.uniform(0.1, 5), 3),
+                "price": round(rng.gauss(reference, 10), 2),
+            })
+    return orders
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class Recorder:
+    '''
+    Latencies and errors per route, shared by the client threads.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {"set": [], "get": []}
+        self.errors = {"set": {}, "get": {}}
+
+    def record(self, route, latency, error=None):
+        with self._lock:
+            if error is None:
+                self.latencies[route].append(latency)
+            else:
+                self.errors[route][error] = (
+                    self.errors[route].get(error, 0) + 1)
+
+    def report(self, elapsed):
+        report = {"elapsed_s": elapsed, "routes": {}}
+        for route in ["set", "get"]:
+            ordered = sorted(self.latencies[route])
+            nerrors = sum(self.errors[route].values())
+            total = len(ordered) + nerrors
+            report["routes"][route] = {
+                "requests": total,
+                "ok": len(ordered),
+                "errors": dict(self.errors[route]),
+                "error_rate": nerrors / total if total else None,
+                "throughput_per_s": len(ordered) / elapsed,
+                "p50_ms": _ms(percentile(ordered, 50)),
+                "p95_ms": _ms(percentile(ordered, 95)),
+                "p99_ms": _ms(percentile(ordered, 99)),
+                "max_ms": _ms(ordered[-1] if ordered else None),
+            }
+        return report
+
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+
+class LoadGenerator:
+
+    def __init__(self, args, keys):
+        self.args = args
+        self.keys = keys
+        self.base = f"{args.url.rstrip('/')}/{args.endpointname}"
+        self.deadline = dtime.fromisoformat(args.deadline)
+        self.recorder = Recorder()
+        self._local = threading.local()
+
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def make_request(self, rng):
+        '''
+        (route, payload) of a random request.
+        '''
+        key = rng.choice(self.keys)
+        applying_date = next_applying_date(datetime.now(), self.deadline)
+        if rng.random() < self.args.getfraction:
+            return "get", {
+                "key": key,
+                "applying_date": applying_date.isoformat()
+            }
+        return "set", {
+            "key": key,
+            "orders": make_orders(rng, applying_date,
+                                  self.args.ordersperhour)
+        }
+
+    def send(self, route, payload, intended_start=None):
+        '''
+        Latencies in open loop are counted from when the request
+        was due, so that a slow server is not hidden by requests
+        starting late.
+        '''
+        start = (intended_start
+                 if intended_start is not None else time.perf_counter())
+        error = None
+        try:
+            if route == "set":
+                r = self.session().post(f"{self.base}/set", json=payload)
+            else:
+                r = self.session().get(f"{self.base}/get", params=payload)
+            if r.status_code != 200:
+                error = f"HTTP {r.status_code}"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        self.recorder.record(route, time.perf_counter() - start, error)
+
+    def run_closed(self):
+        stop_at = time.perf_counter() + self.args.duration
+        interval = (self.args.concurrency / self.args.rate
+                    if self.args.rate else 0)
+
+        def client(i):
+            rng = random.Random(self.args.seed * 1000 + i)
+            next_start = time.perf_counter()
+            while next_start < stop_at:
+                delay = next_start - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self.send(*self.make_request(rng))
+                if interval:
+                    next_start += interval
+                else:
+                    next_start = time.perf_counter()
+
+        threads = [
+            threading.Thread(target=client, args=(i, ))
+            for i in range(self.args.concurrency)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def run_open(self):
+        rng = random.Random(self.args.seed)
+        start = time.perf_counter()
+        stop_at = start + self.args.duration
+        due = start
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            while due < stop_at:
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                route, payload = self.make_request(rng)
+                pool.submit(self.send, route, payload, due)
+                if self.args.arrival == "poisson":
+                    due += rng.expovariate(self.args.rate)
+                else:
+                    due += 1 / self.args.rate
+
+    def run(self):
+        start = time.perf_counter()
+        if self.args.mode == "open":
+            self.run_open()
+        else:
+            self.run_closed()
+        return self.recorder.report(time.perf_counter() - start)
+
+
+def wait_for_port(host, port, timeout=30, process=None):
+    stop_at = time.monotonic() + timeout
+    while time.monotonic() < stop_at:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(
+                f"Server exited with code {process.returncode}.")
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Server not listening on {host}:{port}"
+                       f" after {timeout}s.")
+
+
+def start_server(args, logfile):
+    url = requests.utils.urlparse(args.url)
+    here = os.path.dirname(os.path.abspath(__file__))
+    src = os.path.join(os.path.dirname(here), "src")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in [src, env.get("PYTHONPATH")] if p)
+    server = subprocess.Popen([
+        sys.executable,
+        os.path.join(here, "bidding_api.py"), "--dbfile", args.dbfile,
+        "--logfile", logfile, "--endpointname", args.endpointname, "--port",
+        str(url.port or 80)
+    ] + shlex.split(args.serverargs),
+                              env=env)
+    try:
+        wait_for_port(url.hostname, url.port or 80, process=server)
+    except (TimeoutError, RuntimeError):
+        server.terminate()
+        raise
+    return server
+
+
+def print_report(report):
+    print(f"{report['elapsed_s']:.1f}s")
+    print(f"{'route':6} {'requests':>9} {'errors':>7} {'req/s':>8}"
+          f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, r in report["routes"].items():
+        if not r["requests"]:
+            continue
+        p = [f"{r[k]:8.1f}" if r[k] is not None else f"{'-':>8}"
+             for k in ["p50_ms", "p95_ms", "p99_ms"]]
+        print(f"{route:6} {r['requests']:9d}"
+              f" {r['requests'] - r['ok']:7d}"
+              f" {r['throughput_per_s']:8.1f} {' '.join(p)}")
+        for error, n in r["errors"].items():
+            print(f"       {n} x {error}")
+
+
+if __name__ == "__main__":
+    parser = make_parser()
+    args = parser.parse_args()
+    if args.mode == "open" and not args.rate:
+        parser.error("--rate is required in open loop.")
+
+    keys = key_names(args.participants)
+    provision_keys(args.dbfile, keys)
+
+    server = None
+    if args.startserver:
+        server_log = tempfile.NamedTemporaryFile(prefix="bidding_api-",
+                                                 suffix=".log",
+                                                 delete=False).name
+        server = start_server(args, server_log)
+        print(f"Server started, logging to {server_log}")
+
+    try:
+        report = LoadGenerator(args, keys).run()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report["config"] = vars(args)
+    print_report(report)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+from auction_db import AuctionDbEndpoint
+from loggers import get_logger, set_global_handler
+import argparse
+from datetime import date
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='''
+    Partition the orders by month of applying date, and drop or detach
+    the partitions of the months that have expired.
+    The servers using the database may keep running: their next writes
+    and reads go to the partitions.
+    ''')
+
+    parser.add_argument('--dbfile',
+                        type=str,
+                        required=True,
+                        help="File to use for the sqlite database.")
+
+    parser.add_argument('--logfile',
+                        required=True,
+                        type=str,
+                        help="File where to store logs.")
+
+    parser.add_argument('--dropbefore',
+                        type=date.fromisoformat,
+                        default=None,
+                        help="Delete the orders of the months entirely"
+                        " before this date (YYYY-MM-DD).")
+
+    parser.add_argument('--detach',
+                        type=str,
+                        nargs=2,
+                        metavar=("MONTH", "FILE"),
+                        default=None,
+                        help="Move the orders of MONTH (YYYY-MM)"
+                        " to the new database FILE.")
+
+    return parser
+
+
+if __name__ == "__main__":
+    parser = make_parser()
+    args = parser.parse_args()
+
+    set_global_handler(args.logfile)
+    logger = get_logger("MAIN")
+
+    bid_db = AuctionDbEndpoint(args.dbfile, logger=logger, partitioned=True)
+    try:
+        if args.detach is not None:
+            bid_db.detach_order_partition(*args.detach)
+        if args.dropbefore is not None:
+            print("Dropped:",
+                  ", ".join(bid_db.drop_order_partitions(args.dropbefore)))
+        print("Partitions:", ", ".join(bid_db.order_partitions()))
+    finally:
+        bid_db.close()
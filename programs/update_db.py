@@ -3,9 +3,14 @@
 from loggers import get_logger, set_global_handler
 import query_bmrs as bmrs
 from auction_db import AuctionDbEndpoint
+from bmrs_backfill import backfill
+from bmrs_sync import sync
+from bmrs_cache import ResponseCache
+from timeseries import TimeSeriesStore
 
 import argparse
 from datetime import date
+import os
 
 
 def make_parser():
@@ -23,6 +28,48 @@ def make_parser():
                         type=str,
                         help="File where to store logs.")
 
+    parser.add_argument('--from',
+                        dest='from_date',
+                        type=date.fromisoformat,
+                        default=None,
+                        help="Backfill from this date (YYYY-MM-DD).")
+
+    parser.add_argument('--to',
+                        dest='to_date',
+                        type=date.fromisoformat,
+                        default=None,
+                        help="Backfill up to this date, included"
+                        " (default: today).")
+
+    parser.add_argument('--workers',
+                        type=int,
+                        default=8,
+                        help="Number of concurrent requests when backfilling.")
+
+    parser.add_argument('--lookback',
+                        type=int,
+                        default=2,
+                        help="When syncing, look for missing periods from"
+                        " this many days before the latest stored day.")
+
+    parser.add_argument('--cachedir',
+                        type=str,
+                        default=None,
+                        help="Directory where to cache the API responses"
+                        " (default: no cache).")
+
+    parser.add_argument('--cachesize',
+                        type=int,
+                        default=512,
+                        help="Maximum size of the cache, in MB.")
+
+    parser.add_argument('--timeseriesdir',
+                        type=str,
+                        default=None,
+                        help="Directory of the memory-mapped time series"
+                        " store to keep in sync (filled from the database"
+                        " when new).")
+
     return parser
 
 
@@ -36,12 +83,43 @@ if __name__ == "__main__":
     set_global_handler(logfile)
     logger = get_logger("MAIN")
 
-    bid_db = AuctionDbEndpoint(database_file, logger=logger)
+    store = None
+    if args.timeseriesdir is not None:
+        new_store = not os.path.exists(
+            os.path.join(args.timeseriesdir, "meta.json"))
+        store = TimeSeriesStore(args.timeseriesdir)
+
+    bid_db = AuctionDbEndpoint(database_file, logger=logger, timeseries=store)
+    if store is not None and new_store:
+        bid_db.rebuild_timeseries()
+
+    if args.cachedir is not None:
+        bmrs.set_cache(
+            ResponseCache(args.cachedir, max_bytes=args.cachesize * 2**20))
 
-    # get data from yesterday
-    yesterday = date.today()
-    market_index_df = bmrs.get_market_index_converted(yesterday.isoformat())
-    imbalance_prices_df = bmrs.get_imbalance_prices(yesterday.isoformat(0))
+    if args.from_date is not None:
+        to_date = args.to_date if args.to_date is not None else date.today()
+        written, failed = backfill(bid_db,
+                                   args.from_date,
+                                   to_date,
+                                   max_workers=args.workers,
+                                   logger=logger)
+        print(f"Written rows: {written}")
+        for table, day, error in failed:
+            print(f"Failed: {table} {day}: {error}")
+    else:
+        # fetch only what is missing since the last run
+        report = sync(bid_db,
+                      lookback_days=args.lookback,
+                      max_workers=args.workers,
+                      logger=logger)
+        for table, rep in report.items():
+            print(f"{table}: {rep['missing']} periods missing,"
+                  f" {rep['requests']} requests, {len(rep['failed'])} failed,"
+                  f" {rep['inserted']} rows inserted,"
+                  f" {rep['updated']} rows updated.")
 
-    bid_db.write_market_index(market_index_df)
-    bid_db.write_imbalance_price(imbalance_prices_df)
+    if bmrs.get_cache() is not None:
+        report = bmrs.get_cache().report()
+        logger.info("Cache report: %s", report)
+        print(f"Cache report: {report}")
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''
+Archive of the settled days: the orders, market index and imbalance prices
+that are only read by analytics, moved out of the hot sqlite file
+into compressed Parquet files (needs pyarrow, which is optional).
+
+There is one file per table and month, <directory>/<table>/YYYY-MM.parquet,
+sorted by date with one row group per day, so that a read opens only the
+files of its months and, thanks to the row group statistics,
+decodes only the days and columns it asks for.
+'''
+from auction_db import AuctionDbEndpoint
+
+from datetime import date, datetime
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# The date column and the unique columns of the archived tables
+tables = {
+    "orders": ("applying_date", ["order_id"]),
+    "market_index": ("date", ["date", "period"]),
+    "imbalance_prices": ("date", ["date", "period"]),
+}
+
+
+def _schema(table):
+    types = {
+        int: pa.int64(),
+        float: pa.float64(),
+        str: pa.string(),
+        date: pa.date32(),
+        datetime: pa.timestamp("us"),
+    }
+    return pa.schema([(name, types[t])
+                      for name, t, _ in AuctionDbEndpoint.tables[table]
+                      ["fields"]])
+
+
+def _months(start_date, end_date):
+    months = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class Archive:
+
+    def __init__(self, directory, compression="zstd"):
+        if pq is None:
+            raise ImportError("The archive needs pyarrow.")
+        self.directory = directory
+        self.compression = compression
+
+    def _path(self, table, month):
+        return os.path.join(self.directory, table, f"{month}.parquet")
+
+    def months(self, table):
+        '''
+        The months ("YYYY-MM") archived for table.
+        '''
+        folder = os.path.join(self.directory, table)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(f[:-len(".parquet")] for f in os.listdir(folder)
+                      if f.endswith(".parquet"))
+
+    def write(self, table, rows):
+        '''
+        Add rows (tuples of all the fields of table, as read from sqlite)
+        to the files of their months. Rows already archived
+        (same unique columns) are replaced.
+        '''
+        date_column, unique = tables[table]
+        schema = _schema(table)
+        df = pd.DataFrame(rows, columns=schema.names)
+        if df.empty:
+            return
+        month = df[date_column].map(lambda d: d.isoformat()[:7])
+        for m, new in df.groupby(month):
+            path = self._path(table, m)
+            if os.path.exists(path):
+                old = pq.read_table(path).to_pandas(date_as_object=True)
+                new = pd.concat([old, new], ignore_index=True)
+            new = (new.drop_duplicates(unique, keep="last").sort_values(
+                [date_column] + unique, kind="stable"))
+            self._write_month(path, pa.Table.from_pandas(new,
+                                                         schema=schema,
+                                                         preserve_index=False),
+                              date_column)
+
+    def _write_month(self, path, table, date_column):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        days = table.column(date_column).to_pylist()
+        with pq.ParquetWriter(tmp, table.schema,
+                              compression=self.compression) as writer:
+            start = 0
+            while start < len(days):
+                end = start
+                while end < len(days) and days[end] == days[start]:
+                    end += 1
+                writer.write_table(table.slice(start, end - start))
+                start = end
+        # The readers see either the old file or the new one.
+        os.replace(tmp, path)
+
+    def read(self, table, start_date, end_date, columns=None, filters=None):
+        '''
+        The archived rows of table from start_date to end_date included,
+        as tuples of columns (all the fields by default), in file order.
+        filters are extra pyarrow filters, e.g. [("hour_ID", "in", [1, 2])].
+        '''
+        date_column, _ = tables[table]
+        paths = [
+            p for p in (self._path(table, m)
+                        for m in _months(start_date, end_date))
+            if os.path.exists(p)
+        ]
+        if not paths:
+            return []
+        res = pq.read_table(paths,
+                            columns=columns,
+                            filters=[(date_column, ">=", start_date),
+                                     (date_column, "<=", end_date)] +
+                            (filters or []),
+                            schema=_schema(table))
+        return list(zip(*(c.to_pylist() for c in res.columns)))
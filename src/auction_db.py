@@ -1,14 +1,50 @@
 #!/usr/bin/env python3
-from common_db_operations import setup_db, date_to_sqlite
+from common_db_operations import (setup_db, date_to_sqlite, connect,
+                                  set_durability, create_table)
+import migrations
+import partitions
+import timeseries
 
+from contextlib import nullcontext
 from datetime import date, datetime, time, timedelta
+from functools import partial
+from itertools import islice, repeat
+from operator import itemgetter
 import os
-import sqlite3
+import numpy as np
 import pandas as pd
 import hashlib
 import converter
 
 
+class _RowList:
+    '''
+    The fetchall and fetchmany of a cursor, over rows already read.
+    '''
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchmany(self, size):
+        return list(islice(self._rows, size))
+
+
+def _sqlite_timestamps(values):
+    '''
+    The text the sqlite3 adapter makes of datetimes
+    (datetime.isoformat(" "), without the microseconds when they are 0)
+    for an array of datetime64.
+    '''
+    seconds = values.astype("datetime64[s]")
+    text = np.char.replace(np.datetime_as_string(seconds), "T", " ")
+    microseconds = (values - seconds).astype("timedelta64[us]").astype(int)
+    return np.where(microseconds == 0, text,
+                    np.char.add(text, np.char.mod(".%06d", microseconds)))
+
+
 class AuctionDbEndpoint:
     tables = {
         "imbalance_prices": {
@@ -35,19 +71,44 @@ class AuctionDbEndpoint:
                 ("hour_ID", int, ""),  # 1-24
                 ("type", str, ""),
                 ("volume", float, ""),
-                ("price", float, "")
+                ("price", float, ""),
+                # set by the clearing when the market index is known
+                ("accepted", int, ""),
             ],
             "constraints":
-            ''
+            '',
+            "indexes": [
+                ("orders_key_date_hour",
+                 ["key_id", "applying_date", "hour_ID"]),
+                ("orders_date_hour", ["applying_date", "hour_ID"]),
+            ]
         },
         "keys": {
             "fields": [("key_id", int, "PRIMARY KEY AUTOINCREMENT"),
                        ("encrypted_key", str, "")],
             "constraints":
-            ''
+            '',
+            "indexes": [
+                ("keys_encrypted_key", ["encrypted_key"]),
+            ]
+        },
+        # Counters increased by the writes that other processes cache
+        "data_versions": {
+            "fields": [("name", str, ""), ("version", int, "")],
+            "constraints": ''
+        },
+        # The first day not archived, per table (see archive_settled)
+        "archive_watermarks": {
+            "fields": [("name", str, "PRIMARY KEY"), ("until", date, "")],
+            "constraints": ''
         }
     }
     order_types = ["BUY", "SELL"]
+    # Positions of the fields in the rows of orders
+    _order_fields = {
+        f[0]: i
+        for i, f in enumerate(tables["orders"]["fields"])
+    }
 
     def logger_info(self, *args, **kwargs):
         if self.logger:
@@ -61,18 +122,176 @@ class AuctionDbEndpoint:
         if self.logger:
             self.logger.debug(*args, **kwargs)
 
-    def __init__(self, filename, logger=None, order_deadline=time(9)):
+    def __init__(self,
+                 filename,
+                 logger=None,
+                 order_deadline=time(9),
+                 connection=None,
+                 key_cache=None,
+                 metrics=None,
+                 tracer=None,
+                 partitioned=False,
+                 archive=None,
+                 timeseries=None,
+                 market_cache=None):
+        '''
+        If connection is given (e.g. one borrowed from a ConnectionPool)
+        it is used as it is and no setup is done.
+        key_cache is a KeyCache, usually shared by all the endpoints
+        of a process.
+        metrics is a metrics.BidMetrics timing the stages of the writes.
+        With a sql_trace.SqlTracer, execute and executemany are replaced
+        by traced versions (without one they are not touched at all).
+        With partitioned, the orders are partitioned by month
+        (see partitions), moving those already stored; the database stays
+        partitioned for all the endpoints opening it afterwards.
+        With an archive.Archive, archive_settled moves the settled days
+        to it and the reads of those days are answered from it.
+        A timeseries.TimeSeriesStore is kept up to date with the market
+        index and imbalance prices written, and serves their numpy reads.
+        With a market_cache.MarketIndexCache (usually shared by all the
+        endpoints of a process) the orders inserted are cleared
+        in Python against the cached market index, instead of in SQL.
+        '''
         self.filename = filename
         self.logger = logger
         self.deadline = order_deadline
-        if not os.path.exists(filename):
+        self.key_cache = key_cache
+        self.metrics = metrics
+        self.archive = archive
+        self.timeseries = timeseries
+        self.market_cache = market_cache
+        self._data_version = None
+        if connection is not None:
+            self._connection = connection
+            self._cursor = self._connection.cursor()
+        elif not os.path.exists(filename):
             self._cursor, self._connection = setup_db(filename,
                                                       AuctionDbEndpoint.tables)
+            migrations.stamp(self._connection)
         else:
             self.logger_info("Connecting to existing database")
-            self._connection = sqlite3.connect(
-                self.filename, detect_types=sqlite3.PARSE_DECLTYPES)
+            self._connection = connect(self.filename)
             self._cursor = self._connection.cursor()
+            migrations.migrate(self._connection, AuctionDbEndpoint.tables,
+                               self.logger)
+
+        if tracer is not None:
+            self.execute = partial(tracer.execute, self._connection,
+                                   self._cursor)
+            self.executemany = partial(tracer.executemany, self._connection,
+                                       self._cursor)
+
+        self._partitioned = None
+        self._schema_version = None
+        if partitioned:
+            self.partition_orders()
+
+    def close(self):
+        self._connection.close()
+
+    def _timed(self, stage):
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.time(stage)
+
+    def set_durability(self,
+                       journal_mode=None,
+                       synchronous=None,
+                       busy_timeout=None):
+        set_durability(self._connection, journal_mode, synchronous,
+                       busy_timeout)
+
+    @property
+    def partitioned(self):
+        '''
+        Looked up again whenever the schema has changed,
+        e.g. because another connection has partitioned the orders.
+        '''
+        schema_version, = self.execute("PRAGMA schema_version;").fetchone()
+        if schema_version != self._schema_version:
+            self._partitioned = partitions.is_partitioned(self)
+            self._schema_version = schema_version
+        return self._partitioned
+
+    def partition_orders(self):
+        '''
+        Partition the orders by month from now on.
+        '''
+        if not self.partitioned:
+            # In one transaction, that also keeps out other processes
+            # doing the same.
+            self._connection.commit()
+            self.execute("BEGIN IMMEDIATE;")
+            try:
+                partitions.enable(self, self.tables["orders"])
+                self._connection.commit()
+            except Exception:
+                self._connection.rollback()
+                raise
+            self.logger_info("Partitioned the orders by month")
+
+    def _orders_tables(self, start_date, end_date):
+        '''
+        The tables with the orders applying from start_date to end_date.
+        '''
+        if self.partitioned:
+            # An empty table, if there are no partitions.
+            return partitions.find(self, start_date, end_date) or ["orders"]
+        return ["orders"]
+
+    def order_partitions(self):
+        '''
+        The months ("YYYY-MM") that have a partition.
+        '''
+        if not self.partitioned:
+            return []
+        return [
+            m for m, in self.execute(f'''
+        SELECT month
+        FROM {partitions.registry}
+        ORDER BY month;''').fetchall()
+        ]
+
+    def drop_order_partitions(self, before):
+        '''
+        Delete the orders of the months entirely before the date before,
+        a partition at a time. Returns the months dropped.
+        '''
+        months = [
+            m for m in self.order_partitions()
+            if m < partitions.month_of(before)
+        ]
+        for month in months:
+            partitions.drop(self, month)
+        self._connection.commit()
+        self.logger_info("Dropped %d order partitions.", len(months))
+        return months
+
+    def detach_order_partition(self, month, filename):
+        '''
+        Move the orders of month ("YYYY-MM") to the orders table
+        of a new database file.
+        '''
+        if month not in self.order_partitions():
+            raise ValueError(f"No partition for {month}.")
+        if os.path.exists(filename):
+            raise ValueError(f"{filename} already exists.")
+        # ATTACH cannot run in a transaction.
+        self._connection.commit()
+        self.execute("ATTACH DATABASE ? AS detached;", (filename, ))
+        try:
+            create_table(self, "detached.orders", self.tables["orders"])
+            self.execute(f'''
+            INSERT INTO detached.orders
+            SELECT *
+            FROM {partitions.table_name(month)};''')
+            self._connection.commit()
+        finally:
+            self.execute("DETACH DATABASE detached;")
+        partitions.drop(self, month)
+        self._connection.commit()
+        self.logger_info("Detached the orders of %s to %s", month, filename)
 
     def executemany(self, *args, **kwargs):
         return self._cursor.executemany(*args, **kwargs)
@@ -89,16 +308,47 @@ class AuctionDbEndpoint:
             INSERT INTO keys VALUES (NULL,'{self._encrypt(key)}');
             ''')
             self._connection.commit()
+            if self.key_cache is not None:
+                self.key_cache.invalidate(self._encrypt(key))
         self.logger_info("Written key")
 
+    def revoke_key(self, key):
+        '''
+        The orders already submitted with the key are kept.
+        '''
+        encrypted_key = self._encrypt(key)
+        self.execute(
+            '''
+        DELETE FROM keys
+        WHERE encrypted_key = ?;
+        ''', (encrypted_key, ))
+        self._connection.commit()
+        if self.key_cache is not None:
+            self.key_cache.invalidate(encrypted_key)
+        self.logger_info("Revoked key")
+
     def find_key_id(self, key):
-        res = self.execute(f'''
+        with self._timed("key_lookup"):
+            return self._find_key_id(key)
+
+    def _find_key_id(self, key):
+        encrypted_key = self._encrypt(key)
+        if self.key_cache is not None:
+            found, key_id = self.key_cache.lookup(encrypted_key)
+            if found:
+                return key_id
+
+        res = self.execute(
+            '''
         SELECT key_id
         FROM keys
-        WHERE encrypted_key == '{self._encrypt(key)}';
-        ''').fetchone()
-        if res:
-            return res[0]
+        WHERE encrypted_key == ?;
+        ''', (encrypted_key, )).fetchone()
+        key_id = res[0] if res else None
+
+        if self.key_cache is not None:
+            self.key_cache.store(encrypted_key, key_id)
+        return key_id
 
     def check_order_not_late(self, order):
         applying = order["applying_date"]
@@ -123,7 +373,7 @@ class AuctionDbEndpoint:
         if not AuctionDbEndpoint.validate_order(order):
             raise ValueError("Order syntactically invalid.")
 
-        other_fs = {"order_id": None, "key_id": key_id}
+        other_fs = {"order_id": None, "key_id": key_id, "accepted": None}
 
         o = (order | other_fs)
         o["type"] = o["type"].upper()
@@ -141,65 +391,523 @@ class AuctionDbEndpoint:
 
         return order
 
-    def write_orders(self, key, orders):
+    def prepare_orders(self, key, orders):
+        '''
+        Validate the orders and drop the late ones.
+        Returns the rows to insert and the message for the submitter.
+        '''
         key_id = self.find_key_id(key)
 
-        ords = [self.sanify_order(key_id, o) for o in orders]
+        with self._timed("validation"):
+            ords = [self.sanify_order(key_id, o) for o in orders]
+            ords = [
+                self.to_list(o) for o in ords if self.check_order_not_late(o)
+            ]
 
-        ords = [self.to_list(o) for o in ords if self.check_order_not_late(o)]
+        message = ''
+        nrejected = len(orders) - len(ords)
+        if self.metrics is not None:
+            self.metrics.count_orders(len(ords), nrejected)
+        if nrejected:
+            message += f"rejected {nrejected} orders because of time limit;"
+
+        return key_id, ords, message
+
+    def insert_orders(self, ords, applying_dates=None):
+        '''
+        ords can be any iterable of rows
+        if the set of their applying_dates is given.
+        '''
+        if applying_dates is None:
+            idate = self.get_field_names("orders").index("applying_date")
+            applying_dates = {o[idate] for o in ords}
+
+        def rows(market_prices):
+            if market_prices is None:
+                return ords
+            return self._clear_rows(ords, market_prices)
+
+        self._insert(rows, applying_dates)
+
+    def _insert(self, rows, applying_dates):
+        '''
+        Insert the orders rows(market_prices), which apply on
+        applying_dates. With a market cache, market_prices maps each of
+        applying_dates to the {period: price} of its market index
+        and the rows must be cleared against it; without one,
+        market_prices is None and the orders are cleared in SQL.
+        '''
+        with self._timed("insert"):
+            if not self._connection.in_transaction:
+                # The write lock, before deciding where the orders go
+                # and reading the market index they are cleared against:
+                # no other connection can change either until the commit.
+                self.execute("BEGIN IMMEDIATE;")
+            market_prices = None
+            if self.market_cache is not None:
+                # Read before executemany, which needs the cursor.
+                self._check_market_cache()
+                market_prices = {
+                    d: self._market_prices(d)
+                    for d in applying_dates
+                }
+            ords = rows(market_prices)
+
+            if self.partitioned:
+                self._insert_partitioned(ords)
+            else:
+                self._insert_into("orders", ords)
 
+            if self.market_cache is None:
+                # Orders for days whose market index is already known
+                # are cleared straight away.
+                self.clear_orders(
+                    [d for d in applying_dates if self._has_market_index(d)])
+
+    def _market_index_version(self):
+        res = self.execute('''
+        SELECT version
+        FROM data_versions
+        WHERE name = 'market_index';''').fetchone()
+        return res[0] if res else 0
+
+    def _bump_market_index_version(self):
+        '''
+        In the transaction changing the market index.
+        '''
+        cursor = self.execute('''
+        UPDATE data_versions
+        SET version = version + 1
+        WHERE name = 'market_index';''')
+        if cursor.rowcount == 0:
+            self.execute(
+                "INSERT INTO data_versions VALUES ('market_index', 1);")
+
+    def _market_index_changed(self):
+        # The other connections see the new version by themselves.
+        if self.market_cache is not None:
+            self.market_cache.check_version(self._market_index_version())
+
+    def _check_market_cache(self):
+        '''
+        Empty the cache if the market index has changed since,
+        looking at the version only if another connection
+        has committed something since the last time.
+        '''
+        data_version, = self.execute("PRAGMA data_version;").fetchone()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self.market_cache.check_version(self._market_index_version())
+
+    def _market_prices(self, applying_date):
+        '''
+        {period: price} of the market index of applying_date.
+        '''
+        if type(applying_date) is not str:
+            applying_date = date_to_sqlite(applying_date)
+        found, prices = self.market_cache.lookup(applying_date)
+        if found:
+            return prices
+        version = self.market_cache.version
+        prices = dict(
+            self.execute(
+                '''
+        SELECT period, price
+        FROM market_index
+        WHERE date = ?;
+        ''', (applying_date, )).fetchall())
+        self.market_cache.store(applying_date, prices, version)
+        return prices
+
+    def _clear_rows(self, ords, market_prices):
+        '''
+        The rows of ords with accepted set as clear_orders would,
+        against market_prices ({applying_date: {period: price}}):
+        NULL if the market index of their period is not known yet.
+        '''
+        fields = self._order_fields
+        idate, ihour, itype, iprice, iaccepted = (fields[f] for f in [
+            "applying_date", "hour_ID", "type", "price", "accepted"
+        ])
+        res = []
+        for o in ords:
+            price = market_prices[o[idate]].get(int(o[ihour]))
+            if price is not None:
+                order_price = float(o[iprice])
+                accepted = int((order_price <= price and o[itype] == "SELL")
+                               or (order_price >= price
+                                   and o[itype] == "BUY"))
+                o = (*o[:iaccepted], accepted, *o[iaccepted + 1:])
+            res.append(o)
+        return res
+
+    @staticmethod
+    def _accepted_column(applying, hours, types, prices, market_prices):
+        '''
+        The accepted of the orders given by columns (arrays),
+        as _clear_rows would set it.
+        '''
+        market = np.full(len(hours), np.nan)
+        for d, periods in market_prices.items():
+            if not periods:
+                continue
+            by_hour = np.full(max(max(periods), hours.max()) + 1, np.nan)
+            by_hour[list(periods.keys())] = list(periods.values())
+            on_day = applying == d
+            market[on_day] = by_hour[hours[on_day]]
+        accepted = (((prices <= market) & (types == "SELL"))
+                    | ((prices >= market) & (types == "BUY")))
+        # Python ints, which sqlite3 can bind.
+        res = accepted.astype(int).astype(object)
+        res[np.isnan(market)] = None
+        return res.tolist()
+
+    def _insert_into(self, table, ords):
         placeholders = ','.join(['?'] * len(self.tables["orders"]["fields"]))
         self.executemany(
             f'''
-        INSERT INTO orders VALUES ({placeholders});
+        INSERT INTO {table} VALUES ({placeholders});
         ''', ords)
-        self._connection.commit()
+
+    def _insert_partitioned(self, ords):
+        idate = self.get_field_names("orders").index("applying_date")
+        by_month = {}
+        for o in ords:
+            by_month.setdefault(partitions.month_of(o[idate]), []).append(o)
+        if not by_month:
+            return
+
+        order_id = partitions.allocate_ids(
+            self, sum(len(rows) for rows in by_month.values()))
+        for month, rows in by_month.items():
+            table = partitions.create(self, month, self.tables["orders"])
+            # order_id is the first field.
+            self._insert_into(table, ((i, *o[1:]) for i, o in zip(
+                range(order_id, order_id + len(rows)), rows)))
+            order_id += len(rows)
+
+    def _has_market_index(self, applying_date):
+        if type(applying_date) is not str:
+            applying_date = date_to_sqlite(applying_date)
+        return self.execute(
+            '''
+        SELECT 1
+        FROM market_index
+        WHERE date = ?
+        LIMIT 1;
+        ''', (applying_date, )).fetchone() is not None
+
+    def clear_orders(self, applying_dates):
+        '''
+        Decide whether the orders for the given dates are accepted,
+        against the market index stored for those dates
+        (NULL where the market index is missing). Does not commit.
+        '''
+        dates = [(d if type(d) is str else date_to_sqlite(d), )
+                 for d in applying_dates]
+        by_table = {}
+        if self.partitioned and dates:
+            existing = set(
+                self._orders_tables(min(dates)[0],
+                                    max(dates)[0])) - {"orders"}
+            for d in dates:
+                table = partitions.table_name(partitions.month_of(d[0]))
+                if table in existing:
+                    by_table.setdefault(table, []).append(d)
+        else:
+            by_table["orders"] = dates
+
+        for table, table_dates in by_table.items():
+            self.executemany(
+                f'''
+            UPDATE {table}
+            SET accepted = (
+                SELECT
+                (({table}.price <= market_index.price
+                  AND {table}.type = 'SELL') OR
+                ({table}.price >= market_index.price
+                 AND {table}.type = 'BUY'))
+                FROM market_index
+                WHERE market_index.date = {table}.applying_date
+                AND market_index.period = {table}.hour_ID)
+            WHERE applying_date = ?;
+            ''', table_dates)
+        if dates:
+            self.logger_info("Cleared orders for %d days.", len(dates))
+
+    def commit(self):
+        with self._timed("commit"):
+            self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def write_orders(self, key, orders):
+        key_id, ords, message = self.prepare_orders(key, orders)
+        self.insert_orders(ords)
+        self.commit()
+
+        self.logger_info("Written %d orders by id %s", len(ords), key_id)
+        return len(ords), message
+
+    def write_orders_pandas(self, key, df):
+        '''
+        Same as write_orders(key, converter.pandas_orders_to_records(df)),
+        but the checks run on whole columns
+        and the rows go to executemany without building a dict for each.
+        '''
+        key_id = self.find_key_id(key)
+
+        with self._timed("validation"):
+            types = df["type"].astype(str).str.upper()
+            hours = pd.to_numeric(df["hour_ID"])
+            volumes = pd.to_numeric(df["volume"]).astype(float)
+            prices = pd.to_numeric(df["price"]).astype(float)
+            valid = (types.isin(AuctionDbEndpoint.order_types) & (hours > 0)
+                     & (hours < 25) & (hours == hours.round()))
+            if not valid.all():
+                raise ValueError("Order syntactically invalid.")
+
+            applying = pd.to_datetime(df["applying_date"]).dt.normalize()
+            timestamps = pd.to_datetime(df["timestamp"])
+            deadline = (applying - pd.Timedelta(days=1) + pd.Timedelta(
+                hours=self.deadline.hour,
+                minutes=self.deadline.minute,
+                seconds=self.deadline.second,
+                microseconds=self.deadline.microsecond))
+            not_late = (timestamps < deadline).to_numpy()
+            nwritten = int(not_late.sum())
+
+        if nwritten:
+            self._insert_pandas(key_id, applying.to_numpy()[not_late],
+                                timestamps.to_numpy()[not_late],
+                                hours.to_numpy()[not_late].astype(int),
+                                types.to_numpy()[not_late],
+                                volumes.to_numpy()[not_late],
+                                prices.to_numpy()[not_late])
+            self.commit()
 
         message = ''
-        nrejected = len(orders) - len(ords)
+        nrejected = len(df) - nwritten
+        if self.metrics is not None:
+            self.metrics.count_orders(nwritten, nrejected)
         if nrejected:
             message += f"rejected {nrejected} orders because of time limit;"
 
-        self.logger_info(f"Written {len(ords)} orders by id {key_id}")
-        return len(ords), message
+        self.logger_info("Written %d orders by id %s", nwritten, key_id)
+        return nwritten, message
 
-    def write_orders_pandas(self, key, df):
-        fixed_orders = converter.pandas_orders_to_records(df)
-        return self.write_orders(key, fixed_orders)
+    def _insert_pandas(self, key_id, applying, timestamps, hours, types,
+                       volumes, prices):
+        '''
+        Insert the orders given by columns (arrays, not empty).
+        '''
+        # The same text as the sqlite3 adapters, as in write_orders.
+        applying = np.datetime_as_string(applying, unit='D')
+        timestamps = _sqlite_timestamps(timestamps)
+
+        def rows(market_prices):
+            accepted = (repeat(None) if market_prices is None else
+                        self._accepted_column(applying, hours, types, prices,
+                                              market_prices))
+            return zip(repeat(None), repeat(key_id), timestamps.tolist(),
+                       applying.tolist(), hours.tolist(), types.tolist(),
+                       volumes.tolist(), prices.tolist(), accepted)
 
-    def read_orders(self, key, applying_date, period=None):
+        self._insert(rows, set(applying.tolist()))
+
+    def _select_orders(self, key, applying_date, period=None):
+        '''
+        The cursor over the orders of read_orders, or None.
+        '''
         period_selection = f"AND  hour_ID = '{period}'" if period else ''
-        q = self.execute(f'''
-        SELECT key_id
-        FROM keys
-        WHERE encrypted_key =  '{self._encrypt(key)}';
-        ''').fetchone()
-        if not q:
+        key_id = self.find_key_id(key)
+        if key_id is None:
             return None
-        else:
-            key_id, = q
-        field_names = AuctionDbEndpoint.get_field_names("orders")
-        selection = ','.join(f'orders.{f}' for f in field_names)
-
-        res = self.execute(f'''
-        SELECT {selection},
-        ((orders.price <= market_index.price AND orders.type = 'SELL') OR
-        (orders.price >= market_index.price AND orders.type = 'BUY') )
-        as accepted
-        FROM orders
-        LEFT JOIN market_index
-        ON orders.applying_date = market_index.date
-        AND orders.hour_ID = market_index.period
+        selection = ','.join(AuctionDbEndpoint.get_field_names("orders"))
+        table, = self._orders_tables(applying_date, applying_date)
+        # Before the select: the queries share the cursor.
+        archived = self._archived_orders([key_id], applying_date,
+                                         applying_date,
+                                         [period] if period else None)
+
+        cursor = self.execute(f'''
+        SELECT {selection}
+        FROM {table}
         WHERE applying_date = '{date_to_sqlite(applying_date)}'
         {period_selection}
         AND key_id = '{key_id}';
-        ''').fetchall()
-        field_names.append("accepted")
-        res = [dict(zip(field_names, v)) for v in res]
-        self.logger_info(f"Read {len(res)} orders.")
-        return res
+        ''')
+        return self._with_archived(cursor, archived)
+
+    def read_orders(self, key, applying_date, period=None, output="records"):
+        '''
+        output as in read_orders_bulk.
+        '''
+        self._check_output(output)
+        cursor = self._select_orders(key, applying_date, period)
+        if cursor is None:
+            return None
+        res = cursor.fetchall()
+        self.logger_info("Read %d orders.", len(res))
+        return self._format_orders(res, output)
+
+    @staticmethod
+    def _check_output(output):
+        if output not in ("records", "numpy", "pandas"):
+            raise ValueError(f"Unknown output {output}.")
+
+    @staticmethod
+    def _format_orders(rows, output):
+        if output == "records":
+            field_names = AuctionDbEndpoint.get_field_names("orders")
+            return [dict(zip(field_names, v)) for v in rows]
+        columns = AuctionDbEndpoint._orders_columns(rows)
+        if output == "numpy":
+            return columns
+        return pd.DataFrame(columns)
+
+    def iter_orders(self, key, applying_date, period=None, chunksize=1000):
+        '''
+        Same orders as read_orders, as an iterator over lists of
+        at most chunksize of them (or None if the key is unknown).
+        No other query must run on this endpoint until it is exhausted.
+        '''
+        cursor = self._select_orders(key, applying_date, period)
+        if cursor is None:
+            return None
+        return self._iter_chunks(cursor, chunksize)
+
+    @staticmethod
+    def _iter_chunks(cursor, chunksize):
+        field_names = AuctionDbEndpoint.get_field_names("orders")
+        while rows := cursor.fetchmany(chunksize):
+            yield [dict(zip(field_names, v)) for v in rows]
+
+    def _archived_orders(self, key_ids, start_date, end_date, hours=None):
+        '''
+        The archived orders of key_ids (all if None), hours (all if None)
+        from start_date to end_date included.
+        '''
+        end_date = self._archived_end("orders", start_date, end_date)
+        if end_date is None:
+            return []
+        filters = []
+        if key_ids is not None:
+            filters.append(("key_id", "in", key_ids))
+        if hours is not None:
+            filters.append(("hour_ID", "in", [int(h) for h in hours]))
+        return self.archive.read("orders", start_date, end_date,
+                                 filters=filters)
+
+    @staticmethod
+    def _with_archived(cursor, archived):
+        '''
+        The rows of cursor and the archived ones, in the order of the
+        bulk reads (the same rows as cursor if nothing is archived).
+        '''
+        if not archived:
+            return cursor
+        field_names = AuctionDbEndpoint.get_field_names("orders")
+        order = itemgetter(*[
+            field_names.index(f)
+            for f in ["key_id", "applying_date", "hour_ID", "order_id"]
+        ])
+        return _RowList(sorted(archived + cursor.fetchall(), key=order))
+
+    def _select_orders_bulk(self, keys, start_date, end_date, hours=None):
+        conditions = ["applying_date >= ? AND applying_date <= ?"]
+        params = [date_to_sqlite(start_date), date_to_sqlite(end_date)]
+        if keys is not None:
+            key_ids = [self.find_key_id(key) for key in keys]
+            if None in key_ids:
+                return None
+            conditions.append(
+                f"key_id IN ({','.join(['?'] * len(key_ids))})")
+            params.extend(key_ids)
+        if hours is not None:
+            conditions.append(f"hour_ID IN ({','.join(['?'] * len(hours))})")
+            params.extend(int(h) for h in hours)
+
+        selection = ','.join(AuctionDbEndpoint.get_field_names("orders"))
+        # Only the partitions of the dates asked for.
+        tables = self._orders_tables(start_date, end_date)
+        selects = [
+            f"SELECT {selection} FROM {table}"
+            f" WHERE {' AND '.join(conditions)}" for table in tables
+        ]
+        archived = self._archived_orders(key_ids if keys is not None else None,
+                                         start_date, end_date, hours)
+        cursor = self.execute(
+            f'''
+        {" UNION ALL ".join(selects)}
+        ORDER BY key_id, applying_date, hour_ID, order_id;
+        ''', params * len(tables))
+        return self._with_archived(cursor, archived)
+
+    def read_orders_bulk(self,
+                         keys,
+                         start_date,
+                         end_date,
+                         hours=None,
+                         output="records"):
+        '''
+        The orders of keys (all the participants if keys is None)
+        applying from start_date to end_date included, optionally only
+        for the given hours, in one query.
+        None if one of the keys is unknown.
+        output is "records" (a list of dicts), "numpy" (a dict of arrays)
+        or "pandas" (a DataFrame).
+        '''
+        self._check_output(output)
+        cursor = self._select_orders_bulk(keys, start_date, end_date, hours)
+        if cursor is None:
+            return None
+        res = cursor.fetchall()
+        self.logger_info("Read %d orders in bulk.", len(res))
+        return self._format_orders(res, output)
+
+    def iter_orders_bulk(self,
+                         keys,
+                         start_date,
+                         end_date,
+                         hours=None,
+                         chunksize=1000):
+        '''
+        Same orders as read_orders_bulk, as an iterator over lists of
+        at most chunksize records (or None if one of the keys is unknown).
+        No other query must run on this endpoint until it is exhausted.
+        '''
+        cursor = self._select_orders_bulk(keys, start_date, end_date, hours)
+        if cursor is None:
+            return None
+        return self._iter_chunks(cursor, chunksize)
+
+    @staticmethod
+    def _orders_columns(rows):
+        '''
+        The rows of orders as one typed array per field
+        (integer columns with NULLs become floats with NaNs).
+        '''
+        dtypes = {
+            int: "int64",
+            float: "float64",
+            date: "datetime64[D]",
+            datetime: "datetime64[us]",
+            str: object
+        }
+        columns = {}
+        fields = AuctionDbEndpoint.tables["orders"]["fields"]
+        for (name, t, _), values in zip(fields, zip(*rows) if rows else
+                                        [()] * len(fields)):
+            dtype = dtypes[t]
+            if t is int and None in values:
+                values = [np.nan if v is None else v for v in values]
+                dtype = "float64"
+            columns[name] = np.array(values, dtype=dtype)
+        return columns
 
-    def _write_from_api(self, df_converted, tablename):
+    def _write_from_api(self, df_converted, tablename, commit=True):
         data = df_converted.to_dict("split")["data"]
         placeholders = ','.join(['?'] * len(self.tables[tablename]["fields"]))
         self.executemany(
@@ -207,21 +915,79 @@ class AuctionDbEndpoint:
         REPLACE INTO {tablename}
         VALUES ({placeholders})
         ''', data)
+        if commit:
+            self._connection.commit()
+        self.logger_info("Written/replaces %d rows into %s.", len(data),
+                         tablename)
+
+    def _upsert_from_api(self, df_converted, tablename, commit=True):
+        '''
+        Like _write_from_api, but the rows equal to the stored ones
+        are left alone. Returns the number of rows inserted or changed.
+        '''
+        data = df_converted.to_dict("split")["data"]
+        field_names = self.get_field_names(tablename)
+        values = [f for f in field_names if f not in ["date", "period"]]
+        placeholders = ','.join(['?'] * len(field_names))
+        before = self._connection.total_changes
+        self.executemany(
+            f'''
+        INSERT INTO {tablename}
+        VALUES ({placeholders})
+        ON CONFLICT (date, period) DO UPDATE
+        SET {','.join(f"{f} = excluded.{f}" for f in values)}
+        WHERE {' OR '.join(f"{f} IS NOT excluded.{f}" for f in values)};
+        ''', data)
+        changed = self._connection.total_changes - before
+        if commit:
+            self._connection.commit()
+        self.logger_info("Upserted %d rows into %s, %d changed.", len(data),
+                         tablename, changed)
+        return changed
+
+    def _write_timeseries(self, df_converted, tablename):
+        # After the commit: the store never has rows the database has not.
+        if self.timeseries is not None:
+            self.timeseries.write(tablename, df_converted)
+
+    def upsert_imbalance_prices(self, df):
+        df_converted = converter.convert_imbalance_prices_columns(df)
+        changed = self._upsert_from_api(df_converted, "imbalance_prices")
+        self._write_timeseries(df_converted, "imbalance_prices")
+        return changed
+
+    def upsert_market_index(self, df):
+        df_converted = converter.convert_market_index_columns(df)
+        changed = self._upsert_from_api(df_converted,
+                                        "market_index",
+                                        commit=False)
+        if changed:
+            self.clear_orders(df_converted["date"].unique())
+            self._bump_market_index_version()
         self._connection.commit()
-        self.logger_info(
-            f"Written/replaces {len(data)} rows into {tablename}.")
+        if changed:
+            self._market_index_changed()
+        self._write_timeseries(df_converted, "market_index")
+        return changed
 
     def write_imbalance_prices(self, df):
         df_converted = converter.convert_imbalance_prices_columns(df)
-        self.logger_info(f"Writing {len(df_converted)}"
-        " rows in 'imbalance_prices'")
+        self.logger_info("Writing %d rows in 'imbalance_prices'",
+                         len(df_converted))
         self._write_from_api(df_converted, "imbalance_prices")
+        self._write_timeseries(df_converted, "imbalance_prices")
 
     def write_market_index(self, df):
         df_converted = converter.convert_market_index_columns(df)
-        self.logger_info(f"Writing {len(df_converted)}"
-        " rows in 'market_index'")
-        self._write_from_api(df_converted, "market_index")
+        self.logger_info("Writing %d rows in 'market_index'",
+                         len(df_converted))
+        self._write_from_api(df_converted, "market_index", commit=False)
+        # New or replaced prices: clear again only the days they cover.
+        self.clear_orders(df_converted["date"].unique())
+        self._bump_market_index_version()
+        self._connection.commit()
+        self._market_index_changed()
+        self._write_timeseries(df_converted, "market_index")
 
     def _read_api_data(self, start_date, end_date, table_name):
         data = self.execute(f'''
@@ -232,12 +998,167 @@ class AuctionDbEndpoint:
         ''').fetchall()
         header = [t[0] for t in self.tables[table_name]["fields"]]
         res = pd.DataFrame(data, columns=header)
-        self.logger_info(
-            f"Written/replaces {len(data)} rows into {table_name}.")
+
+        archived_end = self._archived_end(table_name, start_date,
+                                          end_date - timedelta(days=1))
+        if archived_end is not None:
+            archived = pd.DataFrame(self.archive.read(table_name, start_date,
+                                                      archived_end),
+                                    columns=header)
+            if res.empty:
+                res = archived
+            elif not archived.empty:
+                # Rows written again after the archival win.
+                res = pd.concat([archived, res], ignore_index=True)
+                res = res.drop_duplicates(["date", "period"], keep="last")
+                res = res.sort_values(["date", "period"], ignore_index=True)
+        self.logger_info("Written/replaces %d rows into %s.", len(data),
+                         table_name)
         return res
 
-    def read_imbalance_prices(self, start_date, end_date):
+    def _archived_until(self, table_name):
+        '''
+        The day from which table_name is not archived, or None.
+        '''
+        res = self.execute(
+            '''
+        SELECT until
+        FROM archive_watermarks
+        WHERE name = ?;
+        ''', (table_name, )).fetchone()
+        return res[0] if res else None
+
+    def _archived_end(self, table_name, start_date, end_date):
+        '''
+        The last day from start_date to end_date included to read from
+        the archive, or None.
+        '''
+        if self.archive is None:
+            return None
+        until = self._archived_until(table_name)
+        if until is None or start_date >= until:
+            return None
+        return min(end_date, until - timedelta(days=1))
+
+    def archive_settled(self, before, vacuum=True):
+        '''
+        Move the orders, market index and imbalance prices of the days
+        before the date before, which must be settled, to the archive,
+        then vacuum the database (without vacuum, the space freed
+        is reused but not given back).
+        Returns the number of rows archived per table.
+        '''
+        if self.archive is None:
+            raise ValueError("No archive to move the settled days to.")
+        last = before - timedelta(days=1)
+        before = date_to_sqlite(before)
+        narchived = {}
+        # The files are written while holding the write lock,
+        # so that no row is missed.
+        self._connection.commit()
+        self.execute("BEGIN IMMEDIATE;")
+        try:
+            for table in ["orders", "market_index", "imbalance_prices"]:
+                rows = [
+                    row for t, column in self._hot_tables(table, last)
+                    for row in self.execute(
+                        f"SELECT * FROM {t} WHERE {column} < ?;", (
+                            before, )).fetchall()
+                ]
+                self.archive.write(table, rows)
+                self._delete_archived(table, before)
+                # The readers switch to the archive with the commit.
+                self.execute(
+                    '''
+                INSERT INTO archive_watermarks
+                VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE
+                SET until = max(until, excluded.until);
+                ''', (table, before))
+                narchived[table] = len(rows)
+            self._connection.commit()
+        except Exception:
+            self._connection.rollback()
+            raise
+        self.logger_info("Archived the days before %s: %s", before,
+                         narchived)
+        if vacuum:
+            self.execute("VACUUM;")
+            self.logger_info("Vacuumed the database")
+        return narchived
+
+    def _hot_tables(self, table_name, last):
+        '''
+        (table, date column) of the rows of table_name up to last.
+        '''
+        if table_name == "orders":
+            return [(t, "applying_date")
+                    for t in self._orders_tables(date.min, last)]
+        return [(table_name, "date")]
+
+    def _delete_archived(self, table_name, before):
+        if table_name == "orders":
+            # Whole months go with their partition.
+            for month in self.order_partitions():
+                if month < partitions.month_of(before):
+                    partitions.drop(self, month)
+        last = date.fromisoformat(before) - timedelta(days=1)
+        for table, column in self._hot_tables(table_name, last):
+            self.execute(f"DELETE FROM {table} WHERE {column} < ?;",
+                         (before, ))
+
+    def _read_api_arrays(self, start_date, end_date, table_name):
+        '''
+        The fields of table_name as (days, 50) arrays of the prices
+        per date and settlement period, NaN where missing.
+        '''
+        if self.timeseries is not None:
+            res = self.timeseries.read(table_name, start_date, end_date)
+        else:
+            df = self._read_api_data(start_date, end_date, table_name)
+            rows = (pd.to_datetime(df["date"]) -
+                    pd.Timestamp(start_date)).dt.days.to_numpy()
+            periods = df["period"].to_numpy(dtype=int)
+            res = {}
+            for field in timeseries.tables[table_name]:
+                res[field] = np.full(
+                    ((end_date - start_date).days, timeseries.nperiods),
+                    np.nan)
+                res[field][rows, periods - 1] = df[field].to_numpy(
+                    dtype="float64")
+        return {
+            "date":
+            np.arange(np.datetime64(start_date, "D"),
+                      np.datetime64(end_date, "D"))
+        } | res
+
+    def rebuild_timeseries(self):
+        '''
+        Fill the time series store with everything stored,
+        e.g. when it is new.
+        '''
+        for table_name in timeseries.tables:
+            self.timeseries.write(
+                table_name,
+                self._read_api_data(self.timeseries.epoch, date.max,
+                                    table_name))
+
+    def read_imbalance_prices(self, start_date, end_date, output="pandas"):
+        '''
+        The imbalance prices from start_date included to end_date excluded.
+        output is "pandas" (a DataFrame with a row per settlement period)
+        or "numpy" (a dict of arrays, see _read_api_arrays: views on the
+        store, without copies, if there is a timeseries store).
+        '''
+        if output == "numpy":
+            return self._read_api_arrays(start_date, end_date,
+                                         "imbalance_prices")
         return self._read_api_data(start_date, end_date, "imbalance_prices")
 
-    def read_market_index(self, start_date, end_date):
+    def read_market_index(self, start_date, end_date, output="pandas"):
+        '''
+        Same as read_imbalance_prices, for the market index.
+        '''
+        if output == "numpy":
+            return self._read_api_arrays(start_date, end_date, "market_index")
         return self._read_api_data(start_date, end_date, "market_index")
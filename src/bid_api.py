@@ -1,7 +1,28 @@
 #!/usr/bin/env python3
+from contextlib import contextmanager
 from datetime import datetime
-from flask import Flask, jsonify, request
+from flask import Flask, abort, g, jsonify, request
 from auction_db import AuctionDbEndpoint
+from archive import Archive
+from connection_pool import ConnectionPool
+from group_commit import GroupCommitWriter
+from key_cache import KeyCache
+from market_cache import MarketIndexCache
+from ingestion import IngestionQueue
+import columnar
+import gzip
+import hmac
+import metrics
+from sql_trace import SqlTracer
+import queue
+import time
+
+
+# ?stream= values of the order reads
+stream_mimetypes = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
 
 
 # To allow patching and mocking
@@ -9,32 +30,351 @@ def get_time():
     return datetime.now()
 
 
-def get_app(database_file, logger, endpoint_name):
+def get_app(database_file,
+            logger,
+            endpoint_name,
+            pool_size=0,
+            journal_mode=None,
+            synchronous=None,
+            group_commit_window=None,
+            key_cache_size=1024,
+            ingestion_queue_size=0,
+            enable_metrics=True,
+            sql_slow_threshold=None,
+            admin_key=None,
+            read_pool_size=0,
+            busy_timeout=None,
+            archive_dir=None,
+            market_cache_size=64):
+    '''
+    With pool_size > 0 the requests share a fixed number of
+    long-lived connections instead of opening one each.
+    journal_mode and synchronous are the sqlite pragmas
+    (e.g. "WAL" and "NORMAL").
+    With group_commit_window (in seconds) the orders submitted
+    by concurrent requests within the window are committed together.
+    key_cache_size bounds the in-process cache of key ids (0 disables it).
+    With ingestion_queue_size > 0, /set validates the orders,
+    queues them and answers with a receipt that can be polled at /receipt;
+    a background thread writes them in batches.
+    With enable_metrics, request and database timings, order counters
+    and the hits and misses of the caches are exposed in the Prometheus text format at /metrics.
+    With sql_slow_threshold (in seconds) the statements are traced
+    (app.extensions["sql_tracer"]) and the slower ones logged with their plan.
+    Requests to /get_bulk made with admin_key read the orders of
+    all the participants.
+    /get and /get_bulk stream the orders with ?stream=ndjson or ?stream=json,
+    or answer in a columnar binary format (Arrow IPC or msgpack,
+    gzipped on request) if the Accept header prefers it.
+    With read_pool_size > 0 the order reads go through a separate pool
+    of read-only connections, each request reading one snapshot;
+    this needs (and sets, if journal_mode is None) the WAL journal mode,
+    so that the reads never wait for the writes.
+    busy_timeout (in seconds) is how long the connections wait for the
+    locks of the others, e.g. of other worker processes.
+    With archive_dir, the reads of the days archived there
+    (see archive.py, needs pyarrow) are answered from the archive.
+    market_cache_size bounds the in-process cache of the market index
+    of the days orders are submitted for (0 disables it).
+    '''
+    if group_commit_window is not None and ingestion_queue_size:
+        raise ValueError("Group commit and the ingestion queue"
+                         " are alternative write paths.")
+    if read_pool_size:
+        if journal_mode is None:
+            journal_mode = "WAL"
+        elif journal_mode.upper() != "WAL":
+            raise ValueError("The read-only pool needs the WAL journal mode.")
     app = Flask(__name__)
 
+    bid_metrics = metrics.BidMetrics() if enable_metrics else None
+    app.extensions["metrics"] = bid_metrics
+
+    tracer = (SqlTracer(sql_slow_threshold, logger)
+              if sql_slow_threshold is not None else None)
+    app.extensions["sql_tracer"] = tracer
+
+    key_cache = KeyCache(key_cache_size) if key_cache_size else None
+    app.extensions["key_cache"] = key_cache
+
+    market_cache = (MarketIndexCache(market_cache_size)
+                    if market_cache_size else None)
+    app.extensions["market_cache"] = market_cache
+
+    if bid_metrics is not None:
+        if key_cache is not None:
+            bid_metrics.watch_cache("key_cache", key_cache)
+        if market_cache is not None:
+            bid_metrics.watch_cache("market_cache", market_cache)
+
+    order_archive = (Archive(archive_dir)
+                     if archive_dir is not None else None)
+    app.extensions["archive"] = order_archive
+
+    pool = (ConnectionPool(database_file,
+                           pool_size,
+                           logger=logger,
+                           journal_mode=journal_mode,
+                           synchronous=synchronous,
+                           busy_timeout=busy_timeout) if pool_size else None)
+    app.extensions["connection_pool"] = pool
+
+    if read_pool_size:
+        # The journal mode must be WAL before the readers connect.
+        bid_db = AuctionDbEndpoint(database_file, logger=logger)
+        bid_db.set_durability(journal_mode)
+        bid_db.close()
+    read_pool = (ConnectionPool(database_file,
+                                read_pool_size,
+                                logger=logger,
+                                read_only=True,
+                                busy_timeout=busy_timeout)
+                 if read_pool_size else None)
+    app.extensions["read_pool"] = read_pool
+
+    writer = (GroupCommitWriter(database_file,
+                                window=group_commit_window,
+                                logger=logger,
+                                journal_mode=journal_mode,
+                                synchronous=synchronous,
+                                busy_timeout=busy_timeout,
+                                key_cache=key_cache,
+                                metrics=bid_metrics,
+                                tracer=tracer,
+                                market_cache=market_cache)
+              if group_commit_window is not None else None)
+    app.extensions["group_commit_writer"] = writer
+
+    ingestion = (IngestionQueue(database_file,
+                                maxsize=ingestion_queue_size,
+                                logger=logger,
+                                journal_mode=journal_mode,
+                                synchronous=synchronous,
+                                busy_timeout=busy_timeout,
+                                metrics=bid_metrics,
+                                tracer=tracer,
+                                market_cache=market_cache)
+                 if ingestion_queue_size else None)
+    app.extensions["ingestion_queue"] = ingestion
+
+    @contextmanager
+    def auction_db(read_only=False):
+        '''
+        An endpoint on a connection borrowed from the read-only pool
+        (if read_only and there is one) or the pool, or on a new one.
+        '''
+        start = time.perf_counter()
+        borrowed = read_pool if read_only and read_pool is not None else pool
+        if borrowed is None:
+            bid_db = AuctionDbEndpoint(database_file,
+                                       logger=logger,
+                                       key_cache=key_cache,
+                                       metrics=bid_metrics,
+                                       tracer=tracer,
+                                       archive=order_archive,
+                                       market_cache=market_cache)
+            bid_db.set_durability(journal_mode, synchronous, busy_timeout)
+            if bid_metrics is not None:
+                bid_metrics.stage_duration.observe(
+                    time.perf_counter() - start, ("connect", ))
+            try:
+                yield bid_db
+            finally:
+                bid_db.close()
+        else:
+            with borrowed.connection() as connection:
+                if bid_metrics is not None:
+                    bid_metrics.stage_duration.observe(
+                        time.perf_counter() - start, ("connect", ))
+                yield AuctionDbEndpoint(database_file,
+                                        logger=logger,
+                                        connection=connection,
+                                        key_cache=key_cache,
+                                        metrics=bid_metrics,
+                                        tracer=tracer,
+                                        archive=order_archive,
+                                        market_cache=market_cache)
+
+    def stream_orders(select, stream):
+        '''
+        Stream the chunks of orders returned by select(bid_db)
+        as NDJSON (one order per line) or as a JSON array,
+        holding only one chunk in memory at a time.
+        '''
+        dumps = app.json.dumps
+
+        def generate():
+            with auction_db(read_only=True) as bid_db:
+                chunks = select(bid_db)
+                if chunks is None:
+                    yield "null\n"
+                    return
+                if stream == "ndjson":
+                    for chunk in chunks:
+                        yield "".join(dumps(o) + "\n" for o in chunk)
+                else:
+                    separator = "["
+                    for chunk in chunks:
+                        yield separator + ",".join(dumps(o) for o in chunk)
+                        separator = ","
+                    yield "[]\n" if separator == "[" else "]\n"
+
+        return app.response_class(generate(),
+                                  mimetype=stream_mimetypes[stream])
+
+    def orders_response(read):
+        '''
+        The orders from read(bid_db, output), as JSON or in the columnar
+        format preferred by the Accept header.
+        '''
+        mimetype = request.accept_mimetypes.best_match(
+            ["application/json"] + columnar.available_mimetypes(),
+            default="application/json")
+        binary = mimetype != "application/json"
+        with auction_db(read_only=True) as bid_db:
+            orders = read(bid_db, "numpy" if binary else "records")
+
+        if not binary:
+            response = jsonify(orders)
+        elif orders is None:
+            response = jsonify({"message": "unknown key"})
+            response.status_code = 404
+        else:
+            body = columnar.encode(orders, mimetype)
+            response = app.response_class(body, mimetype=mimetype)
+            if request.accept_encodings["gzip"]:
+                response.set_data(gzip.compress(body, compresslevel=1))
+                response.content_encoding = "gzip"
+        response.vary.update(["Accept", "Accept-Encoding"])
+        return response
+
+    routes = {
+        f"/{endpoint_name}/set": "set",
+        f"/{endpoint_name}/get": "get",
+        f"/{endpoint_name}/get_bulk": "get_bulk",
+    }
+
+    if bid_metrics is not None:
+
+        @app.before_request
+        def start_timer():
+            g.request_start = time.perf_counter()
+
+        @app.after_request
+        def observe_request(response):
+            route = routes.get(request.path)
+            if route is not None:
+                bid_metrics.observe_request(
+                    route,
+                    time.perf_counter() - g.request_start,
+                    request.content_length, response.content_length)
+            return response
+
+        @app.route("/metrics", methods=["GET"])
+        def get_metrics():
+            return app.response_class(bid_metrics.render(),
+                                      content_type=metrics.content_type)
+
     @app.route(f"/{endpoint_name}/set", methods=["POST"])
     def submit_orders():
         incoming = request.get_json()
         key = incoming["key"]
         ts = get_time()
         orders = [o | {"timestamp": ts} for o in incoming["orders"]]
+        if bid_metrics is not None:
+            bid_metrics.orders_per_request.observe(len(orders))
 
-        auction_db = AuctionDbEndpoint(database_file, logger=logger)
-        accepted, message = auction_db.write_orders(key, orders)
+        if ingestion is not None:
+            with auction_db() as bid_db:
+                _key_id, rows, message = bid_db.prepare_orders(key, orders)
+            try:
+                receipt = ingestion.enqueue(rows)
+            except queue.Full:
+                return jsonify({
+                    "accepted": 0,
+                    "message": "ingestion queue full, retry later;"
+                }), 503
+            return jsonify({
+                "accepted": len(rows),
+                "message": message,
+                "receipt": receipt
+            })
+        elif writer is not None:
+            accepted, message = writer.submit(key, orders)
+        else:
+            with auction_db() as bid_db:
+                accepted, message = bid_db.write_orders(key, orders)
 
         return jsonify({"accepted": accepted, "message": message})
 
     @app.route(f"/{endpoint_name}/get", methods=["GET"])
     def get_orders():
-        bid_db = AuctionDbEndpoint(database_file, logger=logger)
         applying_date = datetime.strptime(request.args["applying_date"],
                                           "%Y-%m-%d").date()
         key = request.args["key"]
         hour_ID = (request.args["hour_ID"]
                    if "hour_ID" in request.args else None)
+        stream = request.args.get("stream")
+        if stream is not None:
+            if stream not in stream_mimetypes:
+                abort(400)
+            return stream_orders(
+                lambda bid_db: bid_db.iter_orders(key, applying_date, hour_ID),
+                stream)
 
-        orders = bid_db.read_orders(key, applying_date, hour_ID)
+        return orders_response(lambda bid_db, output: bid_db.read_orders(
+            key, applying_date, hour_ID, output=output))
+
+    @app.route(f"/{endpoint_name}/get_bulk", methods=["GET"])
+    def get_orders_bulk():
+        '''
+        Orders from start_date to end_date included,
+        optionally only for the hour_IDs given (the parameter can repeat).
+        '''
+        stream = request.args.get("stream")
+        if stream is not None and stream not in stream_mimetypes:
+            abort(400)
+        try:
+            start_date = datetime.strptime(request.args["start_date"],
+                                           "%Y-%m-%d").date()
+            end_date = datetime.strptime(request.args["end_date"],
+                                         "%Y-%m-%d").date()
+            hours = [int(h) for h in request.args.getlist("hour_ID")]
+        except ValueError:
+            abort(400)
+        key = request.args["key"]
+        admin = admin_key is not None and hmac.compare_digest(
+            key.encode(), admin_key.encode())
+        keys = None if admin else [key]
+        if stream is not None:
+            return stream_orders(
+                lambda bid_db: bid_db.iter_orders_bulk(
+                    keys, start_date, end_date, hours or None), stream)
 
-        return jsonify(orders)
+        return orders_response(lambda bid_db, output: bid_db.read_orders_bulk(
+            keys, start_date, end_date, hours or None, output=output))
+
+    @app.route(f"/{endpoint_name}/receipt", methods=["GET"])
+    def get_receipt():
+        if ingestion is None:
+            return jsonify({"message": "ingestion queue not enabled"}), 404
+        receipt = request.args["receipt"]
+        status = ingestion.status(receipt)
+        if status is None:
+            return jsonify({"message": "unknown receipt"}), 404
+        return jsonify(status | {"receipt": receipt})
 
     return app
+
+
+def close_app(app):
+    '''
+    Release the connections and threads held by an app from get_app.
+    '''
+    if app.extensions["ingestion_queue"] is not None:
+        app.extensions["ingestion_queue"].close()
+    if app.extensions["group_commit_writer"] is not None:
+        app.extensions["group_commit_writer"].close()
+    for name in ["connection_pool", "read_pool"]:
+        if app.extensions[name] is not None:
+            app.extensions[name].close()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import query_bmrs as bmrs
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+import time
+
+import pandas as pd
+import requests
+
+
+def date_range(start_date, end_date):
+    '''
+    The days from start_date to end_date, both included.
+    '''
+    return [
+        start_date + timedelta(days=i)
+        for i in range((end_date - start_date).days + 1)
+    ]
+
+
+def with_retries(f, retries=3, backoff=0.5):
+    '''
+    Call f, retrying on network errors and on truncated responses
+    (which fail the record count check) after backoff, 2*backoff, ...
+    seconds.
+    '''
+    for attempt in range(retries + 1):
+        try:
+            return f()
+        except (requests.RequestException, bmrs.InvalidResponse):
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt)
+
+
+# table name -> (function fetching one day, writer method of AuctionDbEndpoint)
+fetchers = {
+    "market_index":
+    (lambda day, session: bmrs.get_market_index_converted(day,
+                                                          session=session),
+     "write_market_index"),
+    "imbalance_prices":
+    (lambda day, session: bmrs.get_imbalance_prices(day, session=session),
+     "write_imbalance_prices"),
+}
+
+
+def backfill(bid_db,
+             start_date,
+             end_date,
+             tables=("market_index", "imbalance_prices"),
+             max_workers=8,
+             batch_days=16,
+             retries=3,
+             backoff=0.5,
+             session=None,
+             logger=None):
+    '''
+    Fetch one request per day and table over a pool of threads
+    sharing one session, and write the results to bid_db in batches
+    of batch_days days as they come in (the writes happen in the calling
+    thread).
+    Returns the number of rows written per table and the list of
+    (table, day, error) that failed after all the retries.
+    '''
+    if session is None:
+        session = bmrs.make_session(max_workers)
+    days = date_range(start_date, end_date)
+    written = {table: 0 for table in tables}
+    failed = []
+    pending = {table: [] for table in tables}
+
+    def flush(table):
+        if pending[table]:
+            df = pd.concat(pending[table], ignore_index=True)
+            getattr(bid_db, fetchers[table][1])(df)
+            written[table] += len(df)
+            pending[table] = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for table in tables:
+            fetch = fetchers[table][0]
+            for day in days:
+                future = executor.submit(with_retries,
+                                         lambda f=fetch, d=day: f(d, session),
+                                         retries, backoff)
+                futures[future] = (table, day)
+
+        for future in as_completed(futures):
+            table, day = futures[future]
+            try:
+                pending[table].append(future.result())
+            except Exception as e:
+                failed.append((table, day, e))
+                if logger:
+                    logger.warning("Failed to fetch %s for %s: %s", table,
+                                   day, e)
+                continue
+            if len(pending[table]) >= batch_days:
+                flush(table)
+
+    for table in tables:
+        flush(table)
+
+    if logger:
+        logger.info("Backfilled %s - %s: %s, %d failures.", start_date,
+                    end_date, written, len(failed))
+    return written, failed
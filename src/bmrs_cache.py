@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+from datetime import date, datetime
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Parameters holding the (last) settlement date of a request.
+date_params = ["SettlementDate", "ToSettlementDate"]
+
+
+class _EntryWriter:
+    '''
+    Writes the lines of a response to a temporary file as they arrive;
+    the entry appears in the cache only when commit() is called.
+    '''
+
+    def __init__(self, cache, path, expires):
+        self.cache = cache
+        self.path = path
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.directory,
+                                             prefix=".tmp-")
+        self._file = gzip.open(os.fdopen(fd, "wb"), "wt", encoding="utf-8")
+        self._file.write(json.dumps({"expires": expires}) + "\n")
+
+    def write(self, line):
+        self._file.write(line + "\n")
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        self.cache._evict()
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.tmp_path)
+
+
+class ResponseCache:
+    '''
+    On-disk cache of raw BMRS responses, gzipped, one file per request.
+
+    Entries are keyed by report name, version and parameters
+    (the APIKey excluded). Responses for settlement dates in the past
+    never expire; those for today or later expire after today_ttl seconds.
+    The total size of the files is kept under max_bytes by removing
+    the least recently used entries.
+    '''
+
+    def __init__(self, directory, max_bytes=512 * 2**20, today_ttl=15 * 60):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.today_ttl = today_ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(report, version, params):
+        relevant = {k: v for k, v in params.items() if k != "APIKey"}
+        text = json.dumps([report, version, relevant], sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, report, version, params):
+        return os.path.join(self.directory,
+                            self.key(report, version, params) + ".csv.gz")
+
+    def _expires(self, params):
+        dates = [
+            datetime.strptime(params[p], "%Y-%m-%d").date()
+            for p in date_params if p in params
+        ]
+        if dates and max(dates) < date.today():
+            return None  # settled: never changes
+        return time.time() + self.today_ttl
+
+    def get(self, report, version, params):
+        '''
+        An iterator over the lines of the cached response, or None.
+        '''
+        path = self._path(report, version, params)
+        try:
+            f = gzip.open(path, "rt", encoding="utf-8")
+            meta = json.loads(f.readline())
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if meta["expires"] is not None and meta["expires"] < time.time():
+            f.close()
+            with self._lock:
+                self.misses += 1
+                self.expired += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+
+        with self._lock:
+            self.hits += 1
+        os.utime(path)  # most recently used
+        return self._read_lines(f)
+
+    @staticmethod
+    def _read_lines(f):
+        with f:
+            for line in f:
+                yield line.rstrip("\n")
+
+    def writer(self, report, version, params):
+        return _EntryWriter(self, self._path(report, version, params),
+                            self._expires(params))
+
+    def _entries(self):
+        res = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".csv.gz"):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                res.append((st.st_mtime, st.st_size, entry.path))
+        return res
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evicted += 1
+
+    def report(self):
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+            }
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+'''
+Incremental sync of the BMRS data in the database:
+only the settlement periods that are over and not stored yet are fetched,
+and only the rows that differ from the stored ones are written.
+'''
+import query_bmrs as bmrs
+import converter
+from bmrs_backfill import date_range, with_retries
+from common_db_operations import date_to_sqlite
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, time, timedelta
+
+import pandas as pd
+
+periods_per_day = 48
+period_length = timedelta(minutes=30)
+
+# table name -> (function fetching one period or a whole day,
+#                name of the upsert method of AuctionDbEndpoint,
+#                function renaming the columns as in the table)
+# The periods found missing are fetched from the API even if cached:
+# the response cached may be one from before BMRS published them.
+sync_tables = {
+    "market_index":
+    (lambda day, period, session: bmrs.get_market_index_converted(
+        day, period=period, session=session, refresh=True),
+     "upsert_market_index",
+     converter.convert_market_index_columns),
+    "imbalance_prices":
+    (lambda day, period, session: bmrs.get_imbalance_prices(
+        day, period=period, session=session, refresh=True),
+     "upsert_imbalance_prices",
+     converter.convert_imbalance_prices_columns),
+}
+
+
+def settled_periods(day, now):
+    '''
+    The settlement periods of day that are over at time now.
+    '''
+    nover = (now - datetime.combine(day, time(0))) // period_length
+    return range(1, min(max(nover, 0), periods_per_day) + 1)
+
+
+def high_water_mark(bid_db, table):
+    '''
+    The latest (date, period) stored in table, or None.
+    '''
+    return bid_db.execute(f'''
+    SELECT date, period
+    FROM {table}
+    ORDER BY date DESC, period DESC
+    LIMIT 1;
+    ''').fetchone()
+
+
+def stored_periods(bid_db, table, start_date, end_date):
+    return set(
+        bid_db.execute(
+            f'''
+    SELECT date, period
+    FROM {table}
+    WHERE date >= ? AND date <= ?;
+    ''', (date_to_sqlite(start_date), date_to_sqlite(end_date))).fetchall())
+
+
+def missing_periods(stored, start_date, now):
+    '''
+    {day: [periods]} of the settled periods from start_date to now
+    that are not in stored.
+    '''
+    missing = {}
+    for day in date_range(start_date, now.date()):
+        periods = [
+            p for p in settled_periods(day, now) if (day, p) not in stored
+        ]
+        if periods:
+            missing[day] = periods
+    return missing
+
+
+def plan_requests(missing, max_period_requests=4):
+    '''
+    One request per missing period,
+    or one for the whole day if too many periods of it are missing.
+    '''
+    planned = []
+    for day, periods in missing.items():
+        if len(periods) > max_period_requests:
+            planned.append((day, '*'))
+        else:
+            planned.extend((day, p) for p in periods)
+    return planned
+
+
+def sync(bid_db,
+         now=None,
+         lookback_days=2,
+         tables=("market_index", "imbalance_prices"),
+         max_workers=8,
+         max_period_requests=4,
+         retries=3,
+         backoff=0.5,
+         session=None,
+         logger=None):
+    '''
+    For each table, look for the missing periods from lookback_days
+    before the latest stored day (or before today, for an empty table)
+    up to now, fetch them and upsert what changed.
+    Returns a report per table.
+    '''
+    if now is None:
+        now = datetime.now()
+    if session is None:
+        session = bmrs.make_session(max_workers)
+
+    report = {}
+    plans = {}
+    stored = {}
+    for table in tables:
+        hwm = high_water_mark(bid_db, table)
+        last_day = hwm[0] if hwm is not None else now.date()
+        start_date = min(last_day, now.date()) - timedelta(days=lookback_days)
+        stored[table] = stored_periods(bid_db, table, start_date, now.date())
+        missing = missing_periods(stored[table], start_date, now)
+        plans[table] = plan_requests(missing, max_period_requests)
+        report[table] = {
+            "high_water_mark": hwm,
+            "from": start_date,
+            "missing": sum(len(ps) for ps in missing.values()),
+            "requests": len(plans[table]),
+            "failed": [],
+            "fetched": 0,
+            "inserted": 0,
+            "updated": 0,
+        }
+
+    results = {table: [] for table in tables}
+    if any(plans.values()):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for table in tables:
+                fetch = sync_tables[table][0]
+                for day, period in plans[table]:
+                    future = executor.submit(
+                        with_retries,
+                        lambda f=fetch, d=day, p=period: f(d, p, session),
+                        retries, backoff)
+                    futures[future] = (table, day, period)
+
+            for future in as_completed(futures):
+                table, day, period = futures[future]
+                try:
+                    results[table].append(future.result())
+                except Exception as e:
+                    report[table]["failed"].append((day, period, e))
+                    if logger:
+                        logger.warning(
+                            "Failed to fetch %s for %s period %s: %s", table,
+                            day, period, e)
+
+    for table in tables:
+        if not results[table]:
+            continue
+        df = pd.concat(results[table], ignore_index=True)
+        renamed = sync_tables[table][2](df)
+        new = {(d, int(p))
+               for d, p in zip(renamed["date"], renamed["period"])
+               } - stored[table]
+        changed = getattr(bid_db, sync_tables[table][1])(df)
+        report[table]["fetched"] = len(df)
+        report[table]["inserted"] = len(new)
+        report[table]["updated"] = changed - len(new)
+
+    if logger:
+        logger.info("Sync report: %s", report)
+    return report
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+'''
+Client side of the order reads of bid_api, asking for the columnar
+formats and loading them into DataFrames without copying the columns
+where the format allows it.
+'''
+import columnar
+
+from datetime import date
+
+import pandas as pd
+import requests
+
+
+def accept_header(mimetype=None):
+    '''
+    The Accept header asking for mimetype,
+    or for the binary formats this client can decode.
+    '''
+    preferred = ([mimetype]
+                 if mimetype is not None else columnar.available_mimetypes())
+    return ", ".join(preferred + ["application/json;q=0.1"])
+
+
+def decode_orders(content, mimetype):
+    '''
+    A DataFrame of the orders in content (already decompressed).
+    '''
+    if mimetype == columnar.arrow_mimetype:
+        pa = columnar.pa
+        table = pa.ipc.open_stream(pa.py_buffer(content)).read_all()
+        return table.to_pandas(split_blocks=True,
+                               self_destruct=True,
+                               date_as_object=False)
+    if mimetype == columnar.msgpack_mimetype:
+        return pd.DataFrame(columnar.decode_msgpack(content), copy=False)
+    raise ValueError(f"Cannot decode {mimetype}.")
+
+
+def _get(url, params, session, mimetype, compress):
+    session = session if session is not None else requests
+    headers = {"Accept": accept_header(mimetype)}
+    if not compress:
+        headers["Accept-Encoding"] = "identity"
+    r = session.get(url, params=params, headers=headers)
+    if r.status_code == 404:
+        return None  # unknown key
+    r.raise_for_status()
+    received = r.headers.get("Content-Type", "").split(";")[0]
+    if received == "application/json":
+        res = r.json()
+        return pd.DataFrame(res) if res is not None else None
+    return decode_orders(r.content, received)
+
+
+def get_orders(url,
+               endpoint_name,
+               key,
+               applying_date,
+               hour_ID=None,
+               session=None,
+               mimetype=None,
+               compress=True):
+    '''
+    The orders of /get as a DataFrame, or None if the key is unknown.
+    '''
+    params = {"key": key, "applying_date": _isoformat(applying_date)}
+    if hour_ID is not None:
+        params["hour_ID"] = hour_ID
+    return _get(f"{url.rstrip('/')}/{endpoint_name}/get", params, session,
+                mimetype, compress)
+
+
+def get_orders_bulk(url,
+                    endpoint_name,
+                    key,
+                    start_date,
+                    end_date,
+                    hours=None,
+                    session=None,
+                    mimetype=None,
+                    compress=True):
+    '''
+    The orders of /get_bulk as a DataFrame, or None if the key is unknown.
+    '''
+    params = {
+        "key": key,
+        "start_date": _isoformat(start_date),
+        "end_date": _isoformat(end_date),
+    }
+    if hours is not None:
+        params["hour_ID"] = list(hours)
+    return _get(f"{url.rstrip('/')}/{endpoint_name}/get_bulk", params,
+                session, mimetype, compress)
+
+
+def _isoformat(d):
+    return d.isoformat() if isinstance(d, date) else d
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+'''
+Binary columnar encodings of the orders, for the clients that load them
+into DataFrames: Arrow IPC streams (needs pyarrow) or msgpack maps
+of raw column buffers (needs msgpack). Both are optional.
+'''
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+arrow_mimetype = "application/vnd.apache.arrow.stream"
+msgpack_mimetype = "application/x-msgpack"
+msgpack_format = "columns-v1"
+
+
+def available_mimetypes():
+    '''
+    The binary formats that can be produced here, by preference.
+    '''
+    res = []
+    if pa is not None:
+        res.append(arrow_mimetype)
+    if msgpack is not None:
+        res.append(msgpack_mimetype)
+    return res
+
+
+def _arrow_encode(columns):
+    table = pa.table({
+        name: pa.array(values, from_pandas=True)
+        for name, values in columns.items()
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _msgpack_column(name, values):
+    if values.dtype == object:
+        return {"name": name, "dtype": "str", "data": values.tolist()}
+    # Fixed byte order, so that the buffer can be used as it is.
+    values = values.astype(values.dtype.newbyteorder("<"), copy=False)
+    return {"name": name, "dtype": values.dtype.str, "data": values.tobytes()}
+
+
+def _msgpack_encode(columns):
+    return msgpack.packb({
+        "format":
+        msgpack_format,
+        "columns":
+        [_msgpack_column(name, values) for name, values in columns.items()],
+    })
+
+
+def encode(columns, mimetype):
+    '''
+    columns is a dict of numpy arrays, as from
+    AuctionDbEndpoint.read_orders(..., output="numpy").
+    '''
+    if mimetype == arrow_mimetype and pa is not None:
+        return _arrow_encode(columns)
+    if mimetype == msgpack_mimetype and msgpack is not None:
+        return _msgpack_encode(columns)
+    raise ValueError(f"Cannot encode to {mimetype}.")
+
+
+def decode_msgpack(content):
+    '''
+    A dict of numpy arrays; the numeric and date columns are views
+    on content, not copies.
+    '''
+    message = msgpack.unpackb(content)
+    if message.get("format") != msgpack_format:
+        raise ValueError(f"Unknown format {message.get('format')}.")
+    columns = {}
+    for column in message["columns"]:
+        if column["dtype"] == "str":
+            columns[column["name"]] = np.array(column["data"], dtype=object)
+        else:
+            columns[column["name"]] = np.frombuffer(column["data"],
+                                                    dtype=column["dtype"])
+    return columns
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import sqlite3
 from datetime import datetime, date
+from pathlib import Path
 
 
 def datetime_to_sqlite(td):
@@ -11,36 +12,92 @@ def date_to_sqlite(td):
     return date.isoformat(td)
 
 
+def connect(filename, check_same_thread=True, read_only=False):
+    '''
+    read_only connections are opened with the "mode=ro" URI:
+    any write through them fails.
+    '''
+    if read_only:
+        filename = Path(filename).resolve().as_uri() + "?mode=ro"
+    return sqlite3.connect(filename,
+                           detect_types=sqlite3.PARSE_DECLTYPES,
+                           check_same_thread=check_same_thread,
+                           uri=read_only)
+
+
+journal_modes = ["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"]
+synchronous_levels = ["OFF", "NORMAL", "FULL", "EXTRA"]
+
+
+def set_durability(connection,
+                   journal_mode=None,
+                   synchronous=None,
+                   busy_timeout=None):
+    '''
+    journal_mode is stored in the database file (WAL persists),
+    synchronous applies to this connection only.
+    busy_timeout (in seconds) is how long this connection waits for the
+    locks held by other connections, in this process or others,
+    before failing with "database is locked".
+    '''
+    if journal_mode is not None:
+        if journal_mode.upper() not in journal_modes:
+            raise ValueError(f"Unknown journal mode {journal_mode}.")
+        connection.execute(f"PRAGMA journal_mode = {journal_mode.upper()};")
+    if synchronous is not None:
+        if synchronous.upper() not in synchronous_levels:
+            raise ValueError(f"Unknown synchronous level {synchronous}.")
+        connection.execute(f"PRAGMA synchronous = {synchronous.upper()};")
+    if busy_timeout is not None:
+        connection.execute(
+            f"PRAGMA busy_timeout = {int(busy_timeout * 1000)};")
+
+
+def create_index(cursor, table, name, columns):
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {name}"
+                   f" ON {table} ({','.join(columns)});")
+
+
+sqlite_types = {
+    int: "INTEGER",
+    float: "REAL",
+    str: "TEXT",
+    datetime: "TIMESTAMP",
+    date: "DATE",
+}
+
+
+def create_table(cursor, name, spec, if_not_exists=False):
+    '''
+    spec is a table of the schema of setup_db (its indexes are not created).
+    '''
+    fieldspec = ','.join([
+        f"{field} {sqlite_types[t]} {mod}" for field, t, mod in spec["fields"]
+    ])
+    constraints = spec["constraints"].strip()
+    constraints = f", {constraints}" if constraints else ''
+    condition = "IF NOT EXISTS " if if_not_exists else ''
+
+    cursor.execute(f"CREATE TABLE {condition}{name}"
+                   f" ({fieldspec}{constraints});")
+
+
 def setup_db(filename, schema):
     '''
     schema is a dictionary "table name": <field specification>,
     where <field specification> is a list of pairs ("field name",<python type>)
+    and optionally "indexes", a list of pairs ("index name", [columns])
     '''
     conn = sqlite3.connect(filename,
                            detect_types=sqlite3.PARSE_DECLTYPES
                            | sqlite3.PARSE_COLNAMES)
     c = conn.cursor()
 
-    def convert_fields(table_fields):
-        sqlite_types = {
-            int: "INTEGER",
-            float: "REAL",
-            str: "TEXT",
-            datetime: "TIMESTAMP",
-            date: "DATE",
-        }
-        return [(k, sqlite_types[v], mod) for k, v, mod in table_fields]
-
-    def schema_to_tuples(tables):
-        return [(k, convert_fields(v["fields"]), v["constraints"])
-                for k, v in tables.items()]
-
-    for table in schema_to_tuples(schema):
-        k, vs, constrs = table
-        fieldspec = ','.join([f"{name} {t} {mod}" for name, t, mod in vs])
-        constraints = constrs.strip()
-        constraints = f", {constraints}" if constraints else ''
-
-        c.execute(f"CREATE TABLE {k} ({fieldspec}{constraints});")
+    for table, v in schema.items():
+        create_table(c, table, v)
+
+    for table, v in schema.items():
+        for name, columns in v.get("indexes", []):
+            create_index(c, table, name, columns)
 
     return c, conn
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+from auction_db import AuctionDbEndpoint
+from common_db_operations import connect, set_durability
+
+from contextlib import contextmanager
+import queue
+import sqlite3
+
+
+class ConnectionPool:
+    '''
+    A fixed number of long-lived sqlite connections to the same database file.
+
+    Connections are borrowed with the ``connection()`` context manager,
+    one per request (or per eventlet greenlet) and are given back
+    when the block exits. A connection that fails the health check
+    when it is borrowed is replaced by a fresh one.
+
+    With read_only, the connections are opened in "mode=ro" and each
+    borrowing is one read transaction: all the queries of the block see
+    the same snapshot of the database. In WAL mode the snapshot is read
+    without waiting for the writers, whatever they are doing.
+    '''
+
+    def __init__(self,
+                 filename,
+                 size,
+                 logger=None,
+                 checkout_timeout=None,
+                 journal_mode=None,
+                 synchronous=None,
+                 read_only=False,
+                 busy_timeout=None):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1.")
+        self.filename = filename
+        self.size = size
+        self.logger = logger
+        self.checkout_timeout = checkout_timeout
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.read_only = read_only
+        self.busy_timeout = busy_timeout
+
+        # Create the schema if the file is new.
+        AuctionDbEndpoint(filename, logger=logger).close()
+
+        # LIFO: the most recently used connections stay warm.
+        self._idle = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._idle.put(self._connect())
+        if self.logger:
+            self.logger.info("Opened pool of %d%s connections.", size,
+                             " read-only" if read_only else "")
+
+    def _connect(self):
+        # Connections move between threads/greenlets,
+        # but only one of them uses a connection at any given time.
+        if self.read_only:
+            # The journal mode is set by the writers.
+            connection = connect(self.filename,
+                                 check_same_thread=False,
+                                 read_only=True)
+            set_durability(connection, busy_timeout=self.busy_timeout)
+            return connection
+        connection = connect(self.filename, check_same_thread=False)
+        set_durability(connection, self.journal_mode, self.synchronous,
+                       self.busy_timeout)
+        return connection
+
+    @staticmethod
+    def is_healthy(connection):
+        try:
+            connection.execute("SELECT 1;").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _replace(self, connection):
+        if self.logger:
+            self.logger.warning("Replacing unhealthy pooled connection")
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise TimeoutError("No database connection available.")
+        try:
+            if not self.is_healthy(conn):
+                conn = self._replace(conn)
+            if self.read_only:
+                # Rolled back when given back.
+                conn.execute("BEGIN;")
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                conn = self._replace(conn)
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
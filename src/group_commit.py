@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+from auction_db import AuctionDbEndpoint
+from common_db_operations import connect
+
+from datetime import time
+import queue
+import threading
+import time as timer
+
+
+class _PendingWrite:
+
+    def __init__(self, key, orders):
+        self.key = key
+        self.orders = orders
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GroupCommitWriter:
+    '''
+    Merges the orders of concurrent submitters into one transaction.
+
+    The first submission opens a window of ``window`` seconds;
+    everything submitted in the meantime (up to ``max_batch`` requests)
+    is written by a single background thread and committed with one fsync.
+    Each caller still gets its own (accepted, message) back,
+    or the exception its own orders raised.
+    '''
+
+    def __init__(self,
+                 filename,
+                 window=0.005,
+                 max_batch=256,
+                 logger=None,
+                 order_deadline=time(9),
+                 journal_mode=None,
+                 synchronous=None,
+                 busy_timeout=None,
+                 key_cache=None,
+                 metrics=None,
+                 tracer=None,
+                 market_cache=None):
+        self.window = window
+        self.max_batch = max_batch
+        self.logger = logger
+        self.ncommits = 0
+        self.nrequests = 0
+
+        # Create the schema if the file is new.
+        AuctionDbEndpoint(filename, logger=logger).close()
+
+        # Used only by the writer thread.
+        self._bid_db = AuctionDbEndpoint(filename,
+                                         logger=logger,
+                                         order_deadline=order_deadline,
+                                         connection=connect(
+                                             filename,
+                                             check_same_thread=False),
+                                         key_cache=key_cache,
+                                         metrics=metrics,
+                                         tracer=tracer,
+                                         market_cache=market_cache)
+        self._bid_db.set_durability(journal_mode, synchronous, busy_timeout)
+
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._run,
+                                        name="group-commit",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, key, orders):
+        '''
+        Blocks until the orders are committed.
+        '''
+        pending = _PendingWrite(key, orders)
+        self._pending.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self, first):
+        batch = [first]
+        stop = False
+        deadline = timer.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - timer.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if pending is None:
+                stop = True
+                break
+            batch.append(pending)
+        return batch, stop
+
+    def _write(self, batch):
+        prepared = []
+        for pending in batch:
+            try:
+                prepared.append(
+                    (pending,
+                     self._bid_db.prepare_orders(pending.key,
+                                                 pending.orders)))
+            except Exception as e:
+                pending.error = e
+
+        try:
+            rows = [row for _, (_, ords, _) in prepared for row in ords]
+            self._bid_db.insert_orders(rows)
+            self._bid_db.commit()
+        except Exception as e:
+            self._bid_db.rollback()
+            for pending, _ in prepared:
+                pending.error = e
+        else:
+            for pending, (key_id, ords, message) in prepared:
+                pending.result = (len(ords), message)
+            self.ncommits += 1
+            self.nrequests += len(batch)
+            if self.logger:
+                self.logger.info("Group-committed %d orders from %d requests.",
+                                 len(rows), len(prepared))
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self._pending.get()
+            if first is None:
+                break
+            batch, stop = self._collect(first)
+            self._write(batch)
+        self._bid_db.close()
+
+    def close(self):
+        self._pending.put(None)
+        self._thread.join()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+from auction_db import AuctionDbEndpoint
+from common_db_operations import connect
+
+from collections import OrderedDict
+import queue
+import threading
+import uuid
+
+QUEUED = "queued"
+PERSISTED = "persisted"
+FAILED = "failed"
+
+
+class IngestionQueue:
+    '''
+    Bounded in-process queue of validated orders,
+    drained into sqlite by a background thread.
+
+    The submitter validates the orders (AuctionDbEndpoint.prepare_orders),
+    enqueues the rows and gets a receipt back straight away;
+    the writer inserts everything that is waiting (up to max_batch
+    submissions) in one transaction. The receipt can then be polled
+    with status() to confirm the orders were persisted.
+    '''
+
+    def __init__(self,
+                 filename,
+                 maxsize=1024,
+                 max_batch=1024,
+                 logger=None,
+                 journal_mode=None,
+                 synchronous=None,
+                 busy_timeout=None,
+                 receipts_kept=100000,
+                 metrics=None,
+                 tracer=None,
+                 market_cache=None):
+        self.max_batch = max_batch
+        self.logger = logger
+        self.receipts_kept = receipts_kept
+        self.ncommits = 0
+
+        # Create the schema if the file is new.
+        AuctionDbEndpoint(filename, logger=logger).close()
+
+        # Used only by the writer thread.
+        self._bid_db = AuctionDbEndpoint(filename,
+                                         logger=logger,
+                                         connection=connect(
+                                             filename,
+                                             check_same_thread=False),
+                                         metrics=metrics,
+                                         tracer=tracer,
+                                         market_cache=market_cache)
+        self._bid_db.set_durability(journal_mode, synchronous, busy_timeout)
+
+        self._receipts = OrderedDict()  # receipt -> status dict
+        self._lock = threading.Lock()
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run,
+                                        name="ingestion",
+                                        daemon=True)
+        self._thread.start()
+
+    def enqueue(self, rows):
+        '''
+        rows are the ones returned by AuctionDbEndpoint.prepare_orders.
+        Raises queue.Full if the writer is too far behind.
+        '''
+        receipt = uuid.uuid4().hex
+        with self._lock:
+            self._receipts[receipt] = {"status": QUEUED, "orders": len(rows)}
+        try:
+            self._queue.put_nowait((receipt, rows))
+        except queue.Full:
+            with self._lock:
+                del self._receipts[receipt]
+            raise
+        return receipt
+
+    def status(self, receipt):
+        '''
+        None if the receipt is unknown (or too old to be remembered).
+        '''
+        with self._lock:
+            status = self._receipts.get(receipt)
+            return dict(status) if status is not None else None
+
+    def _set_status(self, batch, status, error=None):
+        with self._lock:
+            for receipt, _ in batch:
+                self._receipts[receipt]["status"] = status
+                if error is not None:
+                    self._receipts[receipt]["error"] = error
+            while len(self._receipts) > self.receipts_kept:
+                oldest = next(iter(self._receipts))
+                if self._receipts[oldest]["status"] == QUEUED:
+                    break
+                del self._receipts[oldest]
+
+    def _collect(self, first):
+        batch = [first]
+        stop = False
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _write(self, batch):
+        try:
+            self._bid_db.insert_orders(
+                [row for _, rows in batch for row in rows])
+            self._bid_db.commit()
+        except Exception as e:
+            self._bid_db.rollback()
+            self._set_status(batch, FAILED, str(e))
+            if self.logger:
+                self.logger.warning(
+                    "Failed to write %d queued submissions: %s", len(batch),
+                    e)
+        else:
+            self._set_status(batch, PERSISTED)
+            self.ncommits += 1
+            if self.logger:
+                self.logger.info(
+                    "Written %d queued orders from %d submissions.",
+                    sum(len(rows) for _, rows in batch), len(batch))
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is None:
+                self._queue.task_done()
+                break
+            batch, stop = self._collect(first)
+            self._write(batch)
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+        self._bid_db.close()
+
+    def join(self):
+        '''
+        Wait until everything enqueued so far has been written.
+        '''
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+from collections import OrderedDict
+import threading
+import time
+
+
+class KeyCache:
+    '''
+    Bounded LRU map from hashed API keys to key ids.
+
+    Unknown keys are cached too (as None), so write_key and revoke_key
+    must invalidate the entry of the key they change.
+    Changes made by other processes (e.g. programs/add_key.py)
+    become visible after ttl seconds.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=60):
+        if maxsize < 1:
+            raise ValueError("Cache size must be at least 1.")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # hashed key -> (key_id, expiry)
+        self._lock = threading.Lock()
+
+    def lookup(self, hashed_key):
+        '''
+        Returns (found, key_id).
+        '''
+        with self._lock:
+            entry = self._entries.get(hashed_key)
+            if entry is not None:
+                key_id, expiry = entry
+                if expiry is None or time.monotonic() < expiry:
+                    self._entries.move_to_end(hashed_key)
+                    self.hits += 1
+                    return True, key_id
+                del self._entries[hashed_key]
+            self.misses += 1
+            return False, None
+
+    def store(self, hashed_key, key_id):
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[hashed_key] = (key_id, expiry)
+            self._entries.move_to_end(hashed_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, hashed_key):
+        with self._lock:
+            self._entries.pop(hashed_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -1,27 +1,98 @@
 #!/usr/bin/env python3
-
+'''
+Logging to one file through a queue: the loggers only put the records
+on the queue, a background listener thread formats them and writes them,
+so that the threads serving requests never wait for the disk.
+'''
+import atexit
+from datetime import datetime, timezone
+import json
 import logging
+import logging.handlers
+import queue
 
 global_level = logging.DEBUG
 _global_handler = None  # Set the handler
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    One JSON object per line.
+    '''
+
+    def format(self, record):
+        entry = {
+            "time":
+            datetime.fromtimestamp(record.created,
+                                   timezone.utc).isoformat(),
+            "logger": record.name,
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def set_global_handler(filename, json_format=False):
+    '''
+    Start writing the records of the loggers from get_logger to filename,
+    as text or, with json_format, as JSON lines.
+    '''
+    global _global_handler, _listener
+    stop_listener()
+
+    file_handler = logging.FileHandler(filename)
+    file_handler.setLevel(global_level)
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        formatter = logging.Formatter(fmt)
+    file_handler.setFormatter(formatter)
 
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records,
+                                               file_handler,
+                                               respect_handler_level=True)
+    _listener.start()
 
-def set_global_handler(filename):
-    global _global_handler
-    _global_handler = logging.FileHandler(filename)
+    previous = _global_handler
+    _global_handler = logging.handlers.QueueHandler(records)
     _global_handler.setLevel(global_level)
-    fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    formatter = logging.Formatter(fmt)
-    _global_handler.setFormatter(formatter)
+
+    # Loggers created before keep logging, to the new file.
+    for logger in logging.Logger.manager.loggerDict.values():
+        if (isinstance(logger, logging.Logger)
+                and previous in logger.handlers):
+            logger.removeHandler(previous)
+            logger.addHandler(_global_handler)
+
+
+def stop_listener():
+    '''
+    Write what is still queued and close the file.
+    '''
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_listener)
 
 
 def get_logger(name):
     logger = logging.getLogger(name)
     logger.setLevel(global_level)
 
-    if _global_handler is not None:
-        logger.addHandler(_global_handler)
-    else:
+    if _global_handler is None:
         raise ValueError("Handler must be set.")
+    if _global_handler not in logger.handlers:
+        logger.addHandler(_global_handler)
 
     return logger
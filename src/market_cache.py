@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+from collections import OrderedDict
+import threading
+
+
+class MarketIndexCache:
+    '''
+    Bounded LRU map from dates to the market index prices of their
+    settlement periods ({period: price}, empty if the date has none yet).
+
+    The entries are valid for one version of the market index:
+    the counter in the data_versions table, which the writes of the
+    market index increase. AuctionDbEndpoint looks at the counter again
+    only when "PRAGMA data_version" says that another connection
+    (of this process or another) has committed something,
+    and the cache is emptied when the counter has moved.
+    '''
+
+    def __init__(self, maxsize=64):
+        if maxsize < 1:
+            raise ValueError("Cache size must be at least 1.")
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # date -> {period: price}
+        self._lock = threading.Lock()
+
+    def check_version(self, version):
+        '''
+        Empty the cache if version is not the one of its entries.
+        '''
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def lookup(self, applying_date):
+        '''
+        Returns (found, prices).
+        '''
+        with self._lock:
+            prices = self._entries.get(applying_date)
+            if prices is not None:
+                self._entries.move_to_end(applying_date)
+                self.hits += 1
+                return True, prices
+            self.misses += 1
+            return False, None
+
+    def store(self, applying_date, prices, version):
+        '''
+        prices were read at version: they are not stored
+        if the cache has moved on since.
+        '''
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[applying_date] = prices
+            self._entries.move_to_end(applying_date)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
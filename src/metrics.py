@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+'''
+In-process counters and histograms, exposed in the Prometheus text format.
+'''
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{name}="{value}"' for name, value in pairs)
+    return "{" + inner + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if type(value) is float else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    '''
+    Counts of the observations per bucket (upper bounds, inclusive),
+    with their sum and number.
+    '''
+    type = "histogram"
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0
+                ]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, labels=()):
+        with self._lock:
+            state = self._values.get(labels)
+            return state[2] if state is not None else 0
+
+    def samples(self):
+        with self._lock:
+            values = {
+                labels: (list(counts), total, n)
+                for labels, (counts, total, n) in self._values.items()
+            }
+        for labels, (counts, total, n) in sorted(values.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + [float("inf")], counts):
+                cumulative += c
+                yield (self.name + "_bucket",
+                       _format_labels(self.labelnames, labels,
+                                      [("le", _format_value(bound))]),
+                       cumulative)
+            yield (self.name + "_sum",
+                   _format_labels(self.labelnames, labels), total)
+            yield (self.name + "_count",
+                   _format_labels(self.labelnames, labels), n)
+
+
+class Observed:
+    '''
+    A value owned by another object, read when the metrics are rendered.
+    '''
+
+    def __init__(self, name, help, type, read):
+        self.name = name
+        self.help = help
+        self.type = type
+        self._read = read
+
+    def samples(self):
+        yield self.name, "", self._read()
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+latency_buckets = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+    5, 10
+]
+size_buckets = [2**i for i in range(6, 24, 2)]
+count_buckets = [1, 5, 10, 24, 50, 100, 250, 500, 1000, 5000]
+
+
+class BidMetrics:
+    '''
+    The metrics of the bidding API: per route request histograms,
+    timers of the stages of a write and counters of the orders.
+    '''
+    stages = ["connect", "key_lookup", "validation", "insert", "commit"]
+
+    def __init__(self, prefix="bid_api"):
+        self.prefix = prefix
+        self.registry = Registry()
+        r = self.registry.register
+        self.request_duration = r(
+            Histogram(f"{prefix}_request_duration_seconds",
+                      "Time spent answering a request.", latency_buckets,
+                      ["route"]))
+        self.request_size = r(
+            Histogram(f"{prefix}_request_size_bytes",
+                      "Size of the request bodies.", size_buckets, ["route"]))
+        self.response_size = r(
+            Histogram(f"{prefix}_response_size_bytes",
+                      "Size of the response bodies.", size_buckets,
+                      ["route"]))
+        self.orders_per_request = r(
+            Histogram(f"{prefix}_orders_per_request",
+                      "Number of orders submitted per /set request.",
+                      count_buckets))
+        self.stage_duration = r(
+            Histogram(f"{prefix}_stage_duration_seconds",
+                      "Time spent in each stage of the database accesses.",
+                      latency_buckets, ["stage"]))
+        self.orders_accepted = r(
+            Counter(f"{prefix}_orders_accepted_total",
+                    "Orders validated and in time."))
+        self.orders_rejected_late = r(
+            Counter(f"{prefix}_orders_rejected_late_total",
+                    "Orders rejected because submitted after the deadline."))
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_duration.observe(time.perf_counter() - start,
+                                        (stage, ))
+
+    def observe_request(self, route, seconds, request_bytes, response_bytes):
+        labels = (route, )
+        self.request_duration.observe(seconds, labels)
+        if request_bytes is not None:
+            self.request_size.observe(request_bytes, labels)
+        if response_bytes is not None:
+            self.response_size.observe(response_bytes, labels)
+
+    def count_orders(self, accepted, rejected_late):
+        self.orders_accepted.inc(accepted)
+        if rejected_late:
+            self.orders_rejected_late.inc(rejected_late)
+
+    def watch_cache(self, name, cache):
+        '''
+        Expose the hits, misses and size of cache (a KeyCache
+        or a MarketIndexCache) as {prefix}_{name}_*.
+        '''
+        r = self.registry.register
+        for field, suffix, type, help in [
+            ("hits", "hits_total", "counter", "Lookups found in the cache."),
+            ("misses", "misses_total", "counter",
+             "Lookups not found in the cache."),
+            ("size", "size", "gauge", "Entries in the cache."),
+        ]:
+            r(
+                Observed(f"{self.prefix}_{name}_{suffix}", help, type,
+                         lambda field=field: cache.stats()[field]))
+
+    def render(self):
+        return self.registry.render()
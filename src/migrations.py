@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+'''
+Versioned schema migrations, tracked with sqlite's "PRAGMA user_version".
+
+New database files get the whole schema from setup_db and are stamped
+with the latest version; existing files are upgraded in place
+by running the migrations they have not seen yet, in order.
+'''
+from common_db_operations import create_index
+
+
+def _indexes(*names):
+    '''
+    A migration that creates the named indexes of the schema.
+    '''
+
+    def run(cursor, schema):
+        for table, v in schema.items():
+            for name, columns in v.get("indexes", []):
+                if name in names:
+                    create_index(cursor, table, name, columns)
+
+    return run
+
+
+def _materialize_accepted(cursor, schema):
+    cursor.execute("ALTER TABLE orders ADD COLUMN accepted INTEGER;")
+    _indexes("orders_date_hour")(cursor, schema)
+    cursor.execute('''
+    UPDATE orders
+    SET accepted = (
+        SELECT
+        ((orders.price <= market_index.price AND orders.type = 'SELL') OR
+        (orders.price >= market_index.price AND orders.type = 'BUY'))
+        FROM market_index
+        WHERE market_index.date = orders.applying_date
+        AND market_index.period = orders.hour_ID);
+    ''')
+
+
+def _data_versions(cursor, schema):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        name TEXT,
+        version INTEGER
+    );''')
+
+
+def _archive_watermarks(cursor, schema):
+    # Databases archived before this migration already have it.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archive_watermarks (
+        name TEXT PRIMARY KEY,
+        until DATE
+    );''')
+
+
+# (version, description, function(cursor, schema))
+# The functions must not change once released:
+# they describe how the schema was at that version.
+migrations = [
+    (1, "secondary indexes on orders and keys",
+     _indexes("orders_key_date_hour", "keys_encrypted_key")),
+    (2, "materialized clearing results in orders.accepted",
+     _materialize_accepted),
+    (3, "data_versions counters, for the caches of other processes",
+     _data_versions),
+    (4, "archive_watermarks, the first day not archived per table",
+     _archive_watermarks),
+]
+
+latest_version = migrations[-1][0]
+
+
+def get_version(connection):
+    version, = connection.execute("PRAGMA user_version;").fetchone()
+    return version
+
+
+def _set_version(cursor, version):
+    cursor.execute(f"PRAGMA user_version = {int(version)};")
+
+
+def stamp(connection):
+    '''
+    Mark a freshly created database as up to date.
+    '''
+    _set_version(connection, latest_version)
+    connection.commit()
+
+
+def migrate(connection, schema, logger=None):
+    '''
+    Run the pending migrations. Returns the list of versions applied.
+    '''
+    if get_version(connection) >= latest_version:
+        return []
+
+    cursor = connection.cursor()
+    # Take the write lock before looking again,
+    # in case another process is migrating the same file.
+    cursor.execute("BEGIN IMMEDIATE;")
+    try:
+        current = get_version(connection)
+        applied = []
+        for version, description, run in migrations:
+            if version <= current:
+                continue
+            if logger:
+                logger.info("Migrating database to version %d: %s", version,
+                            description)
+            run(cursor, schema)
+            _set_version(cursor, version)
+            applied.append(version)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return applied
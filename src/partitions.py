@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+'''
+Orders partitioned by month of applying_date.
+
+Each month has its own table, orders_YYYY_MM, with its own indexes,
+in the same database file; the partitions are listed in the
+order_partitions table, whose existence marks a partitioned database.
+Every AuctionDbEndpoint on such a file, in any process, writes the orders
+to the partition of their month and reads only the partitions of the dates
+asked for. A month of orders that has expired is dropped with the table,
+without touching the other months or their indexes.
+
+order_id stays unique across the partitions: the ids are taken from
+the sequence of the (then empty) orders table.
+'''
+from common_db_operations import create_index, create_table
+from datetime import date
+
+registry = "order_partitions"
+
+
+def is_partitioned(cursor):
+    return cursor.execute(
+        '''
+    SELECT 1
+    FROM sqlite_master
+    WHERE type = 'table' AND name = ?;
+    ''', (registry, )).fetchone() is not None
+
+
+def month_of(d):
+    '''
+    "YYYY-MM" of a date or of its sqlite text.
+    '''
+    if isinstance(d, date):
+        d = d.isoformat()
+    return d[:7]
+
+
+def table_name(month):
+    return "orders_" + month.replace("-", "_")
+
+
+def partition_spec(spec):
+    '''
+    The orders table spec for a partition: the ids are given on insert.
+    '''
+    fields = [(name, t, "PRIMARY KEY" if name == "order_id" else mod)
+              for name, t, mod in spec["fields"]]
+    indexes = [(name.replace("orders", "{table}", 1), columns)
+               for name, columns in spec.get("indexes", [])]
+    return spec | {"fields": fields, "indexes": indexes}
+
+
+def enable(cursor, spec):
+    '''
+    Make the database partitioned, moving the existing orders
+    to the partitions of their month. Does not commit.
+    '''
+    if is_partitioned(cursor):
+        return
+    cursor.execute(f'''
+    CREATE TABLE {registry} (
+        month TEXT PRIMARY KEY,
+        name TEXT
+    );''')
+    months = [
+        m for m, in cursor.execute('''
+        SELECT DISTINCT substr(applying_date, 1, 7)
+        FROM orders;''').fetchall()
+    ]
+    for month in months:
+        table = create(cursor, month, spec)
+        cursor.execute(
+            f'''
+        INSERT INTO {table}
+        SELECT *
+        FROM orders
+        WHERE applying_date >= ? AND applying_date < ?;
+        ''', (month, _next_month(month)))
+    # Keeps the sequence of the ids.
+    cursor.execute("DELETE FROM orders;")
+
+
+def _next_month(month):
+    year, m = map(int, month.split("-"))
+    return f"{year + m // 12:04d}-{m % 12 + 1:02d}"
+
+
+def create(cursor, month, spec):
+    '''
+    The partition of month, created if needed (in the current transaction).
+    '''
+    table = table_name(month)
+    spec = partition_spec(spec)
+    create_table(cursor, table, spec, if_not_exists=True)
+    for name, columns in spec["indexes"]:
+        create_index(cursor, table, name.format(table=table), columns)
+    cursor.execute(
+        f'''
+    INSERT OR IGNORE INTO {registry}
+    VALUES (?, ?);
+    ''', (month, table))
+    return table
+
+
+def find(cursor, start_date, end_date):
+    '''
+    The partitions with orders applying from start_date
+    to end_date included, in order.
+    '''
+    return [
+        name for name, in cursor.execute(
+            f'''
+        SELECT name
+        FROM {registry}
+        WHERE month >= ? AND month <= ?
+        ORDER BY month;
+        ''', (month_of(start_date), month_of(end_date))).fetchall()
+    ]
+
+
+def allocate_ids(cursor, n):
+    '''
+    The first of n new order ids (in the current write transaction).
+    '''
+    # Updating first takes the write lock before reading the sequence.
+    row = cursor.execute(
+        '''
+    UPDATE sqlite_sequence
+    SET seq = seq + ?
+    WHERE name = 'orders'
+    RETURNING seq;
+    ''', (n, )).fetchone()
+    if row is None:
+        cursor.execute("INSERT INTO sqlite_sequence VALUES ('orders', ?);",
+                       (n, ))
+        return 1
+    return row[0] - n + 1
+
+
+def drop(cursor, month):
+    '''
+    Delete the orders of month with their partition. Does not commit.
+    '''
+    # The DELETE starts the transaction the DROP is part of.
+    cursor.execute(f"DELETE FROM {registry} WHERE month = ?;", (month, ))
+    cursor.execute(f"DROP TABLE IF EXISTS {table_name(month)};")
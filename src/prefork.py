@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+'''
+Prefork serving: a master process opens the listening socket and forks
+worker processes that all accept on it, each with its own app
+(and so its own sqlite connections, pools and background threads).
+
+Signals to the master:
+    SIGTERM, SIGINT  stop the workers (letting them finish their requests)
+    SIGHUP           graceful restart: start new workers, then stop the old
+'''
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+class _InFlight:
+    '''
+    WSGI middleware counting the requests being answered.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self._lock = threading.Lock()
+        self.idle = threading.Event()
+        self.idle.set()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.count += 1
+            self.idle.clear()
+        try:
+            yield from self.app(environ, start_response)
+        finally:
+            with self._lock:
+                self.count -= 1
+                if self.count == 0:
+                    self.idle.set()
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    '''
+    No access log on stderr: the app logs what it needs to.
+    '''
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve_worker(make_app,
+                 sock,
+                 graceful_timeout=30,
+                 on_exit=None,
+                 logger=None):
+    '''
+    Serve the app from make_app() on the inherited socket until SIGTERM,
+    then wait (up to graceful_timeout seconds) for the requests
+    in flight. on_exit(app) is called last, with None as the app
+    if make_app failed.
+    '''
+    app = None
+    try:
+        app = make_app()
+        wrapped = _InFlight(app)
+        host, port = sock.getsockname()[:2]
+        server = make_server(host,
+                             port,
+                             wrapped,
+                             threaded=True,
+                             request_handler=_QuietRequestHandler,
+                             fd=sock.fileno())
+
+        def stop(signum, frame):
+            # shutdown() waits for serve_forever() to return:
+            # it cannot run in the thread serving.
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master decides
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        try:
+            server.serve_forever()
+        finally:
+            wrapped.idle.wait(graceful_timeout)
+    except Exception:
+        # Before on_exit, which may stop the logging.
+        if logger is not None:
+            logger.exception("Worker %d failed", os.getpid())
+        else:
+            traceback.print_exc()
+        raise
+    finally:
+        if on_exit is not None:
+            on_exit(app)
+
+
+class PreforkServer:
+    '''
+    make_app is called in each worker after the fork,
+    on_exit(app) when the worker stops (e.g. bid_api.close_app).
+
+    A worker that dies is replaced; if it had run for less than
+    min_uptime seconds, only after a delay doubling from backoff
+    seconds with each such failure in a row. After max_failures of them
+    the server stops, and serve_forever raises RuntimeError.
+    '''
+
+    def __init__(self,
+                 make_app,
+                 host="0.0.0.0",
+                 port=5000,
+                 workers=2,
+                 logger=None,
+                 graceful_timeout=30,
+                 on_exit=None,
+                 backlog=1024,
+                 min_uptime=5,
+                 backoff=0.1,
+                 max_failures=10):
+        if workers < 1:
+            raise ValueError("At least one worker is needed.")
+        self.make_app = make_app
+        self.workers = workers
+        self.logger = logger
+        self.graceful_timeout = graceful_timeout
+        self.on_exit = on_exit
+        self.min_uptime = min_uptime
+        self.backoff = backoff
+        self.max_failures = max_failures
+        self.sock = socket.create_server((host, port), backlog=backlog)
+        self.sock.set_inheritable(True)
+        self.address = self.sock.getsockname()[:2]
+        self._pids = set()
+        self._started = {}  # pid -> time.monotonic() at its start
+        self._stopping = False
+        self._restart = False
+        self._failures = 0  # of workers in a row, dead before min_uptime
+        self._respawns = 0  # workers to start again
+        self._respawn_at = 0
+
+    def _log(self, *args):
+        if self.logger:
+            self.logger.info(*args)
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                serve_worker(self.make_app, self.sock, self.graceful_timeout,
+                             self.on_exit, self.logger)
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        self._pids.add(pid)
+        self._started[pid] = time.monotonic()
+        self._log("Started worker %d", pid)
+        return pid
+
+    def _stop(self, pids):
+        '''
+        SIGTERM pids, then SIGKILL those still running after
+        graceful_timeout.
+        '''
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                    remaining.discard(pid)
+            time.sleep(0.05)
+        for pid in remaining:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self._pids -= set(pids)
+        for pid in pids:
+            self._started.pop(pid, None)
+
+    def _reap(self):
+        '''
+        Replace the workers that died on their own,
+        later if they keep failing at once.
+        '''
+        while self._pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in self._pids:
+                self._pids.discard(pid)
+                uptime = time.monotonic() - self._started.pop(pid)
+                if uptime < self.min_uptime:
+                    self._failures += 1
+                else:
+                    self._failures = 0
+                if self._failures >= self.max_failures:
+                    if self.logger:
+                        self.logger.error(
+                            "Worker %d exited (%d), %d workers in a row"
+                            " failed at once: stopping", pid, status,
+                            self._failures)
+                    self._stopping = True
+                    return
+                delay = (self.backoff * 2**(self._failures - 1)
+                         if self._failures else 0)
+                if self.logger:
+                    self.logger.warning(
+                        "Worker %d exited (%d), replacing it in %.1fs", pid,
+                        status, delay)
+                self._respawns += 1
+                self._respawn_at = time.monotonic() + delay
+        if self._respawns and time.monotonic() >= self._respawn_at:
+            for _ in range(self._respawns):
+                self._spawn()
+            self._respawns = 0
+
+    def restart(self):
+        '''
+        Start a new set of workers, then stop the old ones
+        (which finish their requests first).
+        '''
+        old = set(self._pids)
+        self._respawns = 0
+        for _ in range(self.workers):
+            self._spawn()
+        self._stop(old)
+        self._log("Restarted %d workers", self.workers)
+
+    def stop(self):
+        self._stopping = True
+
+    def serve_forever(self):
+
+        def on_stop(signum, frame):
+            self._stopping = True
+
+        def on_restart(signum, frame):
+            self._restart = True
+
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        signal.signal(signal.SIGHUP, on_restart)
+
+        for _ in range(self.workers):
+            self._spawn()
+        self._log("Serving on %s:%d with %d workers", *self.address,
+                  self.workers)
+        try:
+            while not self._stopping:
+                if self._restart:
+                    self._restart = False
+                    self.restart()
+                self._reap()
+                time.sleep(0.1)
+        finally:
+            self._stop(set(self._pids))
+            self.sock.close()
+            self._log("Stopped")
+        if self._failures >= self.max_failures:
+            raise RuntimeError("The workers keep failing.")
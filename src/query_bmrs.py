@@ -9,10 +9,30 @@ import os
 
 apikey = os.getenv("BMRSAPIKEY")
 url_base = "https://api.bmreports.com/BMRS"
+_cache = None  # Set the cache
+
+
+def set_cache(cache):
+    '''
+    cache is a bmrs_cache.ResponseCache, or None to disable caching.
+    '''
+    global _cache
+    _cache = cache
+
+
+def get_cache():
+    return _cache
 
 DATE_FORMAT = "%Y-%m-%d"
 
 
+class InvalidResponse(ValueError):
+    '''
+    A response that is not what the API sends, or that was cut short
+    (its records do not match the count of its FTR line).
+    '''
+
+
 def format_date(date_value):
     '''
     to YYYY-MM-DD if not already in this format
@@ -24,12 +44,139 @@ def format_date(date_value):
         return date_value.strftime(DATE_FORMAT)
 
 
-def get_market_index(from_date, to_date=None, period='*'):
+def make_session(pool_size=10):
+    '''
+    A session keeps the connections (and TLS handshakes) to the API
+    for reuse; pool_size should be at least the number of threads using it.
+    '''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _stream_lines(url, params, session=None):
+    '''
+    The lines of the response, read incrementally.
+    '''
+    getter = session if session is not None else requests
+    with getter.get(url, params=params, stream=True) as r:
+        r.raise_for_status()
+        if r.encoding is None:
+            r.encoding = "utf-8"
+        yield from r.iter_lines(decode_unicode=True)
+
+
+def _fetch_lines(report, version, params, session=None, refresh=False):
+    '''
+    The lines of the response to a request for a report,
+    from the cache if there is one and it has the response (unless
+    refresh). Otherwise they are streamed from the API and, if the whole
+    response has been read, stored in the cache.
+    '''
+    if _cache is not None:
+        lines = None if refresh else _cache.get(report, version, params)
+        if lines is not None:
+            yield from lines
+            return
+        entry = _cache.writer(report, version, params)
+    else:
+        entry = None
+
+    url = '/'.join([url_base, report, version])
+    try:
+        for line in _stream_lines(url, params, session):
+            if entry is not None:
+                entry.write(line)
+            yield line
+    except BaseException:  # including the parser giving up on the response
+        if entry is not None:
+            entry.abort()
+        raise
+    if entry is not None:
+        entry.commit()
+
+
+def _parse_yyyymmdd(s):
+    return date(int(s[:4]), int(s[4:6]), int(s[6:8]))
+
+
+def _frame(columns, names, dtypes):
+    return pd.DataFrame({
+        n: pd.Series(columns[n], dtype=t)
+        for n, t in zip(names, dtypes)
+    })
+
+
+market_index_fields = [
+    "Record Type",
+    "Data Provider",
+    "Settlement Date",
+    "Settlement Period",
+    "Price",
+    "Volume",
+]
+
+# parser for each field, and dtype of the column it is stored in
+market_index_parsers = [str, str, _parse_yyyymmdd, int, float, float]
+market_index_dtypes = [object, object, object, int, float, float]
+
+
+def parse_market_index_lines(lines, chunksize=10000):
+    '''
+    Parse the lines of a MID csv response as they arrive,
+    yielding DataFrames of at most chunksize rows with typed columns.
+    The number of records in the FTR line is checked at the end.
+    '''
+    expected_header = ["HDR", "MARKET INDEX DATA"]
+    lines = iter(lines)
+    header = next(lines).split(',')
+    if expected_header != header:
+        raise InvalidResponse(f"{header} != {expected_header}")
+
+    def empty():
+        return {n: [] for n in market_index_fields}
+
+    columns = empty()
+    nrows = 0
+    nread = 0
+    for line in lines:
+        if not line:
+            continue
+        values = line.split(',')
+        if values[0] == "FTR":
+            nrecords = int(values[1])
+            if nread != nrecords:
+                raise InvalidResponse(f"{nread} != {nrecords}")
+            for _ in lines:  # read to the end, so that it can be cached
+                pass
+            if nrows:
+                yield _frame(columns, market_index_fields,
+                             market_index_dtypes)
+            return
+        for n, parse, v in zip(market_index_fields, market_index_parsers,
+                               values):
+            columns[n].append(parse(v))
+        nrows += 1
+        nread += 1
+        if nrows == chunksize:
+            yield _frame(columns, market_index_fields, market_index_dtypes)
+            columns = empty()
+            nrows = 0
+    raise InvalidResponse("FTR record missing")
+
+
+def iter_market_index(from_date,
+                      to_date=None,
+                      period='*',
+                      chunksize=10000,
+                      session=None,
+                      refresh=False):
     REPORT_NAME = "MID"
     VERSION = "V1"
 
-    url = '/'.join([url_base, REPORT_NAME, VERSION])
-
     if to_date is None:
         to_date = from_date  # one day worth of data
 
@@ -41,28 +188,37 @@ def get_market_index(from_date, to_date=None, period='*'):
         "ServiceType": "csv"
     }
 
-    expected_header = ["HDR", "MARKET INDEX DATA"]
-    output_fields = [
-        "Record Type",
-        "Data Provider",
-        "Settlement Date",
-        "Settlement Period",
-        "Price",
-        "Volume",
-    ]
-
-    r = requests.get(url, params=params)
-    lines = r.text.split('\n')
-    header = lines[0].split(',')
-    assert expected_header == header, f"{header} != {expected_header}"
-    data = [line.split(',') for line in lines[1:-1]]
-    nrecords = int(lines[-1].split(',')[1])
-    assert len(data) == nrecords
-    return pd.DataFrame(data, columns=output_fields)
-
-
-def _get_market_index_clean(from_date, to_date=None, period='*'):
-    df = get_market_index(from_date, to_date, period)
+    yield from parse_market_index_lines(
+        _fetch_lines(REPORT_NAME, VERSION, params, session, refresh),
+        chunksize)
+
+
+def _concat(chunks, names, dtypes):
+    chunks = list(chunks)
+    if not chunks:
+        return _frame({n: [] for n in names}, names, dtypes)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def get_market_index(from_date,
+                     to_date=None,
+                     period='*',
+                     session=None,
+                     refresh=False):
+    return _concat(iter_market_index(from_date,
+                                     to_date,
+                                     period,
+                                     session=session,
+                                     refresh=refresh),
+                   market_index_fields, market_index_dtypes)
+
+
+def _get_market_index_clean(from_date,
+                            to_date=None,
+                            period='*',
+                            session=None,
+                            refresh=False):
+    df = get_market_index(from_date, to_date, period, session, refresh)
     return df.loc[df["Data Provider"] != "N2EXMIDP", :]
 
 
@@ -87,15 +243,25 @@ market_index_clean_coltypes = [
 ]
 
 
-def get_market_index_converted(from_date, to_date=None, period='*'):
-    df = _get_market_index_clean(from_date, to_date, period)
-    return convert_columns(
-        df.drop(["Data Provider", "Record Type"], axis="columns"),
-        market_index_clean_coltypes, market_index_clean_columns)
+def get_market_index_converted(from_date,
+                               to_date=None,
+                               period='*',
+                               session=None,
+                               refresh=False):
+    '''
+    With refresh, the response is fetched from the API
+    even if it is in the cache.
+    '''
+    # the columns are already typed by the parser
+    df = _get_market_index_clean(from_date, to_date, period, session,
+                                 refresh)
+    return df.drop(["Data Provider", "Record Type"],
+                   axis="columns").reset_index(drop=True)
 
 
-def get_market_index_clean(from_date, to_date=None, period='*'):
-    df_converted = get_market_index_converted(from_date, to_date, period)
+def get_market_index_clean(from_date, to_date=None, period='*', session=None):
+    df_converted = get_market_index_converted(from_date, to_date, period,
+                                              session)
     df_converted["Settlement Period"] = (df_converted["Settlement Period"] -
                                          1) // 2 + 1
     df_converted = df_converted.groupby(
@@ -117,11 +283,67 @@ imbalance_prices_selected_coltypes = [
 ]
 
 
-def get_imbalance_prices(settlement_date, period='*'):
+imbalance_prices_parsers = [date.fromisoformat, int, float]
+imbalance_prices_dtypes = [object, int, float]
+
+
+def parse_imbalance_prices_lines(lines, chunksize=10000):
+    '''
+    Parse the lines of a B1770 csv response as they arrive,
+    keeping only the selected columns of the imbalance price time series
+    and yielding DataFrames of at most chunksize rows with typed columns.
+    If there is an FTR line, the number of records is checked against it.
+    '''
+    header_length = 5
+    lines = iter(lines)
+    for _ in range(header_length - 1):
+        next(lines)
+    header = next(lines).split(',')
+    series_idx = header.index("TimeSeriesID")
+    idxs = [header.index(n) for n in imbalance_prices_selected_columns]
+
+    def empty():
+        return {n: [] for n in imbalance_prices_selected_columns}
+
+    columns = empty()
+    nrows = 0
+    nread = 0
+    for line in lines:
+        values = line.split(',')
+        if values[0] == "FTR":
+            nrecords = int(values[1])
+            if nread != nrecords:
+                raise InvalidResponse(f"{nread} != {nrecords}")
+            for _ in lines:  # read to the end, so that it can be cached
+                pass
+            break
+        if len(values) != len(header):  # empty or end of file line
+            continue
+        nread += 1
+        if values[series_idx] != "ELX-EMFIP-IMBP-TS-1":
+            continue
+        for n, parse, i in zip(imbalance_prices_selected_columns,
+                               imbalance_prices_parsers, idxs):
+            columns[n].append(parse(values[i]))
+        nrows += 1
+        if nrows == chunksize:
+            yield _frame(columns, imbalance_prices_selected_columns,
+                         imbalance_prices_dtypes)
+            columns = empty()
+            nrows = 0
+    if nrows:
+        yield _frame(columns, imbalance_prices_selected_columns,
+                     imbalance_prices_dtypes)
+
+
+def iter_imbalance_prices(settlement_date,
+                          period='*',
+                          chunksize=10000,
+                          session=None,
+                          refresh=False):
     REPORT_NAME = "B1770"
     VERSION = "V1"
 
-    url = '/'.join([url_base, REPORT_NAME, VERSION])
     params = {
         "APIKey": apikey,
         "SettlementDate": format_date(settlement_date),
@@ -129,15 +351,21 @@ def get_imbalance_prices(settlement_date, period='*'):
         "ServiceType": "csv"
     }
 
-    r = requests.get(url, params=params)
-    lines = r.text.split('\n')
-    header_length = 5
-    output_fields = lines[header_length - 1].split(',')
-    data = [line.split(',') for line in lines[header_length:-1]]
+    yield from parse_imbalance_prices_lines(
+        _fetch_lines(REPORT_NAME, VERSION, params, session, refresh),
+        chunksize)
 
-    df = pd.DataFrame(data, columns=output_fields)
-    df = df.loc[df["TimeSeriesID"] == "ELX-EMFIP-IMBP-TS-1",
-                imbalance_prices_selected_columns]
 
-    return convert_columns(df, imbalance_prices_selected_coltypes,
-                           imbalance_prices_selected_columns)
+def get_imbalance_prices(settlement_date,
+                         period='*',
+                         session=None,
+                         refresh=False):
+    '''
+    With refresh, the response is fetched from the API
+    even if it is in the cache.
+    '''
+    return _concat(iter_imbalance_prices(settlement_date,
+                                         period,
+                                         session=session,
+                                         refresh=refresh),
+                   imbalance_prices_selected_columns, imbalance_prices_dtypes)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+'''
+Optional tracing of the statements run by AuctionDbEndpoint.
+
+Statements are normalized into templates (literals replaced by ?)
+and their durations and row counts aggregated per template.
+Statements slower than a threshold are logged with their query plan.
+'''
+from itertools import chain
+import re
+import sqlite3
+import threading
+import time
+
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_placeholder_list = re.compile(r"\?(?:\s*,\s*\?)+")
+_whitespace = re.compile(r"\s+")
+
+
+def normalize(sql):
+    '''
+    The template of a statement: literals and lists of placeholders
+    replaced by ?, whitespace collapsed.
+    '''
+    sql = _string_literal.sub("?", sql)
+    sql = _number_literal.sub("?", sql)
+    sql = _placeholder_list.sub("?, ...", sql)
+    return _whitespace.sub(" ", sql).strip()
+
+
+class _TemplateStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+
+
+class _TracedCursor:
+    '''
+    Wraps the cursor of a SELECT, so that the time spent fetching
+    and the rows fetched are counted; recorded once the rows are exhausted
+    (or when the cursor is dropped).
+    '''
+
+    def __init__(self, tracer, connection, cursor, sql, params, elapsed):
+        self._tracer = tracer
+        self._connection = connection
+        self._cursor = cursor
+        self._sql = sql
+        self._params = params
+        self._elapsed = elapsed
+        self._rows = 0
+        self._done = False
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            self._tracer.record(self._connection, self._sql, self._params,
+                                self._elapsed, self._rows)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._elapsed += time.perf_counter() - start
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self._cursor.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(size)
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        while (row := self.fetchone()) is not None:
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __del__(self):
+        self._finish()
+
+
+class SqlTracer:
+    '''
+    Shared by the endpoints of a process (thread-safe).
+    Statements taking slow_threshold seconds or more go to logger
+    with their EXPLAIN QUERY PLAN.
+    '''
+
+    def __init__(self, slow_threshold=0.1, logger=None, max_templates=1000):
+        self.slow_threshold = slow_threshold
+        self.logger = logger
+        self.max_templates = max_templates
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def execute(self, connection, cursor, sql, params=()):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        elapsed = time.perf_counter() - start
+        if cursor.description is None:
+            self.record(connection, sql, params, elapsed,
+                        max(cursor.rowcount, 0))
+            return cursor
+        return _TracedCursor(self, connection, cursor, sql, params, elapsed)
+
+    def executemany(self, connection, cursor, sql, seq_of_params):
+        # Keep the first parameters for the query plan
+        # (seq_of_params can be an iterator).
+        params = iter(seq_of_params)
+        first = next(params, None)
+        if first is not None:
+            params = chain([first], params)
+        start = time.perf_counter()
+        cursor.executemany(sql, params)
+        self.record(connection, sql, first, time.perf_counter() - start,
+                    max(cursor.rowcount, 0))
+        return cursor
+
+    def record(self, connection, sql, params, elapsed, rows):
+        template = normalize(sql)
+        slow = elapsed >= self.slow_threshold
+        with self._lock:
+            stats = self._stats.get(template)
+            if stats is None:
+                if len(self._stats) >= self.max_templates:
+                    template = "<other>"
+                stats = self._stats.setdefault(template, _TemplateStats())
+            stats.calls += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.rows += rows
+            stats.slow += slow
+        if slow and self.logger:
+            self.logger.warning("Slow query (%.1f ms, %d rows): %s\n%s",
+                                elapsed * 1000, rows,
+                                _whitespace.sub(" ", sql).strip(),
+                                self.query_plan(connection, sql, params))
+
+    @staticmethod
+    def query_plan(connection, sql, params):
+        try:
+            plan = connection.execute("EXPLAIN QUERY PLAN " + sql,
+                                      params if params is not None else ())
+            return "\n".join(f"  {row[-1]}" for row in plan.fetchall())
+        except sqlite3.Error as e:
+            return f"  (no plan: {e})"
+
+    def summary(self):
+        '''
+        Per template statistics, the most time consuming first.
+        '''
+        with self._lock:
+            res = [{
+                "template": template,
+                "calls": s.calls,
+                "total_s": s.total,
+                "mean_s": s.total / s.calls,
+                "max_s": s.max,
+                "rows": s.rows,
+                "slow": s.slow,
+            } for template, s in self._stats.items()]
+        return sorted(res, key=lambda r: r["total_s"], reverse=True)
+
+    def dump(self, limit=None):
+        '''
+        The summary as text.
+        '''
+        lines = [
+            f"{'calls':>8} {'total ms':>10} {'mean ms':>9} {'max ms':>9}"
+            f" {'rows':>9} {'slow':>6}  template"
+        ]
+        for r in self.summary()[:limit]:
+            lines.append(f"{r['calls']:8d} {r['total_s'] * 1000:10.1f}"
+                         f" {r['mean_s'] * 1000:9.3f} {r['max_s'] * 1000:9.3f}"
+                         f" {r['rows']:9d} {r['slow']:6d}  {r['template']}")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+'''
+Dense store of the market index and imbalance prices, for the models
+that read the same multi-year series over and over.
+
+Each field is a memory-mapped float64 file <directory>/<table>.<field>.f64
+of shape (days, 50): one row per date from the epoch of the store,
+one column per settlement period (up to 50, on the long clock-change day),
+NaN where the period is missing. The row of a date is computed,
+not searched for, and the reads are views on the mapping: nothing is
+copied, and the pages are shared by all the processes reading the store.
+
+There must be a single writer (the AuctionDbEndpoint writing the API data);
+the readers map the files again when they have grown.
+'''
+from datetime import date, timedelta
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+nperiods = 50
+
+# The fields stored per table
+tables = {
+    "market_index": ["price", "volume"],
+    "imbalance_prices": ["price"],
+}
+
+
+class TimeSeriesStore:
+
+    def __init__(self, directory, epoch=date(2000, 1, 1)):
+        '''
+        epoch, the first date that can be stored, is fixed when
+        the store is created.
+        '''
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        meta = os.path.join(directory, "meta.json")
+        if os.path.exists(meta):
+            with open(meta) as f:
+                epoch = date.fromisoformat(json.load(f)["epoch"])
+        else:
+            with open(meta, "w") as f:
+                json.dump({"epoch": epoch.isoformat()}, f)
+        self.epoch = epoch
+        self._maps = {}
+
+    def _path(self, table, field):
+        return os.path.join(self.directory, f"{table}.{field}.f64")
+
+    def _map(self, table, field, ndays=0):
+        '''
+        The mapping of the field, grown to at least ndays if needed.
+        '''
+        path = self._path(table, field)
+        mapped = self._maps.get((table, field))
+        if mapped is not None and len(mapped) >= ndays:
+            return mapped
+        row_size = nperiods * 8
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < ndays * row_size:
+            with open(path, "ab") as f:
+                # The new rows are NaN (missing), not 0.
+                f.write(np.full((ndays - size // row_size, nperiods),
+                                np.nan).tobytes())
+            size = ndays * row_size
+        if size == 0:
+            return None
+        mapped = np.memmap(path,
+                           dtype="float64",
+                           mode="r+",
+                           shape=(size // row_size, nperiods))
+        self._maps[(table, field)] = mapped
+        return mapped
+
+    def row(self, d):
+        '''
+        The row of date d.
+        '''
+        if d < self.epoch:
+            raise ValueError(f"{d} is before the epoch of the store.")
+        return (d - self.epoch).days
+
+    def write(self, table, df):
+        '''
+        Store the rows of df, with the columns of the database table
+        (date, period and the fields).
+        '''
+        if df.empty:
+            return
+        days = pd.to_datetime(df["date"]).to_numpy().astype("datetime64[D]")
+        rows = (days - np.datetime64(self.epoch, "D")).astype(int)
+        periods = df["period"].to_numpy().astype(int)
+        if rows.min() < 0:
+            raise ValueError("Dates before the epoch of the store.")
+        if periods.min() < 1 or periods.max() > nperiods:
+            raise ValueError(f"Periods must be from 1 to {nperiods}.")
+        for field in tables[table]:
+            mapped = self._map(table, field, rows.max() + 1)
+            mapped[rows, periods - 1] = df[field].to_numpy(dtype="float64")
+            mapped.flush()
+
+    def read(self, table, start_date, end_date):
+        '''
+        A dict of the fields of table from start_date included to end_date
+        excluded, as (days, 50) views on the store (read-only).
+        '''
+        start, end = self.row(start_date), self.row(end_date)
+        if end < start:
+            raise ValueError("end_date is before start_date.")
+        res = {}
+        for field in tables[table]:
+            mapped = self._map(table, field)
+            if mapped is None or len(mapped) < end:
+                # Written since it was mapped (or never written).
+                self._maps.pop((table, field), None)
+                mapped = self._map(table, field)
+            if mapped is not None and len(mapped) >= end:
+                view = mapped[start:end]
+            else:
+                # Beyond what was ever written: missing.
+                view = np.full((end - start, nperiods), np.nan)
+                if mapped is not None and start < len(mapped):
+                    view[:len(mapped) - start] = mapped[start:]
+            view = view.view(np.ndarray)
+            view.flags.writeable = False
+            res[field] = view
+        return res
+
+    def dates(self, start_date, end_date):
+        '''
+        The dates of the rows of read.
+        '''
+        return [
+            start_date + timedelta(days=i)
+            for i in range((end_date - start_date).days)
+        ]
@@ -4,16 +4,23 @@ import auction_db
 import query_bmrs as bmrs
 
 import pytest
-from datetime import datetime,date,time
+from datetime import datetime,date,time,timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import threading
 import pandas as pd
 import os
 
 @pytest.fixture
 def db_endpoint():
-    yield auction_db.AuctionDbEndpoint(filename = "test.db",
-                                       logger = None,
-                                       order_deadline = time(9))
-    os.remove("test.db")
+    db = auction_db.AuctionDbEndpoint(filename = "test.db",
+                                      logger = None,
+                                      order_deadline = time(9))
+    yield db
+    db.close()
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists("test.db" + suffix):
+            os.remove("test.db" + suffix)
 
 keys = ["AAAAAAA","BBBBBB","CCCCCCC"]
 @pytest.fixture
@@ -109,3 +116,81 @@ def db_complete(db_withapidata_and_keys,pandas_orders):
     key = keys[1]
     _nwritten,_message = db_withapidata_and_keys.write_orders_pandas(key,pandas_orders)
     return db_withapidata_and_keys
+
+
+# Synthetic BMRS csv responses
+
+def mid_lines(start=date(2021, 1, 1), ndays=2, nperiods=48, periods=None):
+    yield "HDR,MARKET INDEX DATA"
+    n = 0
+    for d in range(ndays):
+        day = (start + timedelta(days=d)).strftime("%Y%m%d")
+        for p in periods or range(1, nperiods + 1):
+            for provider, price in [("APXMIDP", 40.5), ("N2EXMIDP", 0)]:
+                yield f"MID,{provider},{day},{p},{price},{p * 10}"
+                n += 1
+    yield f"FTR,{n}"
+
+
+def b1770_lines(day=date(2021, 1, 1), nperiods=48, periods=None):
+    for _ in range(4):
+        yield "*"
+    yield ("*DocumentID,TimeSeriesID,SettlementDate,SettlementPeriod,"
+           "ImbalancePriceAmount,PriceCategory")
+    for p in periods or range(1, nperiods + 1):
+        yield f"DOC,ELX-EMFIP-IMBP-TS-1,{day.isoformat()},{p},{p / 2},Excess"
+        yield f"DOC,ELX-EMFIP-IMBP-TS-2,{day.isoformat()},{p},{p / 2},Short"
+    yield "<EOF>"
+
+
+class _BmrsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        report = url.path.split('/')[-2]
+        self.server.requests.append((report, params))
+        periods = (None if params.get("Period", "*") == "*" else
+                   [int(params["Period"])])
+        if report == "MID":
+            start = date.fromisoformat(params["FromSettlementDate"])
+            end = date.fromisoformat(params["ToSettlementDate"])
+            day = start
+            lines = mid_lines(start, (end - start).days + 1, periods=periods)
+        else:
+            day = date.fromisoformat(params["SettlementDate"])
+            lines = b1770_lines(day, periods=periods)
+
+        if (report, day) in self.server.fail_once:
+            self.server.fail_once.remove((report, day))
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        body = "\n".join(lines).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def bmrs_server(monkeypatch):
+    '''
+    A local stand-in for the BMRS API serving synthetic MID and B1770 data.
+    server.fail_once is a set of (report, date) answered once with a 503.
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _BmrsHandler)
+    server.requests = []
+    server.fail_once = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(bmrs, "url_base",
+                        f"http://127.0.0.1:{server.server_port}/BMRS")
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import archive
+from bid_api import get_app, close_app
+from fixtures import (
+    keys,
+    db_endpoint,
+    db_withapidata_and_keys,
+    db_complete,
+    market_index,
+    imbalance_prices,
+    pandas_orders,
+)
+
+from datetime import date
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+first_day = date(2021, 2, 19)
+second_day = date(2021, 2, 20)
+
+
+def count(bid_db, table):
+    n, = bid_db.execute(f"SELECT COUNT(*) FROM {table};").fetchone()
+    return n
+
+
+def reads(bid_db):
+    return {
+        "orders":
+        bid_db.read_orders(keys[1], first_day),
+        "orders_hour":
+        bid_db.read_orders(keys[1], first_day, 3),
+        "bulk":
+        bid_db.read_orders_bulk(None, first_day, second_day),
+        "bulk_hours":
+        bid_db.read_orders_bulk([keys[1]], first_day, second_day, [1, 24]),
+        "iter": [
+            o for chunk in bid_db.iter_orders_bulk(
+                None, first_day, second_day, chunksize=7) for o in chunk
+        ],
+        "market_index":
+        bid_db.read_market_index(first_day, date(2021, 2, 21)),
+        "imbalance_prices":
+        bid_db.read_imbalance_prices(first_day, date(2021, 2, 21)),
+    }
+
+
+@pytest.fixture
+def archived_db(db_complete, tmp_path):
+    db_complete.archive = archive.Archive(str(tmp_path))
+    return db_complete
+
+
+def assert_same(res, expected):
+    for name, value in expected.items():
+        if hasattr(value, "equals"):
+            assert value.equals(res[name]), name
+        else:
+            assert value == res[name], name
+
+
+def test_reads_fall_back_to_archive(archived_db, tmp_path):
+    expected = reads(archived_db)
+    norders = count(archived_db, "orders")
+
+    narchived = archived_db.archive_settled(second_day)
+
+    assert narchived["orders"] == norders // 2
+    assert narchived["market_index"] == 48
+    assert count(archived_db, "orders") == norders - narchived["orders"]
+    assert count(archived_db, "market_index") == 48
+    assert os.path.exists(tmp_path / "orders" / "2021-02.parquet")
+    assert_same(reads(archived_db), expected)
+
+    # Archiving again moves nothing new and changes nothing.
+    assert archived_db.archive_settled(second_day)["orders"] == 0
+    assert_same(reads(archived_db), expected)
+
+
+def test_archive_reads_only_its_days(archived_db):
+    archived_db.archive_settled(second_day)
+
+    rows = archived_db.archive.read("orders",
+                                    first_day,
+                                    first_day,
+                                    columns=["hour_ID", "price"],
+                                    filters=[("hour_ID", "in", [2])])
+    assert rows and all(len(r) == 2 and r[0] == 2 for r in rows)
+    assert archived_db.archive.read("orders", second_day, second_day) == []
+    assert archived_db.archive.months("market_index") == ["2021-02"]
+
+
+def test_rewritten_market_data_wins(archived_db, market_index):
+    archived_db.archive_settled(second_day)
+    changed = market_index.copy()
+    changed["Price"] = 1000.0
+    archived_db.write_market_index(changed[changed["Settlement Date"] ==
+                                           changed["Settlement Date"].min()])
+
+    res = archived_db.read_market_index(first_day, date(2021, 2, 21))
+    assert len(res) == 96
+    assert (res[res["date"] == first_day]["price"] == 1000).all()
+    assert (res[res["date"] == second_day]["price"] != 1000).all()
+
+
+def test_partitioned(archived_db):
+    archived_db.partition_orders()
+    expected = reads(archived_db)
+
+    archived_db.archive_settled(date(2021, 3, 1))
+
+    assert archived_db.order_partitions() == []
+    assert_same(reads(archived_db), expected)
+
+
+def test_api_reads_archive(archived_db, tmp_path):
+    expected = archived_db.read_orders(keys[1], first_day)
+    archived_db.archive_settled(second_day)
+    app = get_app(archived_db.filename,
+                  None,
+                  "bids",
+                  read_pool_size=1,
+                  archive_dir=str(tmp_path))
+    with app.test_client() as client:
+        r = client.get("/bids/get",
+                       query_string={
+                           "key": keys[1],
+                           "applying_date": first_day.isoformat()
+                       })
+    close_app(app)
+    assert r.status_code == 200
+    assert len(r.get_json()) == len(expected)
+
+
+def test_needs_an_archive(db_complete):
+    with pytest.raises(ValueError):
+        db_complete.archive_settled(second_day)
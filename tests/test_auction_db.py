@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import auction_db
+import converter
 from fixtures import (
     orders,
     keys,
@@ -26,12 +27,15 @@ def test_init(db_endpoint):
     FROM sqlite_master;
     ''').fetchall()
 
+    nindexes = sum(
+        len(t.get("indexes", [])) for t in db_endpoint.tables.values())
     assert len(res) == (
         len(db_endpoint.tables) +
         1  # because of the unique constraint in the "keys" table
         + 2  # because of the unique constraints on the
         # market_index and imbalance_market tables
-    )
+        + 1  # because of the text primary key of archive_watermarks
+        + nindexes)
     assert "sqlite_sequence" in [r[1] for r in res]
 
 
@@ -321,3 +325,203 @@ def test_read_orders_unknown_state(db_complete, pandas_orders, market_index):
 
     assert len(ords) == len(res)
     assert pd.isna(res["accepted"].iloc[-len(orders):]).all()
+
+
+def query_plans(db, f, *args, **kwargs):
+    '''
+    Run f, then return the query plans of the SELECTs it executed.
+    '''
+    statements = []
+    db._connection.set_trace_callback(statements.append)
+    f(*args, **kwargs)
+    db._connection.set_trace_callback(None)
+    return [
+        ' '.join(r[-1] for r in db.execute(f"EXPLAIN QUERY PLAN {s}"))
+        for s in statements if s.strip().upper().startswith("SELECT")
+    ]
+
+
+def test_find_key_id_uses_index(db_worders):
+    plans = query_plans(db_worders, db_worders.find_key_id, keys[1])
+    assert plans
+    assert all("keys_encrypted_key" in p for p in plans)
+
+
+def test_read_orders_uses_index(db_worders):
+    plans = query_plans(db_worders,
+                        db_worders.read_orders,
+                        key=keys[1],
+                        applying_date=date(2021, 3, 5),
+                        period=17)
+    orders_plans = [p for p in plans if "orders" in p]
+    assert orders_plans
+    assert all("orders_key_date_hour" in p for p in orders_plans)
+    assert not any("SCAN orders" in p for p in plans)
+
+
+def test_replaced_market_index_clears_again(db_complete, market_index):
+    # a sentinel on the other day, to check it is not recomputed
+    db_complete.execute('''
+    UPDATE orders
+    SET accepted = 7
+    WHERE applying_date = '2021-02-20';''')
+
+    day19 = market_index.loc[market_index["Settlement Date"] == date(
+        2021, 2, 19)].copy()
+    day19["Price"] = 1e6  # every SELL is accepted, every BUY rejected
+    db_complete.write_market_index(day19)
+
+    res = pd.DataFrame(
+        db_complete.read_orders(key=keys[1], applying_date=date(2021, 2, 19)))
+    assert (res["accepted"] == (res["type"] == "SELL")).all()
+
+    res = pd.DataFrame(
+        db_complete.read_orders(key=keys[1], applying_date=date(2021, 2, 20)))
+    assert (res["accepted"] == 7).all()
+
+
+def test_late_market_index_clears(db_worders, market_index):
+    day = market_index.loc[market_index["Settlement Date"] == date(
+        2021, 2, 19)].copy()
+    day["Settlement Date"] = date(2021, 3, 5)
+
+    res = db_worders.read_orders(key=keys[1], applying_date=date(2021, 3, 5))
+    assert all(o["accepted"] is None for o in res)
+
+    db_worders.write_market_index(day)
+    res = db_worders.read_orders(key=keys[1], applying_date=date(2021, 3, 5))
+    assert all(o["accepted"] in [0, 1] for o in res)
+
+
+def test_write_orders_pandas_same_as_records(db_withapidata_and_keys,
+                                             pandas_orders):
+    db = db_withapidata_and_keys
+    df = pandas_orders.copy()
+    df["type"] = df["type"].str.lower()
+    # half of them late
+    df.loc[df["applying_date"] == date(2021, 2, 19),
+           "timestamp"] = datetime(2021, 2, 18, 9, 30)
+
+    from_frame = db.write_orders_pandas(keys[0], df)
+    from_records = db.write_orders(keys[1],
+                                   converter.pandas_orders_to_records(df))
+    assert from_frame == from_records
+    assert from_frame[0] == len(df) / 2
+
+    for applying_date in [date(2021, 2, 19), date(2021, 2, 20)]:
+        res0 = db.read_orders(keys[0], applying_date)
+        res1 = db.read_orders(keys[1], applying_date)
+        drop = ["order_id", "key_id"]
+        assert ([{k: v
+                  for k, v in o.items() if k not in drop} for o in res0] == [{
+                      k: v
+                      for k, v in o.items() if k not in drop
+                  } for o in res1])
+
+
+def test_write_orders_pandas_timestamp_text(db_wkeys, pandas_orders):
+    df = pandas_orders.iloc[:2].copy()
+    df["timestamp"] = [
+        datetime(2021, 2, 18, 8),
+        datetime(2021, 2, 18, 8, 0, 0, 1500)
+    ]
+    db_wkeys.write_orders_pandas(keys[0], df)
+    db_wkeys.write_orders(keys[1], converter.pandas_orders_to_records(df))
+
+    # As stored, before the TIMESTAMP converter.
+    res = db_wkeys.execute('''
+    SELECT key_id, timestamp || ''
+    FROM orders
+    ORDER BY order_id;''').fetchall()
+    texts = ["2021-02-18 08:00:00", "2021-02-18 08:00:00.001500"]
+    assert res == [(1, t) for t in texts] + [(2, t) for t in texts]
+
+
+def test_write_orders_pandas_nothing_to_write(db_wkeys, pandas_orders):
+    assert db_wkeys.write_orders_pandas(keys[0],
+                                        pandas_orders.iloc[:0]) == (0, '')
+
+    df = pandas_orders.copy()
+    df["timestamp"] = datetime(2021, 2, 19, 10)
+    assert db_wkeys.write_orders_pandas(keys[0], df) == (
+        0, f"rejected {len(df)} orders because of time limit;")
+    n, = db_wkeys.execute("SELECT COUNT(*) FROM orders;").fetchone()
+    assert n == 0
+
+
+def test_write_orders_pandas_invalid(db_wkeys, pandas_orders):
+    df = pandas_orders.copy()
+    df.loc[3, "hour_ID"] = 25
+    with pytest.raises(ValueError):
+        db_wkeys.write_orders_pandas(keys[0], df)
+
+    df = pandas_orders.copy()
+    df.loc[3, "type"] = "french fries"
+    with pytest.raises(ValueError):
+        db_wkeys.write_orders_pandas(keys[0], df)
+
+
+def test_read_orders_bulk(db_worders):
+    db_worders.write_orders(keys[2], orders[:2])
+
+    res = db_worders.read_orders_bulk([keys[1]], date(2021, 3, 5),
+                                      date(2021, 3, 6))
+    assert len(res) == 5
+    assert {r["key_id"] for r in res} == {2}
+
+    res = db_worders.read_orders_bulk([keys[1], keys[2]],
+                                      date(2021, 3, 5),
+                                      date(2021, 3, 5),
+                                      hours=[15, 17])
+    assert sorted((r["key_id"], r["hour_ID"]) for r in res) == [(2, 15),
+                                                                (2, 17),
+                                                                (2, 17),
+                                                                (3, 15)]
+
+    res = db_worders.read_orders_bulk(None, date(2021, 3, 1),
+                                      date(2021, 3, 31))
+    assert len(res) == 7
+
+    assert db_worders.read_orders_bulk(["WRONG"], date(2021, 3, 1),
+                                       date(2021, 3, 31)) is None
+
+
+def test_read_orders_bulk_columns(db_worders):
+    columns = db_worders.read_orders_bulk([keys[1]],
+                                          date(2021, 3, 5),
+                                          date(2021, 3, 6),
+                                          output="numpy")
+    assert columns["applying_date"].dtype == "datetime64[D]"
+    assert columns["price"].dtype == "float64"
+    assert columns["hour_ID"].tolist() == [15, 16, 17, 17, 17]
+    assert columns["accepted"].dtype == "float64"  # NULL before clearing
+
+    df = db_worders.read_orders_bulk([keys[1]],
+                                     date(2021, 3, 5),
+                                     date(2021, 3, 6),
+                                     output="pandas")
+    assert len(df) == 5
+    assert df["timestamp"].dtype.kind == "M"
+
+    empty = db_worders.read_orders_bulk([keys[0]],
+                                        date(2021, 3, 5),
+                                        date(2021, 3, 6),
+                                        output="pandas")
+    assert len(empty) == 0
+    assert list(empty.columns) == list(df.columns)
+
+
+def test_iter_orders_chunks(db_worders):
+    chunks = list(
+        db_worders.iter_orders(keys[1], date(2021, 3, 5), chunksize=3))
+    assert [len(c) for c in chunks] == [3, 1]
+    assert ([o for c in chunks for o in c] == db_worders.read_orders(
+        keys[1], date(2021, 3, 5)))
+    assert db_worders.iter_orders("WRONG", date(2021, 3, 5)) is None
+
+    chunks = list(
+        db_worders.iter_orders_bulk(None,
+                                    date(2021, 3, 1),
+                                    date(2021, 3, 31),
+                                    chunksize=2))
+    assert [len(c) for c in chunks] == [2, 2, 1]
@@ -1,23 +1,39 @@
 #!/usr/bin/env python3
-from bid_api import get_app
+from bid_api import get_app, close_app
+import client as bid_client
+import columnar
 import converter
 from fixtures import (keys, orders, db_endpoint, market_index,
                       imbalance_prices, db_withapidata_and_keys, pandas_orders)
 
 from datetime import date, datetime
+import gzip
+import json
 from unittest.mock import patch
 import pytest
 
 endpoint_name = "bids"
 
 
-@pytest.fixture
-def client(db_withapidata_and_keys):
-    app = get_app(db_withapidata_and_keys.filename, None, endpoint_name)
+@pytest.fixture(params=[
+    {},
+    dict(pool_size=2),
+    dict(pool_size=2,
+         journal_mode="WAL",
+         synchronous="NORMAL",
+         group_commit_window=0.001),
+    dict(pool_size=2, read_pool_size=2),
+],
+                ids=["nopool", "pool", "groupcommit", "readpool"])
+def client(request, db_withapidata_and_keys):
+    app = get_app(db_withapidata_and_keys.filename, None, endpoint_name,
+                  **request.param)
 
     with app.test_client() as client:
         yield client
 
+    close_app(app)
+
 
 def test_push_single_order(client):
     order = {
@@ -115,3 +131,206 @@ def test_push_and_get_orders_ok(client, pandas_orders):
 
     assert len(rv.json) == 48
     assert all("accepted" in r for r in rv.json)
+
+
+@pytest.fixture
+def ingestion_app(db_withapidata_and_keys):
+    app = get_app(db_withapidata_and_keys.filename,
+                  None,
+                  endpoint_name,
+                  ingestion_queue_size=16)
+    yield app
+    close_app(app)
+
+
+def test_push_orders_queued(ingestion_app, pandas_orders):
+    fixed_orders = converter.pandas_orders_to_records(pandas_orders)
+    with ingestion_app.test_client() as client:
+        with patch("bid_api.get_time",
+                   return_value=datetime(2021, 2, 18, 9, 0, 1)):
+            r = client.post(f"/{endpoint_name}/set",
+                            json={
+                                "key": keys[1],
+                                "orders": fixed_orders
+                            })
+        d = r.json
+        assert d["accepted"] == len(pandas_orders) / 2
+        assert "time limit" in d["message"]
+
+        ingestion_app.extensions["ingestion_queue"].join()
+
+        rv = client.get(f"/{endpoint_name}/receipt",
+                        query_string=dict(receipt=d["receipt"]))
+        assert rv.json["status"] == "persisted"
+        assert rv.json["orders"] == d["accepted"]
+
+        rv = client.get(f"/{endpoint_name}/get",
+                        query_string=dict(key=keys[1],
+                                          applying_date=date(
+                                              2021, 2, 20).isoformat()))
+        assert len(rv.json) == d["accepted"]
+
+
+def test_unknown_receipt(ingestion_app):
+    with ingestion_app.test_client() as client:
+        rv = client.get(f"/{endpoint_name}/receipt",
+                        query_string=dict(receipt="WRONG"))
+    assert rv.status_code == 404
+
+
+def test_metrics(client, pandas_orders):
+    fixed_orders = converter.pandas_orders_to_records(pandas_orders)
+    with patch("bid_api.get_time", return_value=datetime(2021, 2, 18, 9, 0,
+                                                         1)):
+        client.post(f"/{endpoint_name}/set",
+                    json={
+                        "key": keys[1],
+                        "orders": fixed_orders
+                    })
+    client.get(f"/{endpoint_name}/get",
+               query_string=dict(key=keys[1],
+                                 applying_date=date(2021, 2,
+                                                    19).isoformat()))
+
+    rv = client.get("/metrics")
+    assert rv.status_code == 200
+    assert rv.content_type.startswith("text/plain")
+    text = rv.get_data(as_text=True)
+    half = len(pandas_orders) // 2
+    assert f"bid_api_orders_accepted_total {half}" in text
+    assert f"bid_api_orders_rejected_late_total {half}" in text
+    assert 'bid_api_request_duration_seconds_count{route="set"} 1' in text
+    assert 'bid_api_request_duration_seconds_count{route="get"} 1' in text
+    assert 'bid_api_request_size_bytes_count{route="set"} 1' in text
+    for stage in ["key_lookup", "validation", "insert", "commit"]:
+        assert f'stage_duration_seconds_count{{stage="{stage}"}}' in text
+    for cache in ["key_cache", "market_cache"]:
+        assert f"# TYPE bid_api_{cache}_hits_total counter" in text
+        assert f"bid_api_{cache}_misses_total " in text
+    assert "bid_api_key_cache_size 1" in text
+    assert "bid_api_market_cache_size " in text
+
+
+def test_metrics_disabled(db_withapidata_and_keys):
+    app = get_app(db_withapidata_and_keys.filename,
+                  None,
+                  endpoint_name,
+                  enable_metrics=False)
+    with app.test_client() as client:
+        assert client.get("/metrics").status_code == 404
+    close_app(app)
+
+
+def test_get_orders_bulk(db_withapidata_and_keys, pandas_orders):
+    app = get_app(db_withapidata_and_keys.filename,
+                  None,
+                  endpoint_name,
+                  admin_key="ADMIN")
+    fixed_orders = converter.pandas_orders_to_records(pandas_orders)
+    with app.test_client() as client:
+        with patch("bid_api.get_time",
+                   return_value=datetime(2021, 2, 18, 8, 20)):
+            for key in keys[:2]:
+                client.post(f"/{endpoint_name}/set",
+                            json={
+                                "key": key,
+                                "orders": fixed_orders
+                            })
+
+        query = dict(start_date="2021-02-19", end_date="2021-02-20")
+        rv = client.get(f"/{endpoint_name}/get_bulk",
+                        query_string=query | dict(key=keys[1]))
+        assert len(rv.json) == len(pandas_orders)
+        assert {r["key_id"] for r in rv.json} == {2}
+
+        rv = client.get(f"/{endpoint_name}/get_bulk",
+                        query_string=query | dict(key="ADMIN", hour_ID=[1, 2]))
+        assert len(rv.json) > 0
+        assert {r["key_id"] for r in rv.json} == {1, 2}
+        assert {r["hour_ID"] for r in rv.json} == {1, 2}
+
+        rv = client.get(f"/{endpoint_name}/get_bulk",
+                        query_string=query | dict(key="WRONG"))
+        assert rv.json is None
+
+        rv = client.get(f"/{endpoint_name}/get_bulk",
+                        query_string=dict(key=keys[1],
+                                          start_date="2021-02-31",
+                                          end_date="2021-03-01"))
+        assert rv.status_code == 400
+    close_app(app)
+
+
+def test_get_orders_streamed(client, pandas_orders):
+    fixed_orders = converter.pandas_orders_to_records(pandas_orders)
+    with patch("bid_api.get_time", return_value=datetime(2021, 2, 18, 8, 20)):
+        client.post(f"/{endpoint_name}/set",
+                    json={
+                        "key": keys[1],
+                        "orders": fixed_orders
+                    })
+    query = dict(key=keys[1], applying_date=date(2021, 2, 19).isoformat())
+    expected = client.get(f"/{endpoint_name}/get", query_string=query).json
+
+    rv = client.get(f"/{endpoint_name}/get",
+                    query_string=query | dict(stream="ndjson"))
+    assert rv.mimetype == "application/x-ndjson"
+    lines = rv.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == expected
+
+    rv = client.get(f"/{endpoint_name}/get",
+                    query_string=query | dict(stream="json"))
+    assert json.loads(rv.get_data(as_text=True)) == expected
+
+    rv = client.get(f"/{endpoint_name}/get",
+                    query_string=dict(key="WRONG",
+                                      applying_date="2021-02-19",
+                                      stream="json"))
+    assert json.loads(rv.get_data(as_text=True)) is None
+
+    rv = client.get(f"/{endpoint_name}/get_bulk",
+                    query_string=dict(key=keys[0],
+                                      start_date="2021-02-19",
+                                      end_date="2021-02-20",
+                                      stream="json"))
+    assert json.loads(rv.get_data(as_text=True)) == []
+
+    rv = client.get(f"/{endpoint_name}/get",
+                    query_string=query | dict(stream="xml"))
+    assert rv.status_code == 400
+
+
+def test_get_orders_columnar(client, pandas_orders):
+    fixed_orders = converter.pandas_orders_to_records(pandas_orders)
+    with patch("bid_api.get_time", return_value=datetime(2021, 2, 18, 8, 20)):
+        client.post(f"/{endpoint_name}/set",
+                    json={
+                        "key": keys[1],
+                        "orders": fixed_orders
+                    })
+    query = dict(key=keys[1], applying_date=date(2021, 2, 19).isoformat())
+    expected = client.get(f"/{endpoint_name}/get", query_string=query).json
+
+    for mimetype in columnar.available_mimetypes():
+        rv = client.get(f"/{endpoint_name}/get",
+                        query_string=query,
+                        headers={
+                            "Accept": bid_client.accept_header(mimetype),
+                            "Accept-Encoding": "gzip"
+                        })
+        assert rv.mimetype == mimetype
+        assert rv.content_encoding == "gzip"
+        df = bid_client.decode_orders(gzip.decompress(rv.data), mimetype)
+        assert df["price"].tolist() == [o["price"] for o in expected]
+        assert df["hour_ID"].tolist() == [o["hour_ID"] for o in expected]
+
+        rv = client.get(f"/{endpoint_name}/get",
+                        query_string=dict(key="WRONG",
+                                          applying_date="2021-02-19"),
+                        headers={"Accept": mimetype})
+        assert rv.status_code == 404
+
+    rv = client.get(f"/{endpoint_name}/get",
+                    query_string=query,
+                    headers={"Accept": "*/*"})
+    assert rv.mimetype == "application/json"
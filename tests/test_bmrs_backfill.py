@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+from bmrs_backfill import backfill, date_range, with_retries
+import query_bmrs as bmrs
+from fixtures import db_endpoint, bmrs_server, mid_lines
+
+from datetime import date
+
+
+def count(db, table):
+    n, = db.execute(f"SELECT COUNT(*) FROM {table};").fetchone()
+    return n
+
+
+def test_date_range():
+    days = date_range(date(2021, 1, 30), date(2021, 2, 2))
+    assert days == [
+        date(2021, 1, 30),
+        date(2021, 1, 31),
+        date(2021, 2, 1),
+        date(2021, 2, 2)
+    ]
+
+
+def test_backfill(db_endpoint, bmrs_server):
+    written, failed = backfill(db_endpoint,
+                               date(2021, 1, 1),
+                               date(2021, 1, 10),
+                               max_workers=4,
+                               batch_days=3)
+    assert not failed
+    assert written == {"market_index": 480, "imbalance_prices": 480}
+    assert count(db_endpoint, "market_index") == 480
+    assert count(db_endpoint, "imbalance_prices") == 480
+    assert len(bmrs_server.requests) == 20
+
+
+def test_backfill_retries(db_endpoint, bmrs_server):
+    bmrs_server.fail_once |= {("MID", date(2021, 1, 2)),
+                              ("B1770", date(2021, 1, 3))}
+    written, failed = backfill(db_endpoint,
+                               date(2021, 1, 1),
+                               date(2021, 1, 4),
+                               backoff=0.01)
+    assert not failed
+    assert written == {"market_index": 192, "imbalance_prices": 192}
+    assert len(bmrs_server.requests) == 10
+
+
+def test_truncated_responses_are_retried():
+    responses = [list(mid_lines())[:-10], list(mid_lines())]
+
+    def fetch():
+        return list(bmrs.parse_market_index_lines(responses.pop(0)))
+
+    chunks = with_retries(fetch, backoff=0.01)
+    assert sum(len(c) for c in chunks) == 2 * 48 * 2
+    assert responses == []
+
+
+def test_backfill_gives_up(db_endpoint, bmrs_server):
+    written, failed = backfill(db_endpoint,
+                               date(2021, 1, 1),
+                               date(2021, 1, 2),
+                               tables=["imbalance_prices"],
+                               retries=0)
+    assert written == {"imbalance_prices": 96}
+
+    bmrs_server.fail_once.add(("B1770", date(2021, 1, 5)))
+    written, failed = backfill(db_endpoint,
+                               date(2021, 1, 5),
+                               date(2021, 1, 5),
+                               tables=["imbalance_prices"],
+                               retries=0)
+    assert written == {"imbalance_prices": 0}
+    assert [(t, d) for t, d, _ in failed] == [("imbalance_prices",
+                                               date(2021, 1, 5))]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import query_bmrs as bmrs
+from bmrs_cache import ResponseCache
+from fixtures import bmrs_server
+
+from datetime import date, timedelta
+import os
+import pytest
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    bmrs.set_cache(cache)
+    yield cache
+    bmrs.set_cache(None)
+
+
+def test_second_request_is_a_hit(cache, bmrs_server):
+    df1 = bmrs.get_imbalance_prices("2021-01-01")
+    df2 = bmrs.get_imbalance_prices("2021-01-01")
+    assert df1.equals(df2)
+    assert len(bmrs_server.requests) == 1
+    report = cache.report()
+    assert (report["hits"], report["misses"], report["entries"]) == (1, 1, 1)
+
+
+def test_market_index_is_cached(cache, bmrs_server):
+    df1 = bmrs.get_market_index("2021-01-01", "2021-01-03")
+    df2 = bmrs.get_market_index("2021-01-01", "2021-01-03")
+    assert df1.equals(df2)
+    assert len(bmrs_server.requests) == 1
+
+
+def test_key_ignores_apikey(cache, bmrs_server, monkeypatch):
+    bmrs.get_imbalance_prices("2021-01-01")
+    monkeypatch.setattr(bmrs, "apikey", "ANOTHER")
+    bmrs.get_imbalance_prices("2021-01-01")
+    assert len(bmrs_server.requests) == 1
+    bmrs.get_imbalance_prices("2021-01-02")
+    assert len(bmrs_server.requests) == 2
+
+
+def test_today_expires(cache, bmrs_server):
+    cache.today_ttl = -1  # already expired when written
+    today = date.today()
+    bmrs.get_imbalance_prices(today)
+    bmrs.get_imbalance_prices(today)
+    assert len(bmrs_server.requests) == 2
+    assert cache.report()["expired"] == 1
+
+    past = today - timedelta(days=3)
+    bmrs.get_imbalance_prices(past)
+    bmrs.get_imbalance_prices(past)
+    assert len(bmrs_server.requests) == 3
+
+
+def test_lru_eviction(cache, bmrs_server):
+    bmrs.get_imbalance_prices("2021-01-01")
+    entry_size = cache.report()["bytes"]
+    cache.max_bytes = int(2.5 * entry_size)
+
+    bmrs.get_imbalance_prices("2021-01-02")
+    os.utime(cache._path("B1770", "V1", {
+        "APIKey": None,
+        "SettlementDate": "2021-01-01",
+        "Period": "*",
+        "ServiceType": "csv"
+    }), (0, 0))  # make 2021-01-01 the least recently used
+    bmrs.get_imbalance_prices("2021-01-03")
+
+    report = cache.report()
+    assert report["entries"] == 2
+    assert report["evicted"] == 1
+    nrequests = len(bmrs_server.requests)
+    bmrs.get_imbalance_prices("2021-01-02")
+    assert len(bmrs_server.requests) == nrequests
+    bmrs.get_imbalance_prices("2021-01-01")
+    assert len(bmrs_server.requests) == nrequests + 1
+
+
+def test_invalid_response_not_cached(cache, monkeypatch):
+    lines = ["HDR,MARKET INDEX DATA", "MID,APXMIDP,20210101,1,40,10", "FTR,5"]
+    monkeypatch.setattr(bmrs, "_stream_lines",
+                        lambda url, params, session=None: iter(lines))
+    with pytest.raises(bmrs.InvalidResponse):
+        bmrs.get_market_index("2021-01-01")
+    assert cache.report()["entries"] == 0
+    assert os.listdir(cache.directory) == []
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import bmrs_sync
+from bmrs_backfill import backfill
+from bmrs_cache import ResponseCache
+import query_bmrs as bmrs
+from fixtures import db_endpoint, bmrs_server
+
+from datetime import date, datetime
+
+
+def count(db, table):
+    n, = db.execute(f"SELECT COUNT(*) FROM {table};").fetchone()
+    return n
+
+
+def test_settled_periods():
+    day = date(2021, 1, 2)
+    assert list(bmrs_sync.settled_periods(day, datetime(2021, 1, 1,
+                                                        23))) == []
+    assert list(bmrs_sync.settled_periods(day, datetime(2021, 1, 2, 1,
+                                                        10))) == [1, 2]
+    assert len(bmrs_sync.settled_periods(day, datetime(2021, 1, 5))) == 48
+
+
+def test_plan_requests():
+    missing = {date(2021, 1, 1): [3, 4], date(2021, 1, 2): list(range(1, 49))}
+    assert bmrs_sync.plan_requests(missing, max_period_requests=4) == [
+        (date(2021, 1, 1), 3),
+        (date(2021, 1, 1), 4),
+        (date(2021, 1, 2), '*'),
+    ]
+
+
+def test_sync_empty_db(db_endpoint, bmrs_server):
+    now = datetime(2021, 1, 3, 1, 0)
+    report = bmrs_sync.sync(db_endpoint, now=now, lookback_days=1)
+    # 2021-01-02, and the first 2 periods of 2021-01-03
+    for table in ["market_index", "imbalance_prices"]:
+        assert report[table]["missing"] == 50
+        assert report[table]["requests"] == 3
+        assert report[table]["inserted"] == 50
+        assert count(db_endpoint, table) == 50
+
+
+def test_sync_nothing_new(db_endpoint, bmrs_server):
+    now = datetime(2021, 1, 3, 1, 0)
+    bmrs_sync.sync(db_endpoint, now=now, lookback_days=1)
+    nrequests = len(bmrs_server.requests)
+
+    report = bmrs_sync.sync(db_endpoint, now=now, lookback_days=1)
+    assert len(bmrs_server.requests) == nrequests
+    for table in ["market_index", "imbalance_prices"]:
+        assert report[table]["requests"] == 0
+        assert report[table]["fetched"] == 0
+
+
+def test_sync_fills_gaps(db_endpoint, bmrs_server):
+    backfill(db_endpoint, date(2021, 1, 1), date(2021, 1, 4))
+    db_endpoint.execute('''
+    DELETE FROM imbalance_prices
+    WHERE (date = '2021-01-02' AND period IN (5, 6))
+    OR date = '2021-01-03';''')
+    db_endpoint.commit()
+    bmrs_server.requests.clear()
+
+    report = bmrs_sync.sync(db_endpoint,
+                            now=datetime(2021, 1, 5),
+                            lookback_days=3,
+                            tables=["imbalance_prices"])
+    rep = report["imbalance_prices"]
+    assert rep["missing"] == 2 + 48
+    assert rep["requests"] == 3
+    assert (rep["inserted"], rep["updated"]) == (50, 0)
+    assert count(db_endpoint, "imbalance_prices") == 4 * 48
+    assert sorted(p["Period"] for _, p in bmrs_server.requests) == [
+        "*", "5", "6"
+    ]
+
+
+def test_sync_refetches_cached_gaps(db_endpoint, bmrs_server, tmp_path,
+                                    monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    bmrs.set_cache(cache)
+    try:
+        now = datetime(2021, 1, 3, 1, 0)
+        # As fetched before BMRS published the data: empty, and cached.
+        with monkeypatch.context() as m:
+            m.setattr(bmrs, "_stream_lines", lambda url, params, session=None:
+                      iter(["HDR,MARKET INDEX DATA", "FTR,0"]))
+            report = bmrs_sync.sync(db_endpoint,
+                                    now=now,
+                                    lookback_days=1,
+                                    tables=["market_index"])
+        assert report["market_index"]["inserted"] == 0
+        assert cache.report()["entries"] == 3
+
+        report = bmrs_sync.sync(db_endpoint,
+                                now=now,
+                                lookback_days=1,
+                                tables=["market_index"])
+        assert len(bmrs_server.requests) == 3
+        assert report["market_index"]["inserted"] == 50
+        # The cache has the complete responses now.
+        assert len(bmrs.get_market_index("2021-01-02")) == 2 * 48
+        assert len(bmrs_server.requests) == 3
+    finally:
+        bmrs.set_cache(None)
+
+
+def test_sync_updates_only_changed(db_endpoint, bmrs_server):
+    backfill(db_endpoint, date(2021, 1, 1), date(2021, 1, 1))
+    db_endpoint.execute('''
+    UPDATE market_index
+    SET price = 0
+    WHERE period = 7;''')
+    db_endpoint.execute('''
+    DELETE FROM market_index
+    WHERE period > 40;''')
+    db_endpoint.commit()
+
+    report = bmrs_sync.sync(db_endpoint,
+                            now=datetime(2021, 1, 2),
+                            lookback_days=0,
+                            tables=["market_index"],
+                            max_period_requests=4)
+    rep = report["market_index"]
+    assert rep["missing"] == 8
+    assert rep["fetched"] == 48  # the whole day
+    assert (rep["inserted"], rep["updated"]) == (8, 1)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import columnar
+import client
+from fixtures import keys, db_worders, db_wkeys, db_endpoint
+
+from datetime import date
+import numpy as np
+import pytest
+
+
+@pytest.fixture(params=[columnar.arrow_mimetype, columnar.msgpack_mimetype],
+                ids=["arrow", "msgpack"])
+def mimetype(request):
+    if request.param not in columnar.available_mimetypes():
+        pytest.skip(f"{request.param} not available")
+    return request.param
+
+
+def test_roundtrip(db_worders, mimetype):
+    columns = db_worders.read_orders_bulk(None,
+                                          date(2021, 3, 1),
+                                          date(2021, 3, 31),
+                                          output="numpy")
+    expected = db_worders.read_orders_bulk(None,
+                                           date(2021, 3, 1),
+                                           date(2021, 3, 31),
+                                           output="pandas")
+
+    df = client.decode_orders(columnar.encode(columns, mimetype), mimetype)
+
+    assert list(df.columns) == list(expected.columns)
+    assert df["price"].tolist() == expected["price"].tolist()
+    assert df["type"].tolist() == expected["type"].tolist()
+    assert (df["applying_date"].to_numpy() ==
+            expected["applying_date"].to_numpy()).all()
+    assert (df["timestamp"].to_numpy() == expected["timestamp"].to_numpy()
+            ).all()
+    assert df["accepted"].isna().all()
+
+
+def test_msgpack_columns_not_copied(db_worders):
+    if columnar.msgpack_mimetype not in columnar.available_mimetypes():
+        pytest.skip("msgpack not available")
+    columns = db_worders.read_orders(keys[1],
+                                     date(2021, 3, 5),
+                                     output="numpy")
+    content = columnar.encode(columns, columnar.msgpack_mimetype)
+    decoded = columnar.decode_msgpack(content)
+    assert not decoded["price"].flags.owndata
+    assert np.array_equal(decoded["price"], columns["price"])
+
+
+def test_accept_header():
+    assert client.accept_header("application/x-msgpack") == (
+        "application/x-msgpack, application/json;q=0.1")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+from connection_pool import ConnectionPool
+from auction_db import AuctionDbEndpoint
+
+import os
+import pytest
+import sqlite3
+import threading
+import time
+
+
+@pytest.fixture
+def pool():
+    pool = ConnectionPool("test.db", 2)
+    yield pool
+    pool.close()
+    os.remove("test.db")
+
+
+def test_pool_creates_schema(pool):
+    with pool.connection() as connection:
+        bid_db = AuctionDbEndpoint(pool.filename, connection=connection)
+        tables = [
+            r[0] for r in bid_db.execute('''
+        SELECT name
+        FROM sqlite_master
+        WHERE type = 'table';''').fetchall()
+        ]
+    assert set(AuctionDbEndpoint.tables) <= set(tables)
+
+
+def test_pool_reuses_connections(pool):
+    seen = set()
+    for _ in range(5):
+        with pool.connection() as connection:
+            seen.add(id(connection))
+    assert len(seen) == 1
+
+
+def test_pool_size_is_fixed(pool):
+    with pool.connection() as c1, pool.connection() as c2:
+        assert c1 is not c2
+        pool.checkout_timeout = 0.01
+        with pytest.raises(TimeoutError):
+            with pool.connection():
+                pass
+
+
+def test_pool_replaces_broken_connection(pool):
+    with pool.connection() as connection:
+        connection.close()
+    with pool.connection() as connection:
+        assert ConnectionPool.is_healthy(connection)
+
+
+def test_pool_rolls_back_on_return(pool):
+    with pool.connection() as connection:
+        connection.execute("INSERT INTO keys VALUES (NULL, 'abc');")
+    with pool.connection() as connection:
+        n, = connection.execute("SELECT COUNT(*) FROM keys;").fetchone()
+    assert n == 0
+
+
+def test_pool_across_threads(pool):
+    bid_db = AuctionDbEndpoint(pool.filename)
+    bid_db.write_key("AAAAAAA")
+    bid_db.close()
+    errors = []
+
+    def work():
+        try:
+            for _ in range(20):
+                with pool.connection() as connection:
+                    bid_db = AuctionDbEndpoint(pool.filename,
+                                               connection=connection)
+                    assert bid_db.find_key_id("AAAAAAA") == 1
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+
+
+@pytest.fixture
+def wal_writer():
+    bid_db = AuctionDbEndpoint("test.db")
+    bid_db.set_durability("WAL")
+    bid_db.write_key("AAAAAAA")
+    yield bid_db
+    bid_db.close()
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists("test.db" + suffix):
+            os.remove("test.db" + suffix)
+
+
+def count_keys(connection):
+    return connection.execute("SELECT COUNT(*) FROM keys;").fetchone()[0]
+
+
+def test_read_only_pool_rejects_writes(wal_writer):
+    pool = ConnectionPool("test.db", 1, read_only=True)
+    with pool.connection() as connection:
+        with pytest.raises(sqlite3.OperationalError):
+            connection.execute("DELETE FROM keys;")
+    pool.close()
+
+
+def test_read_only_pool_reads_one_snapshot(wal_writer):
+    pool = ConnectionPool("test.db", 1, read_only=True)
+    with pool.connection() as connection:
+        assert count_keys(connection) == 1
+        wal_writer.write_key("BBBBBB")
+        assert count_keys(connection) == 1
+    with pool.connection() as connection:
+        assert count_keys(connection) == 2
+    pool.close()
+
+
+def test_read_only_pool_does_not_wait_for_writer(wal_writer):
+    pool = ConnectionPool("test.db", 1, read_only=True)
+    wal_writer.execute("BEGIN IMMEDIATE;")
+    wal_writer.executemany("INSERT INTO keys VALUES (NULL, ?);",
+                           [(str(i), ) for i in range(10000)])
+    start = time.perf_counter()
+    with pool.connection() as connection:
+        assert count_keys(connection) == 1
+    assert time.perf_counter() - start < 1
+    wal_writer.rollback()
+    pool.close()
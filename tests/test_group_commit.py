@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+from group_commit import GroupCommitWriter
+from auction_db import AuctionDbEndpoint
+from fixtures import keys, orders
+
+import os
+import pytest
+import threading
+
+
+@pytest.fixture
+def writer():
+    bid_db = AuctionDbEndpoint("test.db")
+    for key in keys:
+        bid_db.write_key(key)
+    bid_db.close()
+    writer = GroupCommitWriter("test.db",
+                               window=0.2,
+                               journal_mode="WAL",
+                               synchronous="NORMAL")
+    yield writer
+    writer.close()
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists("test.db" + suffix):
+            os.remove("test.db" + suffix)
+
+
+def count_orders():
+    bid_db = AuctionDbEndpoint("test.db")
+    n, = bid_db.execute("SELECT COUNT(*) FROM orders;").fetchone()
+    bid_db.close()
+    return n
+
+
+def test_wal_enabled(writer):
+    bid_db = AuctionDbEndpoint("test.db")
+    mode, = bid_db.execute("PRAGMA journal_mode;").fetchone()
+    bid_db.close()
+    assert mode.upper() == "WAL"
+
+
+def test_single_submit(writer):
+    accepted, message = writer.submit(keys[1], orders)
+    assert accepted == len(orders)
+    assert message == ''
+    assert count_orders() == len(orders)
+
+
+def test_concurrent_submits_share_commit(writer):
+    results = {}
+    nsubmitters = 5
+
+    def submit(i):
+        results[i] = writer.submit(keys[i % len(keys)], orders[:i + 1])
+
+    threads = [
+        threading.Thread(target=submit, args=(i, ))
+        for i in range(nsubmitters)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert writer.nrequests == nsubmitters
+    assert writer.ncommits < nsubmitters
+    for i in range(nsubmitters):
+        assert results[i] == (i + 1, '')
+    assert count_orders() == sum(range(1, nsubmitters + 1))
+
+
+def test_invalid_submit_does_not_affect_others(writer):
+    bad = [orders[0] | {"type": "french fries"}]
+    errors = []
+    results = []
+
+    def submit(os):
+        try:
+            results.append(writer.submit(keys[1], os))
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=submit, args=(os, ))
+        for os in [orders, bad, orders]
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(errors) == 1
+    assert results == [(len(orders), '')] * 2
+    assert count_orders() == 2 * len(orders)
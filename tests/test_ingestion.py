@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import ingestion
+from auction_db import AuctionDbEndpoint
+from fixtures import keys, orders
+
+import os
+import pytest
+import queue
+
+
+@pytest.fixture
+def bid_db():
+    bid_db = AuctionDbEndpoint("test.db")
+    for key in keys:
+        bid_db.write_key(key)
+    yield bid_db
+    bid_db.close()
+    os.remove("test.db")
+
+
+@pytest.fixture
+def ingestion_queue(bid_db):
+    q = ingestion.IngestionQueue("test.db", maxsize=4)
+    yield q
+    q.close()
+
+
+def count_orders(bid_db):
+    n, = bid_db.execute("SELECT COUNT(*) FROM orders;").fetchone()
+    return n
+
+
+def test_enqueue_and_persist(bid_db, ingestion_queue):
+    receipts = []
+    for key in keys:
+        _key_id, rows, _message = bid_db.prepare_orders(key, orders)
+        receipts.append(ingestion_queue.enqueue(rows))
+    ingestion_queue.join()
+
+    for receipt in receipts:
+        status = ingestion_queue.status(receipt)
+        assert status["status"] == ingestion.PERSISTED
+        assert status["orders"] == len(orders)
+    assert count_orders(bid_db) == len(keys) * len(orders)
+    assert ingestion_queue.ncommits <= len(keys)
+
+
+def test_queue_full(bid_db):
+    q = ingestion.IngestionQueue("test.db", maxsize=1)
+    _key_id, rows, _message = bid_db.prepare_orders(keys[0], orders)
+    # Keep the writer busy so that the queue fills up.
+    bid_db.execute("BEGIN IMMEDIATE;")
+    try:
+        with pytest.raises(queue.Full):
+            for _ in range(10):
+                q.enqueue(rows)
+    finally:
+        bid_db.rollback()
+        q.close()
+
+
+def test_failed_write(bid_db, ingestion_queue):
+    receipt = ingestion_queue.enqueue([["not", "a", "row"]])
+    ingestion_queue.join()
+    status = ingestion_queue.status(receipt)
+    assert status["status"] == ingestion.FAILED
+    assert "error" in status
+    assert count_orders(bid_db) == 0
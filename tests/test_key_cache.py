@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+from key_cache import KeyCache
+from auction_db import AuctionDbEndpoint
+from fixtures import keys
+
+import os
+import pytest
+
+
+@pytest.fixture
+def cached_db():
+    cache = KeyCache(maxsize=2)
+    bid_db = AuctionDbEndpoint("test.db", key_cache=cache)
+    yield bid_db
+    bid_db.close()
+    os.remove("test.db")
+
+
+def test_hits_and_misses(cached_db):
+    cache = cached_db.key_cache
+    cached_db.write_key(keys[0])
+    assert cached_db.find_key_id(keys[0]) == 1
+    assert cached_db.find_key_id(keys[0]) == 1
+    assert cache.hits == 1
+    assert cache.misses == 2  # the check in write_key, then the first find
+
+
+def test_lru_eviction(cached_db):
+    cache = cached_db.key_cache
+    for key in keys:
+        cached_db.write_key(key)
+    for key in keys:
+        cached_db.find_key_id(key)
+    assert cache.stats()["size"] == 2
+
+    hits = cache.hits
+    cached_db.find_key_id(keys[0])  # the oldest, evicted
+    assert cache.hits == hits
+    cached_db.find_key_id(keys[2])
+    assert cache.hits == hits + 1
+
+
+def test_write_key_invalidates_unknown(cached_db):
+    assert cached_db.find_key_id(keys[0]) is None
+    cached_db.write_key(keys[0])
+    assert cached_db.find_key_id(keys[0]) == 1
+
+
+def test_revoke_key(cached_db):
+    cached_db.write_key(keys[0])
+    assert cached_db.find_key_id(keys[0]) == 1
+    cached_db.revoke_key(keys[0])
+    assert cached_db.find_key_id(keys[0]) is None
+    assert cached_db.read_orders(keys[0], None) is None
+
+
+def test_ttl_expiry():
+    cache = KeyCache(ttl=-1)  # everything is already expired
+    cache.store("abc", 1)
+    assert cache.lookup("abc") == (False, None)
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import loggers
+
+import json
+import os
+import pytest
+
+
+@pytest.fixture
+def logfile():
+    yield "test.log"
+    loggers.stop_listener()
+    os.remove("test.log")
+
+
+def test_handler_attached_once(logfile):
+    loggers.set_global_handler(logfile)
+    logger = loggers.get_logger("TEST_ONCE")
+    loggers.get_logger("TEST_ONCE")
+    assert len(logger.handlers) == 1
+
+    logger.info("Written %d orders", 3)
+    loggers.stop_listener()
+    with open(logfile) as f:
+        lines = f.readlines()
+    assert len(lines) == 1
+    assert lines[0].rstrip().endswith("TEST_ONCE - INFO - Written 3 orders")
+
+
+def test_json_format(logfile):
+    loggers.set_global_handler(logfile, json_format=True)
+    logger = loggers.get_logger("TEST_JSON")
+    logger.warning("Failed to fetch %s", "market_index")
+    loggers.stop_listener()
+    with open(logfile) as f:
+        entry = json.loads(f.readline())
+    assert entry["logger"] == "TEST_JSON"
+    assert entry["level"] == "WARNING"
+    assert entry["message"] == "Failed to fetch market_index"
+
+
+def test_new_handler_replaces_old(logfile):
+    loggers.set_global_handler(logfile)
+    logger = loggers.get_logger("TEST_REPLACE")
+    loggers.set_global_handler(logfile)
+    assert logger.handlers == [loggers._global_handler]
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+from auction_db import AuctionDbEndpoint
+import converter
+from market_cache import MarketIndexCache
+from fixtures import (
+    keys,
+    db_endpoint,
+    db_withapidata_and_keys,
+    market_index,
+    imbalance_prices,
+    pandas_orders,
+)
+
+from datetime import date
+import sqlite3
+
+import pytest
+
+days = [date(2021, 2, 19), date(2021, 2, 20)]
+
+
+def accepted(bid_db):
+    return [
+        o["accepted"] for d in days for o in bid_db.read_orders(keys[1], d)
+    ]
+
+
+@pytest.fixture
+def cached_db(db_withapidata_and_keys):
+    db_withapidata_and_keys.market_cache = MarketIndexCache(8)
+    return db_withapidata_and_keys
+
+
+def test_cleared_like_sql(cached_db, pandas_orders):
+    cached_db.write_orders_pandas(keys[1], pandas_orders)
+    in_python = accepted(cached_db)
+    assert None not in in_python and 0 in in_python and 1 in in_python
+
+    cached_db.clear_orders(days)
+    cached_db.commit()
+    assert accepted(cached_db) == in_python
+    stats = cached_db.market_cache.stats()
+    assert stats["size"] == 2
+    # Once per day, not per order.
+    assert stats["hits"] + stats["misses"] == len(days)
+
+
+def test_records_cleared_like_sql(cached_db, pandas_orders):
+    cached_db.write_orders(keys[1],
+                           converter.pandas_orders_to_records(pandas_orders))
+    in_python = accepted(cached_db)
+    assert None not in in_python
+    cached_db.clear_orders(days)
+    cached_db.commit()
+    assert accepted(cached_db) == in_python
+
+
+def test_prices_read_with_the_write_lock(cached_db, market_index,
+                                         pandas_orders):
+    other = AuctionDbEndpoint(cached_db.filename)
+    other.set_durability(busy_timeout=0)
+    market_prices = cached_db._market_prices
+    errors = []
+
+    def read_after_other_writer(applying_date):
+        # The other writer must not get in between the read and the insert.
+        try:
+            other.write_market_index(market_index)
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+        return market_prices(applying_date)
+
+    cached_db._market_prices = read_after_other_writer
+    try:
+        cached_db.write_orders_pandas(keys[1], pandas_orders)
+    finally:
+        other.close()
+    assert len(errors) == len(days)
+    assert all("locked" in str(e) for e in errors)
+
+
+def test_missing_market_index(cached_db, pandas_orders):
+    cached_db.execute("DELETE FROM market_index WHERE period > 24;")
+    cached_db.commit()
+    cached_db.write_orders_pandas(keys[1], pandas_orders)
+    res = cached_db.read_orders(keys[1], days[0])
+    assert all((o["accepted"] is None) == (o["hour_ID"] > 24) for o in res)
+
+
+def test_changes_of_other_connections_are_seen(cached_db, market_index,
+                                               pandas_orders):
+    cached_db.write_orders_pandas(keys[1], pandas_orders[:10])
+    before = cached_db.market_cache.version
+
+    # As another process would.
+    other = AuctionDbEndpoint(cached_db.filename)
+    changed = market_index.copy()
+    changed["Price"] = 1e6  # every BUY below: rejected
+    other.write_market_index(changed)
+    other.close()
+
+    cached_db.write_orders_pandas(keys[1], pandas_orders[10:])
+    assert cached_db.market_cache.version == before + 1
+    res = cached_db.read_orders_bulk(None, days[0], days[1])
+    assert all(o["accepted"] == (o["type"] == "SELL") for o in res)
+
+
+def test_version_read_only_after_commits(cached_db, pandas_orders):
+    statements = []
+    cached_db._connection.set_trace_callback(statements.append)
+    for i in range(3):
+        cached_db.write_orders_pandas(keys[1], pandas_orders[i::3])
+    cached_db._connection.set_trace_callback(None)
+
+    reads = [s for s in statements if "FROM data_versions" in s]
+    assert len(reads) == 1
+    prices = [s for s in statements if "FROM market_index" in s]
+    assert len(prices) == len(days)
+
+
+def test_lru_and_versions():
+    cache = MarketIndexCache(2)
+    cache.check_version(1)
+    for d in ["2021-01-01", "2021-01-02", "2021-01-03"]:
+        cache.store(d, {1: 40.0}, 1)
+    assert cache.lookup("2021-01-01") == (False, None)
+    assert cache.lookup("2021-01-03") == (True, {1: 40.0})
+
+    # Read before the version changed: not stored.
+    cache.check_version(2)
+    assert cache.lookup("2021-01-03") == (False, None)
+    cache.store("2021-01-03", {1: 40.0}, 1)
+    assert cache.lookup("2021-01-03") == (False, None)
+
+    with pytest.raises(ValueError):
+        MarketIndexCache(0)
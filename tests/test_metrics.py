@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+from metrics import Counter, Histogram, Registry, BidMetrics
+
+
+def test_counter():
+    registry = Registry()
+    c = registry.register(Counter("things_total", "Things.", ["kind"]))
+    c.inc(labels=("a", ))
+    c.inc(2, labels=("a", ))
+    c.inc(labels=("b", ))
+    assert c.value(("a", )) == 3
+    text = registry.render()
+    assert "# TYPE things_total counter" in text
+    assert 'things_total{kind="a"} 3' in text
+    assert 'things_total{kind="b"} 1' in text
+
+
+def test_histogram_cumulative_buckets():
+    registry = Registry()
+    h = registry.register(Histogram("latency_seconds", "Latency.", [0.1, 1]))
+    for v in [0.05, 0.1, 0.5, 2]:
+        h.observe(v)
+    assert h.count() == 4
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_sum 2.65" in lines
+    assert "latency_seconds_count 4" in lines
+
+
+def test_stage_timer():
+    m = BidMetrics()
+    with m.time("commit"):
+        pass
+    try:
+        with m.time("insert"):
+            raise ValueError
+    except ValueError:
+        pass
+    assert m.stage_duration.count(("commit", )) == 1
+    assert m.stage_duration.count(("insert", )) == 1
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import migrations
+from auction_db import AuctionDbEndpoint
+from common_db_operations import setup_db
+
+from datetime import date
+import hashlib
+import os
+import pytest
+
+
+def index_names(connection):
+    return {
+        r[0]
+        for r in connection.execute('''
+        SELECT name
+        FROM sqlite_master
+        WHERE type = 'index' AND name NOT LIKE 'sqlite_autoindex%';''')
+    }
+
+
+# Fields added by migrations, per table
+added_fields = {"orders": ["accepted"]}
+# Tables added by migrations
+added_tables = ["data_versions", "archive_watermarks"]
+
+
+@pytest.fixture
+def old_db_file():
+    # A database as created before the migrations existed.
+    schema = {
+        table: {
+            "fields": [
+                f for f in spec["fields"]
+                if f[0] not in added_fields.get(table, [])
+            ],
+            "constraints": spec["constraints"]
+        }
+        for table, spec in AuctionDbEndpoint.tables.items()
+        if table not in added_tables
+    }
+    c, conn = setup_db("test.db", schema)
+    c.execute("INSERT INTO keys VALUES (NULL, ?);",
+              (hashlib.sha256(b"abc").hexdigest(), ))
+    c.execute("INSERT INTO market_index VALUES ('2021-03-05', 1, 40, 1);")
+    c.executemany(
+        '''
+    INSERT INTO orders
+    VALUES (NULL, 1, '2021-03-04 08:00:00', ?, ?, ?, 1, ?);''',
+        [("2021-03-05", 1, "BUY", 50), ("2021-03-05", 1, "SELL", 50),
+         ("2021-03-06", 1, "BUY", 50)])
+    conn.commit()
+    conn.close()
+    yield "test.db"
+    os.remove("test.db")
+
+
+def test_new_db_is_stamped():
+    bid_db = AuctionDbEndpoint("test.db")
+    try:
+        assert migrations.get_version(bid_db._connection) == \
+            migrations.latest_version
+    finally:
+        bid_db.close()
+        os.remove("test.db")
+
+
+def test_old_db_is_migrated(old_db_file):
+    bid_db = AuctionDbEndpoint(old_db_file)
+    connection = bid_db._connection
+
+    assert migrations.get_version(connection) == migrations.latest_version
+    expected = {
+        name
+        for t in AuctionDbEndpoint.tables.values()
+        for name, _ in t.get("indexes", [])
+    }
+    assert expected <= index_names(connection)
+    for table in added_tables:
+        assert bid_db.execute(f"SELECT * FROM {table};").fetchall() == []
+    # data is untouched
+    n, = bid_db.execute("SELECT COUNT(*) FROM keys;").fetchone()
+    assert n == 1
+    # and the existing orders have been cleared
+    res = bid_db.read_orders("abc", date(2021, 3, 5))
+    bid_db.close()
+    assert [o["accepted"] for o in res] == [1, 0]
+
+
+def test_migrate_is_idempotent(old_db_file):
+    AuctionDbEndpoint(old_db_file).close()
+    bid_db = AuctionDbEndpoint(old_db_file)
+    assert migrations.migrate(bid_db._connection,
+                              AuctionDbEndpoint.tables) == []
+    bid_db.close()
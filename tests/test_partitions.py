@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import auction_db
+from common_db_operations import connect
+import partitions
+from fixtures import (
+    keys,
+    orders,
+    db_endpoint,
+    db_wkeys,
+    db_withapidata_and_keys,
+    db_complete,
+    market_index,
+    imbalance_prices,
+    pandas_orders,
+)
+
+from datetime import date, datetime
+import os
+
+import pytest
+
+
+def month_orders(months):
+    return [{
+        "timestamp": datetime(2021, m - 1, 1, 8),
+        "applying_date": date(2021, m, d),
+        "hour_ID": h,
+        "type": "BUY" if h % 2 else "SELL",
+        "volume": "1",
+        "price": "40"
+    } for m in months for d in [2, 28] for h in [1, 2]]
+
+
+def tables(bid_db):
+    return {
+        name
+        for name, in bid_db.execute('''
+        SELECT name
+        FROM sqlite_master
+        WHERE type = 'table';''')
+    }
+
+
+def test_existing_orders_are_moved(db_complete):
+    before = db_complete.read_orders_bulk(None, date(2021, 2, 1),
+                                          date(2021, 2, 28))
+    assert before and all(o["accepted"] is not None for o in before)
+
+    db_complete.partition_orders()
+
+    assert db_complete.partitioned
+    assert db_complete.order_partitions() == ["2021-02"]
+    n, = db_complete.execute("SELECT COUNT(*) FROM orders;").fetchone()
+    assert n == 0
+    after = db_complete.read_orders_bulk(None, date(2021, 2, 1),
+                                         date(2021, 2, 28))
+    assert after == before
+    assert db_complete.read_orders(keys[1], date(2021, 2, 19)) == [
+        o for o in before if o["applying_date"] == date(2021, 2, 19)
+    ]
+
+
+def test_writes_are_routed(db_wkeys, pandas_orders):
+    db_wkeys.partition_orders()
+    db_wkeys.write_orders(keys[0], month_orders([3, 5]))
+    db_wkeys.write_orders_pandas(keys[1], pandas_orders)
+
+    assert db_wkeys.order_partitions() == ["2021-02", "2021-03", "2021-05"]
+    assert {"orders_2021_03", "orders_2021_05"} <= tables(db_wkeys)
+    n, = db_wkeys.execute("SELECT COUNT(*) FROM orders_2021_03;").fetchone()
+    assert n == 4
+
+    # The ids are unique across the partitions.
+    res = db_wkeys.read_orders_bulk(None, date(2021, 1, 1),
+                                    date(2021, 12, 31))
+    ids = [o["order_id"] for o in res]
+    assert len(res) == 8 + len(pandas_orders)
+    assert sorted(ids) == list(range(1, len(res) + 1))
+
+
+def test_reads_match_unpartitioned(db_wkeys):
+    db_wkeys.write_orders(keys[0], month_orders([3, 4, 5]))
+    db_wkeys.write_orders(keys[1], month_orders([4]))
+    ranges = [(date(2021, 3, 28), date(2021, 4, 2)),
+              (date(2021, 1, 1), date(2021, 12, 31)),
+              (date(2021, 4, 3), date(2021, 4, 27)),
+              (date(2022, 1, 1), date(2022, 2, 1))]
+    expected = [
+        db_wkeys.read_orders_bulk(None, start, end, hours=[2])
+        for start, end in ranges
+    ]
+
+    db_wkeys.partition_orders()
+
+    assert [
+        db_wkeys.read_orders_bulk(None, start, end, hours=[2])
+        for start, end in ranges
+    ] == expected
+    assert db_wkeys.read_orders(keys[0], date(2022, 1, 2)) == []
+
+
+def test_only_relevant_partitions_are_read(db_wkeys):
+    db_wkeys.partition_orders()
+    db_wkeys.write_orders(keys[0], month_orders([3, 4, 5]))
+
+    statements = []
+    db_wkeys._connection.set_trace_callback(statements.append)
+    db_wkeys.read_orders_bulk([keys[0]], date(2021, 4, 1), date(2021, 5, 1))
+    db_wkeys._connection.set_trace_callback(None)
+
+    select = [s for s in statements if "UNION ALL" in s]
+    assert len(select) == 1
+    assert "orders_2021_04" in select[0] and "orders_2021_05" in select[0]
+    assert "orders_2021_03" not in select[0]
+
+
+def test_market_index_clears_partitions(db_wkeys, market_index):
+    db_wkeys.partition_orders()
+    db_wkeys.write_orders(keys[0], [
+        o | {
+            "applying_date": date(2021, 2, 19),
+            "timestamp": datetime(2021, 2, 18, 8)
+        } for o in orders
+    ])
+    db_wkeys.write_market_index(market_index)
+
+    res = db_wkeys.read_orders(keys[0], date(2021, 2, 19))
+    assert len(res) == len(orders)
+    assert all(o["accepted"] is not None for o in res)
+
+
+def test_drop_and_detach(db_wkeys):
+    db_wkeys.partition_orders()
+    db_wkeys.write_orders(keys[0], month_orders([3, 4, 5]))
+
+    assert db_wkeys.drop_order_partitions(date(2021, 4, 15)) == ["2021-03"]
+    assert "orders_2021_03" not in tables(db_wkeys)
+    assert db_wkeys.read_orders(keys[0], date(2021, 3, 2)) == []
+
+    expected = db_wkeys.read_orders(keys[0], date(2021, 4, 2))
+    db_wkeys.detach_order_partition("2021-04", "test_detached.db")
+    try:
+        assert db_wkeys.order_partitions() == ["2021-05"]
+        assert db_wkeys.read_orders(keys[0], date(2021, 4, 2)) == []
+        detached = connect("test_detached.db")
+        rows = detached.execute(
+            "SELECT * FROM orders WHERE applying_date = '2021-04-02';"
+        ).fetchall()
+        detached.close()
+        field_names = auction_db.AuctionDbEndpoint.get_field_names("orders")
+        assert [dict(zip(field_names, r)) for r in rows] == expected
+    finally:
+        os.remove("test_detached.db")
+
+    with pytest.raises(ValueError):
+        db_wkeys.detach_order_partition("2021-04", "test_detached.db")
+
+
+def test_partitioned_is_seen_by_other_connections(db_wkeys):
+    other = auction_db.AuctionDbEndpoint("test.db", partitioned=True)
+    try:
+        assert db_wkeys.partitioned
+        db_wkeys.write_orders(keys[0], month_orders([3]))
+        assert len(other.read_orders(keys[0], date(2021, 3, 2))) == 2
+    finally:
+        other.close()
+
+
+def test_open_endpoints_see_the_partitioning(db_wkeys):
+    db_wkeys.write_orders(keys[0], month_orders([3]))
+    other = auction_db.AuctionDbEndpoint("test.db", partitioned=True)
+    try:
+        db_wkeys.write_orders(keys[0], month_orders([4]))
+        fresh = auction_db.AuctionDbEndpoint("test.db")
+        res = fresh.read_orders_bulk(None, date(2021, 1, 1),
+                                     date(2021, 12, 31))
+        fresh.close()
+        assert len(res) == 8
+        assert db_wkeys.order_partitions() == ["2021-03", "2021-04"]
+        n, = db_wkeys.execute("SELECT COUNT(*) FROM orders;").fetchone()
+        assert n == 0
+    finally:
+        other.close()
+
+
+def test_month_helpers():
+    assert partitions.month_of(date(2021, 12, 31)) == "2021-12"
+    assert partitions.month_of("2021-01-05") == "2021-01"
+    assert partitions.table_name("2021-01") == "orders_2021_01"
+    assert partitions._next_month("2021-12") == "2022-01"
+    assert partitions._next_month("2021-01") == "2021-02"
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+from prefork import PreforkServer
+from bid_api import get_app, close_app
+from fixtures import keys, db_endpoint, db_withapidata_and_keys
+from fixtures import market_index, imbalance_prices
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+import requests
+
+endpoint_name = "bids"
+
+
+def wait_until_serving(url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return requests.get(url, timeout=1)
+        except requests.ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return {int(pid) for pid in f.read().split()}
+
+
+@pytest.fixture
+def prefork_server(db_withapidata_and_keys):
+    db_withapidata_and_keys.set_durability("WAL")
+    filename = db_withapidata_and_keys.filename
+    server = PreforkServer(lambda: get_app(filename,
+                                           None,
+                                           endpoint_name,
+                                           pool_size=2,
+                                           journal_mode="WAL",
+                                           busy_timeout=10),
+                           host="127.0.0.1",
+                           port=0,
+                           workers=2,
+                           graceful_timeout=5,
+                           on_exit=close_app)
+    master = multiprocessing.get_context("fork").Process(
+        target=server.serve_forever)
+    master.start()
+    server.sock.close()  # the master keeps its own
+    url = "http://%s:%d/%s" % (*server.address, endpoint_name)
+    wait_until_serving(f"{url}/get?key=x&applying_date=2021-01-01")
+    yield master, url
+    if master.is_alive():
+        os.kill(master.pid, signal.SIGTERM)
+    master.join(10)
+
+
+def submit(url, key):
+    tomorrow = (datetime.now() + timedelta(days=2)).date().isoformat()
+    orders = [{
+        "applying_date": tomorrow,
+        "hour_ID": h,
+        "type": "BUY",
+        "volume": 1,
+        "price": 50
+    } for h in range(1, 25)]
+    return requests.post(f"{url}/set", json={"key": key, "orders": orders})
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/task"),
+                    reason="needs /proc to find the workers")
+def test_concurrent_writes_and_restart(prefork_server,
+                                       db_withapidata_and_keys):
+    master, url = prefork_server
+    old_workers = worker_pids(master.pid)
+    assert len(old_workers) == 2
+
+    with ThreadPoolExecutor(8) as executor:
+        responses = list(
+            executor.map(lambda i: submit(url, keys[i % 3]), range(32)))
+    assert all(r.status_code == 200 for r in responses)
+    assert all(r.json()["accepted"] == 24 for r in responses)
+
+    norders, = db_withapidata_and_keys.execute(
+        "SELECT COUNT(*) FROM orders;").fetchone()
+    assert norders == 32 * 24
+
+    os.kill(master.pid, signal.SIGHUP)
+    deadline = time.monotonic() + 10
+    while worker_pids(master.pid) & old_workers:
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+    assert len(worker_pids(master.pid)) == 2
+    assert submit(url, keys[0]).status_code == 200
+
+    os.kill(master.pid, signal.SIGTERM)
+    master.join(10)
+    assert master.exitcode == 0
+
+
+def test_failing_workers_are_logged_and_given_up(tmp_path):
+    logfile = tmp_path / "prefork.log"
+    logger = logging.getLogger("test_prefork")
+    handler = logging.FileHandler(logfile)
+    logger.addHandler(handler)
+
+    def make_app():
+        raise ValueError("no database")
+
+    server = PreforkServer(make_app,
+                           host="127.0.0.1",
+                           port=0,
+                           workers=1,
+                           logger=logger,
+                           backoff=0.01,
+                           max_failures=4)
+    master = multiprocessing.get_context("fork").Process(
+        target=server.serve_forever)
+    start = time.monotonic()
+    master.start()
+    server.sock.close()
+    master.join(10)
+    logger.removeHandler(handler)
+    handler.close()
+
+    assert master.exitcode == 1
+    # Waited 0.01 + 0.02 + 0.04 s between the restarts.
+    assert time.monotonic() - start >= 0.07
+    log = logfile.read_text()
+    assert log.count("ValueError: no database") == 4
+    assert "stopping" in log
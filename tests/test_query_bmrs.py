@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
 import query_bmrs as bmrs
-from datetime import datetime
+from fixtures import mid_lines, b1770_lines
+from datetime import date, datetime
+import pandas as pd
 import pytest
 
 
@@ -76,3 +78,63 @@ def test_avg_and_sum():
 def test_imbalance_prices_selected_columns():
     df = bmrs.get_imbalance_prices("2021-02-19")
     assert set(df.columns) == set(bmrs.imbalance_prices_selected_columns)
+
+
+def test_parse_market_index_lines_typed():
+    df = pd.concat(bmrs.parse_market_index_lines(mid_lines()))
+    assert df.shape == (2 * 48 * 2, 6)
+    assert list(df.columns) == bmrs.market_index_fields
+    assert df["Settlement Date"].iloc[0] == date(2021, 1, 1)
+    assert df["Settlement Period"].dtype == int
+    assert df["Price"].dtype == float
+
+
+def test_parse_market_index_lines_chunks():
+    chunks = list(bmrs.parse_market_index_lines(mid_lines(), chunksize=50))
+    assert [len(c) for c in chunks] == [50] * 3 + [42]
+
+
+def test_parse_market_index_lines_wrong_count():
+    lines = list(mid_lines())
+    lines[-1] = "FTR,1000"
+    with pytest.raises(bmrs.InvalidResponse):
+        list(bmrs.parse_market_index_lines(lines))
+
+
+def test_parse_market_index_lines_truncated():
+    lines = list(mid_lines())[:-10]
+    with pytest.raises(bmrs.InvalidResponse):
+        list(bmrs.parse_market_index_lines(lines))
+
+
+def test_parse_market_index_lines_wrong_header():
+    lines = list(mid_lines())
+    lines[0] = "HDR,SOMETHING ELSE"
+    with pytest.raises(bmrs.InvalidResponse):
+        list(bmrs.parse_market_index_lines(lines))
+
+
+def test_parse_imbalance_prices_lines():
+    df = pd.concat(bmrs.parse_imbalance_prices_lines(b1770_lines()))
+    assert df.shape == (48, 3)
+    assert list(df.columns) == bmrs.imbalance_prices_selected_columns
+    assert df["SettlementDate"].iloc[0] == date(2021, 1, 1)
+    assert df["ImbalancePriceAmount"].dtype == float
+
+
+def test_parse_imbalance_prices_lines_chunks():
+    chunks = list(
+        bmrs.parse_imbalance_prices_lines(b1770_lines(), chunksize=20))
+    assert [len(c) for c in chunks] == [20, 20, 8]
+
+
+def test_get_market_index_clean_from_stream(monkeypatch):
+    monkeypatch.setattr(bmrs, "_stream_lines",
+                        lambda url, params, session=None: mid_lines(ndays=1))
+    df_converted = bmrs.get_market_index_converted("2021-01-01")
+    assert set(df_converted.columns) == set(bmrs.market_index_clean_columns)
+    assert len(df_converted) == 48
+
+    df_clean = bmrs.get_market_index_clean("2021-01-01")
+    assert len(df_clean) == 24
+    assert df_clean["Volume"].iloc[0] == df_converted["Volume"].iloc[:2].sum()
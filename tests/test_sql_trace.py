@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+from sql_trace import SqlTracer, normalize
+from auction_db import AuctionDbEndpoint
+from fixtures import keys, pandas_orders
+
+from datetime import date, datetime
+from unittest.mock import MagicMock
+import os
+import pytest
+
+
+@pytest.fixture
+def traced_db():
+    tracer = SqlTracer(slow_threshold=0, logger=MagicMock())
+    bid_db = AuctionDbEndpoint("test.db")
+    bid_db.close()
+    bid_db = AuctionDbEndpoint("test.db", tracer=tracer)
+    yield bid_db, tracer
+    bid_db.close()
+    os.remove("test.db")
+
+
+def test_normalize():
+    assert normalize('''
+    SELECT a FROM orders
+    WHERE applying_date = '2021-02-19' AND key_id = 3 AND price > -1.5;
+    ''') == ("SELECT a FROM orders WHERE applying_date = ? AND key_id = ?"
+             " AND price > ?;")
+    assert (normalize("INSERT INTO orders VALUES (?,?, ?,?);") ==
+            "INSERT INTO orders VALUES (?, ...);")
+    assert (normalize("SELECT * FROM orders_2021_03 LIMIT 1") ==
+            "SELECT * FROM orders_2021_03 LIMIT ?")
+
+
+def test_untraced_by_default():
+    bid_db = AuctionDbEndpoint("test.db")
+    assert "execute" not in vars(bid_db)
+    bid_db.close()
+    os.remove("test.db")
+
+
+def test_aggregates_per_template(traced_db, pandas_orders):
+    bid_db, tracer = traced_db
+    bid_db.write_key(keys[0])
+    bid_db.write_orders_pandas(keys[0],
+                               pandas_orders.assign(
+                                   timestamp=datetime(2021, 2, 18, 8)))
+    for _ in range(3):
+        bid_db.read_orders(keys[0], date(2021, 2, 19))
+
+    summary = {r["template"]: r for r in tracer.summary()}
+    inserts = [r for t, r in summary.items() if "INSERT INTO orders" in t]
+    assert len(inserts) == 1
+    assert inserts[0]["rows"] == len(pandas_orders)
+    reads = [
+        r for t, r in summary.items()
+        if t.startswith("SELECT order_id") and "applying_date = ?" in t
+    ]
+    assert len(reads) == 1
+    assert reads[0]["calls"] == 3
+    assert reads[0]["rows"] == 3 * len(pandas_orders) / 2
+    assert "INSERT INTO orders" in tracer.dump()
+
+
+def test_slow_query_log_has_plan(traced_db):
+    bid_db, tracer = traced_db
+    bid_db.find_key_id(keys[0])
+    fmt, *args = tracer.logger.warning.call_args[0]
+    message = fmt % tuple(args)
+    assert "Slow query" in message
+    assert "keys_encrypted_key" in message  # the index in the plan
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import converter
+import query_bmrs as bmrs
+from timeseries import TimeSeriesStore, nperiods
+from fixtures import (
+    db_endpoint,
+    db_withapidata,
+    market_index,
+    imbalance_prices,
+)
+
+from datetime import date
+
+import numpy as np
+import pytest
+
+first_day = date(2021, 2, 19)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TimeSeriesStore(str(tmp_path), epoch=date(2021, 1, 1))
+
+
+@pytest.fixture
+def db_withstore(db_endpoint, store, market_index, imbalance_prices):
+    db_endpoint.timeseries = store
+    db_endpoint.write_market_index(market_index)
+    db_endpoint.write_imbalance_prices(imbalance_prices)
+    return db_endpoint
+
+
+def test_numpy_reads_match_database(db_withstore, store):
+    for read in ["read_market_index", "read_imbalance_prices"]:
+        db_withstore.timeseries = store
+        from_store = getattr(db_withstore, read)(first_day,
+                                                 date(2021, 2, 22),
+                                                 output="numpy")
+        db_withstore.timeseries = None
+        from_db = getattr(db_withstore, read)(first_day,
+                                              date(2021, 2, 22),
+                                              output="numpy")
+        assert from_store.keys() == from_db.keys()
+        assert not np.isnan(from_store["price"][0, :48]).any()
+        for name, values in from_db.items():
+            np.testing.assert_array_equal(from_store[name], values)
+
+
+def test_views_are_zero_copy(db_withstore, market_index):
+    res = db_withstore.read_market_index(first_day,
+                                         date(2021, 2, 21),
+                                         output="numpy")
+    prices = res["price"]
+    assert prices.shape == (2, nperiods)
+    assert not prices.flags.owndata and not prices.flags.writeable
+    assert prices[0, 0] == market_index["Price"].iloc[0]
+    # Periods not in the data are missing.
+    assert np.isnan(prices[:, 48:]).all()
+
+    # The writes are seen through the views already handed out.
+    changed = market_index.copy()
+    changed["Price"] = 1.0
+    db_withstore.write_market_index(changed)
+    assert (prices[:, :48] == 1.0).all()
+
+
+def test_store_grows_and_is_shared(db_withstore, store, tmp_path):
+    other = TimeSeriesStore(str(tmp_path))
+    assert other.epoch == store.epoch
+    before = other.read("imbalance_prices", first_day, date(2021, 3, 1))
+    assert np.isnan(before["price"][1:]).all()
+
+    df = db_withstore.read_imbalance_prices(first_day, date(2021, 2, 20))
+    df["date"] = date(2022, 5, 1)
+    df["price"] = 5.0
+    db_withstore.write_imbalance_prices(
+        df.set_axis(bmrs.imbalance_prices_selected_columns, axis=1))
+
+    res = other.read("imbalance_prices", date(2022, 5, 1), date(2022, 5, 3))
+    assert (res["price"][0, :48] == 5.0).all()
+    assert np.isnan(res["price"][1]).all()
+    # Beyond what was ever written.
+    assert np.isnan(
+        other.read("market_index", date(2030, 1, 1),
+                   date(2030, 1, 2))["price"]).all()
+
+
+def test_rebuild(db_withapidata, tmp_path):
+    db_withapidata.timeseries = TimeSeriesStore(str(tmp_path),
+                                                epoch=date(2021, 1, 1))
+    db_withapidata.rebuild_timeseries()
+    res = db_withapidata.read_market_index(first_day,
+                                           date(2021, 2, 21),
+                                           output="numpy")
+    assert not np.isnan(res["price"][:, :48]).any()
+
+
+def test_invalid(store, market_index):
+    with pytest.raises(ValueError):
+        store.read("market_index", date(2020, 1, 1), date(2021, 2, 1))
+    df = converter.convert_market_index_columns(market_index)
+    df["period"] = 51
+    with pytest.raises(ValueError):
+        store.write("market_index", df)